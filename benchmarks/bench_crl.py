@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures loading a large CRL into a
+:class:`repoze.who.plugins.x509.revocation.SerialIndex` and looking up serial
+numbers, against a ``set`` of integers and with a Bloom filter in front of the
+index.
+
+Run it from the source tree with::
+
+    python -m benchmarks.bench_crl [entries]
+"""
+
+from binascii import unhexlify
+from timeit import Timer, default_timer
+import random
+import sys
+
+from repoze.who.plugins.x509.bloom import Prefilter
+from repoze.who.plugins.x509.der import parse_crl
+from repoze.who.plugins.x509.revocation import SerialIndex
+
+
+def _element(tag, content):
+    length = len(content)
+    if length < 0x80:
+        header = bytearray([tag, length])
+    else:
+        encoded = unhexlify('%0*x' % (((len('%x' % length) + 1) // 2) * 2,
+                                      length))
+        header = bytearray([tag, 0x80 | len(encoded)]) + bytearray(encoded)
+    return bytes(header) + content
+
+
+def _integer(value):
+    hexadecimal = '%x' % value
+    encoded = unhexlify(hexadecimal.zfill(len(hexadecimal) +
+                                          len(hexadecimal) % 2))
+    if bytearray(encoded)[0] & 0x80:
+        encoded = b'\x00' + encoded
+    return _element(0x02, encoded)
+
+
+def make_crl(serials):
+    """
+    Returns the DER encoding of an (unsigned) CRL that revokes ``serials``.
+    """
+    when = _element(0x17, b'130101000000Z')
+    entries = b''.join(_element(0x30, _integer(serial) + when)
+                       for serial in serials)
+    # ecdsa-with-SHA256
+    algorithm = _element(0x30, _element(0x06,
+                                        b'\x2a\x86\x48\xce\x3d\x04\x03\x02'))
+    issuer = _element(0x30, _element(0x31, _element(
+        0x30, _element(0x06, b'\x55\x04\x03') + _element(0x0c, b'Bench'))))
+    tbs = _element(0x30, _integer(1) + algorithm + issuer + when +
+                   _element(0x30, entries))
+    return _element(0x30, tbs + algorithm + _element(0x03, b'\x00'))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    entries = int(argv[0]) if argv else 300000
+    random.seed(0)
+    # Typical serial numbers: 64 (narrow) and 128 (wide) random bits
+    serials = [random.getrandbits(63) for _ in range(entries // 2)]
+    serials += [random.getrandbits(127) for _ in range(entries - len(serials))]
+    data = make_crl(serials)
+    print('CRL: %d entries, %.1f MB' % (entries, len(data) / 1e6))
+
+    started = default_timer()
+    index = SerialIndex(parse_crl(data)['serials'])
+    print('parse and index: %.2f s' % (default_timer() - started))
+    started = default_timer()
+    revoked = set(parse_crl(data)['serials'])
+    print('parse into a set: %.2f s' % (default_timer() - started))
+    print('memory: index %.1f MB, set %.1f MB'
+          % ((index._narrow.itemsize * len(index._narrow) +
+              index._prefixes.itemsize * len(index._prefixes) +
+              len(index._wide)) / 1e6,
+             (sys.getsizeof(revoked) +
+              sum(sys.getsizeof(serial) for serial in revoked)) / 1e6))
+
+    started = default_timer()
+    prefilter = Prefilter(index, index, 0.01)
+    print('bloom filter: %.2f s, %.1f MB' % (default_timer() - started,
+                                             prefilter.filter.size / 1e6))
+
+    # Almost none of the certificates are revoked
+    probes = serials[::max(1, entries // 100)] + [
+        random.getrandbits(random.choice((63, 127))) for _ in range(10000)]
+    number = 5
+    for name, container in (('index', index), ('set', revoked),
+                            ('bloom', prefilter)):
+        best = min(Timer(lambda: [serial in container for serial in probes])
+                   .repeat(3, number))
+        print('%-6s %8.2f us/lookup' % (name, best / (number * len(probes))
+                                        * 1e6))
+
+
+if __name__ == '__main__':
+    main()
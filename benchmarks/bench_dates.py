@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares the OpenSSL validity date fast path against ``dateutil``.
+
+Run it from the source tree with::
+
+    python -m benchmarks.bench_dates
+"""
+
+from timeit import Timer
+
+from dateutil.parser import parse as date_parse
+from repoze.who.plugins.x509.utils import (parse_openssl_date,
+                                           openssl_date_to_epoch)
+
+
+DATES = ['Jan  2 15:04:05 2012 GMT', 'Dec 31 23:59:59 2030 GMT']
+
+
+def bench(function, number=20000, repeat=3):
+    """
+    Returns the best time per call (in microseconds) of ``function`` over the
+    sample dates.
+    """
+    def run():
+        for date in DATES:
+            function(date)
+    best = min(Timer(run).repeat(repeat, number))
+    return best / (number * len(DATES)) * 1e6
+
+
+def main():
+    baseline = bench(date_parse)
+    print('%-24s %8.2f us/call' % ('dateutil.parser.parse', baseline))
+    for name, function in (('parse_openssl_date', parse_openssl_date),
+                           ('openssl_date_to_epoch', openssl_date_to_epoch)):
+        elapsed = bench(function)
+        print('%-24s %8.2f us/call (%.1fx)' % (name, elapsed,
+                                               baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares :func:`parse_dn` against the previous regex-based parser (which only
+understood the OpenSSL format).
+
+Run it from the source tree with::
+
+    python -m benchmarks.bench_dn
+"""
+
+from timeit import Timer
+import re
+
+from repoze.who.plugins.x509.utils import parse_dn
+
+
+_OLD_DN_SSL_REGEX = re.compile('(/\\s*\\w+=)')
+
+
+def regex_parse_dn(dn):
+    """The parser before the single-pass scanner."""
+    parsed = {}
+    split_string = _OLD_DN_SSL_REGEX.split(dn)
+    if split_string[0] == '':
+        split_string.pop(0)
+    for i in range(0, len(split_string), 2):
+        try:
+            type_, value = split_string[i][1:-1], split_string[i + 1]
+        except IndexError:
+            raise ValueError('Invalid DN')
+        if len(value) == 0:
+            raise ValueError('Invalid DN: Invalid value')
+        if type_ not in parsed:
+            parsed[type_] = []
+        parsed[type_].append(value)
+    if len(parsed) == 0:
+        raise ValueError('Invalid DN: Empty DN')
+    return parsed
+
+
+REALISTIC = [('C', 'US'), ('ST', 'California'), ('L', 'San Francisco'),
+             ('O', 'Example Corp'), ('CN', 'John Smith'),
+             ('Email', 'john.smith@example.com')]
+LONG = ([('DC', 'com'), ('DC', 'example'), ('DC', 'corp')] +
+        [('OU', 'Unit %d' % n) for n in range(20)] + REALISTIC)
+
+DNS = [
+    ('realistic', REALISTIC),
+    ('long', LONG),
+]
+
+
+def openssl_dn(rdns):
+    return ''.join('/%s=%s' % rdn for rdn in rdns)
+
+
+def rfc4514_dn(rdns):
+    return ','.join('%s=%s' % rdn for rdn in reversed(rdns))
+
+
+def bench(function, dn, number=20000, repeat=7):
+    """
+    Returns the best time per call (in microseconds) of ``function(dn)``.
+    """
+    best = min(Timer(lambda: function(dn)).repeat(repeat, number))
+    return best / number * 1e6
+
+
+def main():
+    for name, rdns in DNS:
+        dn = openssl_dn(rdns)
+        baseline = bench(regex_parse_dn, dn)
+        elapsed = bench(parse_dn, dn)
+        print('%-10s openssl  regex %7.2f us  scanner %7.2f us (%.2fx)' % (
+            name, baseline, elapsed, baseline / elapsed))
+        elapsed = bench(parse_dn, rfc4514_dn(rdns))
+        print('%-10s rfc4514                  scanner %7.2f us' % (name,
+                                                                   elapsed))
+
+
+if __name__ == '__main__':
+    main()
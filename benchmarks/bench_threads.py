@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures how ``X509Identifier.identify`` scales when a single identifier is
+shared by many threads. With the GIL the throughput stays flat; on a
+free-threaded CPython build (``python3.13t`` and newer) it should grow with
+the threads, since ``identify`` takes no locks unless a cache or the
+instrumentation is configured.
+
+Run it from the source tree with::
+
+    python -m benchmarks.bench_threads [--threads 1,2,4,8] [--number N] [case]
+"""
+
+from optparse import OptionParser
+from timeit import default_timer
+import sys
+import threading
+
+from benchmarks.suite import CASES
+
+
+def gil_state():
+    """
+    Returns ``'enabled'``, ``'disabled'`` or ``'unknown'`` (before Python
+    3.13).
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is None:
+        return 'unknown'
+    return 'enabled' if is_gil_enabled() else 'disabled'
+
+
+def run_threads(identifier, environ, threads, number):
+    """
+    Calls ``identify`` ``number`` times in each of the threads at the same
+    time. Returns the elapsed seconds.
+    """
+    start = threading.Event()
+    identify = identifier.identify
+
+    def work():
+        start.wait()
+        for _ in range(number):
+            identify(environ)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    started = default_timer()
+    start.set()
+    for worker in workers:
+        worker.join()
+    return default_timer() - started
+
+
+def run(name='dn-only', threads=(1, 2, 4, 8), number=20000, out=None):
+    """
+    Prints the throughput and the speedup over a single thread for each number
+    of threads. Returns a list of ``(threads, calls per second)``.
+    """
+    if out is None:
+        out = sys.stdout
+    setups = dict(CASES)
+    if name not in setups:
+        raise ValueError('Unknown benchmark case: %s' % name)
+    identifier, environ = setups[name]()
+    # Warm up
+    run_threads(identifier, environ, 1, number // 10 or 1)
+
+    out.write('case: %s, GIL: %s\n' % (name, gil_state()))
+    out.write('%8s %12s %9s %11s\n' % ('threads', 'ops/sec', 'speedup',
+                                       'efficiency'))
+    results = []
+    for count in threads:
+        elapsed = run_threads(identifier, environ, count, number)
+        throughput = count * number / elapsed
+        if not results:
+            baseline = throughput
+        speedup = throughput / baseline
+        out.write('%8d %12.0f %8.2fx %10.0f%%\n' % (count, throughput, speedup,
+                                                   speedup / count * 100))
+        results.append((count, throughput))
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [case]')
+    parser.add_option('-t', '--threads', default='1,2,4,8',
+                      help='comma separated numbers of threads '
+                           '(default: %default)')
+    parser.add_option('-n', '--number', type='int', default=20000,
+                      help='calls per thread (default: %default)')
+    options, names = parser.parse_args(argv)
+    if len(names) > 1:
+        parser.error('only one case can be measured')
+    try:
+        threads = [int(count) for count in options.threads.split(',')]
+        run(names[0] if names else 'dn-only', threads, options.number)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark suite for :class:`repoze.who.plugins.x509.X509Identifier`.
+
+It measures ``identify``, ``parse_dn`` and ``verify_certificate`` over WSGI
+environments like the ones written by ``mod_ssl``. Run it from the source
+tree with either of::
+
+    python setup.py benchmark
+    python -m benchmarks.suite [--number N] [--repeat N] [case ...]
+"""
+
+from optparse import OptionParser
+from timeit import Timer
+import time
+
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.utils import (format_openssl_date, parse_dn,
+                                           verify_certificate, ISSUER_DN_KEY,
+                                           SUBJECT_DN_KEY, VERIFY_KEY,
+                                           VALIDITY_START_KEY,
+                                           VALIDITY_END_KEY)
+
+
+ISSUER = '/C=US/O=Company/CN=Issuer'
+SUBJECT_FIELDS = [('C', 'US'), ('ST', 'California'), ('L', 'San Francisco'),
+                  ('O', 'Example Corp'), ('OU', 'Engineering'),
+                  ('CN', 'John Smith'), ('Email', 'john.smith@example.com')]
+SUBJECT = ''.join('/%s=%s' % field for field in SUBJECT_FIELDS)
+SUBJECT_KEY = SUBJECT_DN_KEY
+DAY = 24 * 60 * 60
+
+
+def make_environ(issuer, subject, start=None, end=None, verified=True):
+    """
+    Returns the WSGI environment of a request with a client certificate. By
+    default it was issued a month ago and it is valid for a year.
+    """
+    now = time.time()
+    if start is None:
+        start = now - 30 * DAY
+    if end is None:
+        end = start + 365 * DAY
+    return {
+        VERIFY_KEY: 'SUCCESS' if verified else 'FAILED',
+        VALIDITY_START_KEY: format_openssl_date(start),
+        VALIDITY_END_KEY: format_openssl_date(end),
+        ISSUER_DN_KEY: issuer,
+        SUBJECT_KEY: subject,
+    }
+
+
+def _apache_fields():
+    environ = make_environ(ISSUER, SUBJECT)
+    for type_, value in SUBJECT_FIELDS:
+        environ[SUBJECT_KEY + '_' + type_] = value
+    return X509Identifier(SUBJECT_KEY), environ
+
+
+def _dn_only():
+    return X509Identifier(SUBJECT_KEY), make_environ(ISSUER, SUBJECT)
+
+
+def _dn_only_rfc4514():
+    environ = make_environ(ISSUER, SUBJECT)
+    environ[SUBJECT_KEY] = ','.join('%s=%s' % rdn
+                                    for rdn in reversed(SUBJECT_FIELDS))
+    return X509Identifier(SUBJECT_KEY), environ
+
+
+def _multiple_email():
+    environ = make_environ(
+        ISSUER,
+        '/C=US/O=Example Corp/CN=John Smith/Email=john@example.com'
+        '/Email=john.smith@example.com'
+    )
+    return X509Identifier(SUBJECT_KEY, multiple_values=True), environ
+
+
+def _multiple_email_apache_fields():
+    identifier, environ = _multiple_email()
+    environ[SUBJECT_KEY + '_Email'] = 'john@example.com'
+    environ[SUBJECT_KEY + '_Email_0'] = 'john@example.com'
+    environ[SUBJECT_KEY + '_Email_1'] = 'john.smith@example.com'
+    return identifier, environ
+
+
+def _no_validity():
+    environ = make_environ(ISSUER, SUBJECT)
+    del environ[VALIDITY_START_KEY]
+    del environ[VALIDITY_END_KEY]
+    return X509Identifier(SUBJECT_KEY), environ
+
+
+def _verify_failed():
+    environ = make_environ(ISSUER, SUBJECT, verified=False)
+    return X509Identifier(SUBJECT_KEY), environ
+
+
+def _expired():
+    end = time.time() - 5 * DAY
+    environ = make_environ(ISSUER, SUBJECT, start=end - 365 * DAY, end=end)
+    return X509Identifier(SUBJECT_KEY), environ
+
+
+CASES = [
+    ('apache-fields', _apache_fields),
+    ('dn-only', _dn_only),
+    ('dn-only-rfc4514', _dn_only_rfc4514),
+    ('multiple-email', _multiple_email),
+    ('multiple-email-fields', _multiple_email_apache_fields),
+    ('no-validity', _no_validity),
+    ('verify-failed', _verify_failed),
+    ('expired', _expired),
+]
+
+
+def measure(function, number, repeat):
+    """
+    Returns the best time (in seconds) per call of ``function``.
+    """
+    return min(Timer(function).repeat(repeat, number)) / number
+
+
+def run_case(name, setup, number, repeat):
+    """
+    Returns a list of ``(case, operation, seconds per call)`` for a case.
+    """
+    identifier, environ = setup()
+    subject = environ[SUBJECT_KEY]
+    operations = [
+        ('identify', lambda: identifier.identify(environ)),
+        ('parse_dn', lambda: parse_dn(subject)),
+        ('verify_certificate', lambda: verify_certificate(
+            environ, VERIFY_KEY, VALIDITY_START_KEY, VALIDITY_END_KEY)),
+    ]
+    return [(name, operation, measure(function, number, repeat))
+            for operation, function in operations]
+
+
+def run(names=None, number=10000, repeat=3, out=None):
+    """
+    Runs the benchmark cases (all of them if ``names`` is empty) and prints a
+    report with the operations per second and latency of each operation.
+    """
+    if out is None:
+        import sys
+        out = sys.stdout
+    unknown = set(names or ()) - set(name for name, setup in CASES)
+    if unknown:
+        raise ValueError('Unknown benchmark cases: %s' %
+                         ', '.join(sorted(unknown)))
+
+    results = []
+    out.write('%-22s %-20s %12s %12s\n' % ('case', 'operation', 'ops/sec',
+                                           'us/call'))
+    for name, setup in CASES:
+        if names and name not in names:
+            continue
+        for case, operation, elapsed in run_case(name, setup, number, repeat):
+            out.write('%-22s %-20s %12.0f %12.2f\n' % (case, operation,
+                                                       1.0 / elapsed,
+                                                       elapsed * 1e6))
+            results.append((case, operation, elapsed))
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [case ...]')
+    parser.add_option('-n', '--number', type='int', default=10000,
+                      help='calls per measurement (default: %default)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='measurements per operation, the best one is '
+                           'reported (default: %default)')
+    options, names = parser.parse_args(argv)
+    try:
+        run(names, options.number, options.repeat)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
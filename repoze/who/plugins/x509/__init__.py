@@ -21,27 +21,65 @@
 Repoze who x509 plugin. It contains support for an identifier implementation.
 """
 
-from zope.interface import implements as zope_implements
+import hashlib
+
+from zope.interface import implementer
 from repoze.who.interfaces import IIdentifier
 
+try:
+    from sys import intern
+except ImportError:
+    # Python 2
+    pass
+
+from .cache import LRUCache
+from .clock import system_clock
+from .instrumentation import (STAGE_VERIFY, STAGE_PARSE_DN,
+                              STAGE_LOGIN_VALUES, STAGE_REVOCATION,
+                              OUTCOME_IDENTIFIED, OUTCOME_NO_DN,
+                              OUTCOME_VERIFY_FAILED, OUTCOME_EXPIRED,
+                              OUTCOME_MISSING_LOGIN, OUTCOME_TOO_MANY_VALUES,
+                              OUTCOME_REVOKED, OUTCOME_ISSUER_DENIED,
+                              COUNTER_NEGATIVE_CACHE_HIT)
+from .issuers import IssuerPolicy
+from .mapping import X509Authenticator
+from .metadata import X509MetadataProvider
 from .utils import *
 
 
-__all__ = ['X509Identifier']
+__all__ = ['X509Identifier', 'X509Authenticator', 'X509MetadataProvider']
 
 
+@implementer(IIdentifier)
 class X509Identifier(object):
     """
     IIdentifier for HTTP requests with client certificates.
+
+    Its configuration cannot be changed after it is created, and it does not
+    share mutable state with other instances, so a single identifier can be
+    used by many threads without locks (only the optional caches and
+    instrumentation synchronize themselves).
     """
-    zope_implements(IIdentifier)
 
-    classifications = { IIdentifier: ['browser'] }
+    __slots__ = ('subject_dn_key', 'login_field', 'verify_key', 'start_key',
+                 'end_key', 'multiple_values', 'instrumentation', 'clock',
+                 'dn_cache', 'issuer_dn_key', 'serial_key',
+                 'identity_cache_ttl', 'identity_cache', 'negative_cache_ttl',
+                 'negative_cache', 'revocation', 'issuer_policy',
+                 'cache_namespace', '_classifications', '_login_key',
+                 '_login_value_keys', '_frozen')
 
     def __init__(self, subject_dn_key, login_field='Email',
                  multiple_values=False, verify_key=VERIFY_KEY,
                  start_key=VALIDITY_START_KEY, end_key=VALIDITY_END_KEY,
-                 classifications=None):
+                 classifications=None, dn_cache_size=None,
+                 identity_cache_size=None, identity_cache_ttl=300,
+                 issuer_dn_key=ISSUER_DN_KEY, serial_key=SERIAL_KEY,
+                 max_login_values=16, instrumentation=None,
+                 negative_cache_size=None, negative_cache_ttl=5,
+                 clock=system_clock, identity_cache=None,
+                 negative_cache=None, revocation=None, allowed_issuers=None,
+                 denied_issuers=None, cache_namespace=None):
         """
         :param subject_dn_key: The WSGI environment key for the subject
             distinguished name (it also works as the base for the server
@@ -57,7 +95,68 @@ class X509Identifier(object):
         :param end_key: The WSGI environment key with the encoded datetime of
             the end of the validity range.
         :param classifications: The ``repoze.who`` classifications for this
-            identifier (used with the classifier).
+            identifier (used with the classifier). By default it is
+            ``['browser']``.
+        :param dn_cache_size: If given, the parsed subject distinguished names
+            are kept in a LRU cache of this size (see
+            :class:`repoze.who.plugins.x509.utils.CachedDNParser`).
+        :param identity_cache_size: If given, the credentials of verified
+            certificates are kept in a LRU cache of this size, so the
+            following requests with the same certificate are not verified nor
+            parsed again.
+        :param identity_cache_ttl: The maximum number of seconds that the
+            credentials are kept in the identity cache. They never outlive the
+            end of the validity range of the certificate.
+        :param issuer_dn_key: The WSGI environment key for the issuer
+            distinguished name (part of the identity cache key).
+        :param serial_key: The WSGI environment key for the serial number of
+            the certificate (part of the identity cache key). A fingerprint
+            variable (e.g., Nginx's ``$ssl_client_fingerprint``) also works.
+        :param max_login_values: The number of server variables for multiple
+            values of ``login_field`` (e.g., ``SSL_CLIENT_S_DN_Email_0``) whose
+            names are computed beforehand. More values are still read, only
+            slower.
+        :param instrumentation: Optional
+            :class:`repoze.who.plugins.x509.instrumentation.Instrumentation`
+            that counts the outcomes of ``identify`` and times its stages.
+        :param negative_cache_size: If given, the certificates that failed the
+            verification or that are outside of their validity range are kept
+            in a LRU cache of this size, so their retries are rejected without
+            checking them again.
+        :param negative_cache_ttl: The number of seconds that a rejected
+            certificate is kept in the negative cache.
+        :param clock: Function that returns the current time in seconds since
+            the epoch, used for the validity range and the caches (see
+            :mod:`repoze.who.plugins.x509.clock`).
+        :param identity_cache: The identity cache to use instead of creating a
+            LRU cache of ``identity_cache_size`` (e.g., a
+            :class:`repoze.who.plugins.x509.cache.SharedMemoryCache` shared
+            by every worker process, or a
+            :class:`repoze.who.plugins.x509.cache.MemcachedCache` shared by
+            every host).
+        :param negative_cache: The negative cache to use instead of creating
+            a LRU cache of ``negative_cache_size``.
+        :param revocation: Optional
+            :class:`repoze.who.plugins.x509.revocation.RevocationChecker` (or
+            :class:`repoze.who.plugins.x509.ocsp.OCSPChecker`) that
+            rejects the revoked certificates (by their issuer and serial
+            number, so ``serial_key`` must have the serial number), even when
+            their credentials are in the identity cache.
+        :param allowed_issuers: If given, only the certificates of these
+            issuers (distinguished names in any format) are accepted. The
+            issuer is read from ``issuer_dn_key``.
+        :param denied_issuers: The certificates of these issuers are
+            rejected, even if they are also allowed (see
+            :class:`repoze.who.plugins.x509.issuers.IssuerPolicy`).
+        :param cache_namespace: The string that the keys of this identifier
+            start with in the identity and negative caches. By default it is
+            a fingerprint of the configuration (the WSGI environment keys,
+            ``login_field``, ``multiple_values`` and the issuers), so the
+            identifiers that share a cache only share the entries when they
+            would compute the same credentials. Give a different one to the
+            identifiers that only differ in their ``revocation`` checker.
+
+        :raise ValueError: When one of the issuer names is invalid.
         """
         self.subject_dn_key = subject_dn_key
         self.login_field = login_field
@@ -65,8 +164,84 @@ class X509Identifier(object):
         self.start_key = start_key
         self.end_key = end_key
         self.multiple_values = multiple_values
-        if classifications is not None:
-            self.classifications[IIdentifier] = classifications
+        self.instrumentation = instrumentation
+        self.clock = clock
+        self.revocation = revocation
+        if allowed_issuers is not None or denied_issuers:
+            self.issuer_policy = IssuerPolicy(allowed_issuers,
+                                              denied_issuers or ())
+        else:
+            self.issuer_policy = None
+        # The server variables that we look for in every request
+        self._login_key = intern(subject_dn_key + '_' + login_field)
+        self._login_value_keys = tuple(
+            intern(self._login_key + '_' + str(n))
+            for n in range(max_login_values)
+        )
+        if dn_cache_size is not None:
+            self.dn_cache = CachedDNParser(dn_cache_size)
+        else:
+            self.dn_cache = None
+        self.issuer_dn_key = issuer_dn_key
+        self.serial_key = serial_key
+        if cache_namespace is None:
+            cache_namespace = self._fingerprint()
+        self.cache_namespace = cache_namespace
+        self.identity_cache_ttl = identity_cache_ttl
+        if identity_cache is not None or identity_cache_size is not None:
+            if identity_cache_ttl <= 0:
+                raise ValueError('The identity cache TTL must be positive')
+            if identity_cache is None:
+                identity_cache = LRUCache(identity_cache_size, clock)
+            self.identity_cache = identity_cache
+        else:
+            self.identity_cache = None
+        self.negative_cache_ttl = negative_cache_ttl
+        if negative_cache is not None or negative_cache_size is not None:
+            if negative_cache_ttl <= 0:
+                raise ValueError('The negative cache TTL must be positive')
+            if negative_cache is None:
+                negative_cache = LRUCache(negative_cache_size, clock)
+            self.negative_cache = negative_cache
+        else:
+            self.negative_cache = None
+        if classifications is None:
+            classifications = _DEFAULT_CLASSIFICATIONS
+        # A dictionary of each instance (repoze.who's configuration loader
+        # sets the classifications given in the INI files on it)
+        self._classifications = {IIdentifier: tuple(classifications)}
+        self._frozen = True
+
+    def _fingerprint(self):
+        """
+        Returns the default cache namespace, which is the same in every
+        process with the same configuration.
+        """
+        policy = self.issuer_policy
+        config = (self.subject_dn_key, self.login_field,
+                  bool(self.multiple_values), self.verify_key, self.start_key,
+                  self.end_key, self.issuer_dn_key, self.serial_key,
+                  policy and policy.allowed, policy and policy.denied)
+        digest = hashlib.sha1(repr(config).encode('utf-8')).hexdigest()
+        return 'x509-identity:' + digest[:16]
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('The configuration of %s cannot be modified'
+                                 % self.__class__.__name__)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError('The configuration of %s cannot be modified' %
+                             self.__class__.__name__)
+
+    @property
+    def classifications(self):
+        """
+        The ``repoze.who`` classifications of this identifier. The dictionary
+        belongs to this instance.
+        """
+        return self._classifications
 
     # IIdentifier
     def identify(self, environ):
@@ -76,50 +251,245 @@ class X509Identifier(object):
         :param environ: The WSGI environment.
         """
         subject_dn = environ.get(self.subject_dn_key)
-        if subject_dn is None or not verify_certificate(
+        if subject_dn is None:
+            self._count(OUTCOME_NO_DN)
+            return None
+        if self.identity_cache is None and self.negative_cache is None:
+            outcome, creds = self._identify(environ, subject_dn)
+            self._count(outcome)
+            return creds
+
+        verified = environ.get(self.verify_key)
+        cache_key = (self.cache_namespace,
+                     subject_dn,
+                     environ.get(self.issuer_dn_key),
+                     environ.get(self.serial_key),
+                     environ.get(self.start_key),
+                     environ.get(self.end_key))
+        # The identity cache does not replace the check of the verification
+        # made by the server for this connection.
+        if verified == 'SUCCESS' and self.identity_cache is not None:
+            creds = self.identity_cache.get(cache_key)
+            if creds is not None:
+                # The cache may be shared with identifiers of other issuers
+                if (self.issuer_policy is not None and
+                        not self.issuer_policy.allows(cache_key[2])):
+                    self._count(OUTCOME_ISSUER_DENIED)
+                    return None
+                if self.revocation is not None and self._is_revoked(environ):
+                    self._count(OUTCOME_REVOKED)
+                    return None
+                self._count(OUTCOME_IDENTIFIED)
+                return _copy_creds(creds)
+        if self.negative_cache is not None:
+            negative_key = (verified,) + cache_key
+            outcome = self.negative_cache.get(negative_key)
+            if outcome is not None:
+                self._count(COUNTER_NEGATIVE_CACHE_HIT)
+                self._count(outcome)
+                return None
+
+        outcome, creds = self._identify(environ, subject_dn)
+        self._count(outcome)
+        if creds is not None:
+            if self.identity_cache is not None:
+                self._cache_identity(cache_key, creds)
+        elif (self.negative_cache is not None and
+              outcome in _NEGATIVE_OUTCOMES):
+            self.negative_cache.set(negative_key, outcome,
+                                    self.clock() + self.negative_cache_ttl)
+        return creds
+
+    def _count(self, outcome):
+        if self.instrumentation is not None:
+            self.instrumentation.count(outcome)
+
+    def _cache_identity(self, cache_key, creds):
+        expires = self.clock() + self.identity_cache_ttl
+        validity_end = cache_key[-1]
+        if validity_end is not None:
+            try:
+                expires = min(expires, openssl_date_to_epoch(validity_end))
+            except ValueError:
+                # Without a known end of the validity range it is not safe to
+                # cache the credentials.
+                return
+        self.identity_cache.set(cache_key, _copy_creds(creds), expires)
+
+    def identify_many(self, environs, now=None, batch_cache_size=1024):
+        """
+        Gets the credentials of many requests (e.g., to replay recorded
+        requests). It is a generator that yields the credentials (or ``None``)
+        of each WSGI environment in order, so the environments can be read as
+        they are needed.
+
+        All of them are checked against the same time, and the results for
+        repeated distinguished names and validity ranges are reused within the
+        batch. The identity and negative caches are not used.
+
+        :param environs: An iterable of WSGI environments.
+        :param now: The time (in seconds since the epoch) used to check the
+            validity ranges. By default it is read once from the clock when the
+            batch starts.
+        :param batch_cache_size: How many distinct distinguished names and
+            validity ranges are remembered during the batch.
+        """
+        if now is None:
+            now = self.clock()
+        clock = lambda: now
+        statuses = LRUCache(batch_cache_size)
+        policy = self.issuer_policy
+        dn_cache = self.dn_cache
+        if dn_cache is None:
+            dn_cache = CachedDNParser(batch_cache_size)
+
+        for environ in environs:
+            subject_dn = environ.get(self.subject_dn_key)
+            if subject_dn is None:
+                self._count(OUTCOME_NO_DN)
+                yield None
+                continue
+
+            validity = (environ.get(self.verify_key),
+                        environ.get(self.start_key),
+                        environ.get(self.end_key))
+            status = statuses.get(validity)
+            if status is None:
+                status = self._check_certificate(environ, clock)
+                statuses.set(validity, status)
+            if (status == CERTIFICATE_VALID and policy is not None and
+                    not policy.allows(environ.get(self.issuer_dn_key))):
+                status = CERTIFICATE_ISSUER_DENIED
+            if (status == CERTIFICATE_VALID and self.revocation is not None
+                    and self._is_revoked(environ)):
+                status = CERTIFICATE_REVOKED
+            if status == CERTIFICATE_VALID:
+                outcome, creds = self._credentials(environ, subject_dn,
+                                                   dn_cache)
+            else:
+                outcome, creds = _STATUS_OUTCOMES[status], None
+            self._count(outcome)
+            yield creds
+
+    def _identify(self, environ, subject_dn):
+        """
+        Verifies the certificate and gets the credentials. Returns the outcome
+        (see :mod:`repoze.who.plugins.x509.instrumentation`) and the
+        credentials (``None`` unless it was identified).
+        """
+        status = self._check_certificate(environ, self.clock)
+        if status != CERTIFICATE_VALID:
+            return _STATUS_OUTCOMES[status], None
+        policy = self.issuer_policy
+        if (policy is not None and
+                not policy.allows(environ.get(self.issuer_dn_key))):
+            return OUTCOME_ISSUER_DENIED, None
+        if self.revocation is not None and self._is_revoked(environ):
+            return OUTCOME_REVOKED, None
+        return self._credentials(environ, subject_dn, self.dn_cache)
+
+    def _check_certificate(self, environ, clock):
+        stats = self.instrumentation
+        if stats is None:
+            return check_certificate(
+                environ,
+                self.verify_key,
+                self.start_key,
+                self.end_key,
+                clock=clock
+            )
+
+        started = stats.timer()
+        status = check_certificate(
             environ,
             self.verify_key,
             self.start_key,
-            self.end_key
-        ):
-            return None
+            self.end_key,
+            stats,
+            clock
+        )
+        stats.timing(STAGE_VERIFY, stats.timer() - started)
+        return status
 
+    def _is_revoked(self, environ):
+        stats = self.instrumentation
+        if stats is None:
+            return self.revocation.is_revoked(environ.get(self.issuer_dn_key),
+                                              environ.get(self.serial_key))
+        started = stats.timer()
+        revoked = self.revocation.is_revoked(environ.get(self.issuer_dn_key),
+                                             environ.get(self.serial_key))
+        stats.timing(STAGE_REVOCATION, stats.timer() - started)
+        return revoked
+
+    def _credentials(self, environ, subject_dn, dn_cache):
+        """
+        Gets the credentials of a request with a valid certificate. Returns
+        the outcome and the credentials, like :meth:`_identify`.
+        """
+        stats = self.instrumentation
         creds = {'subject': subject_dn }
         # First let's try with Apache-like var name, if None then parse the DN
-        key = self.subject_dn_key + '_' + self.login_field
-        login = environ.get(key)
+        login = environ.get(self._login_key)
         if login is None:
+            if stats is not None:
+                started = stats.timer()
             try:
-                login = parse_dn(subject_dn)[self.login_field]
-            except:
+                login = self._find_login(subject_dn, dn_cache)
+            except ValueError:
                 login = None
+            if stats is not None:
+                stats.timing(STAGE_PARSE_DN, stats.timer() - started)
         else:
-            values = []
-            try:
-                n = 0
-                while True:
-                    values.append(environ[key + '_' + str(n)])
-                    n += 1
-            except KeyError:
-                pass
-            
-            if n == 0:
+            if stats is not None:
+                started = stats.timer()
+            values = self._login_values(environ)
+            if stats is not None:
+                stats.timing(STAGE_LOGIN_VALUES, stats.timer() - started)
+            if len(values) == 0:
                 login = [login]
             else:
                 login = values
-                
 
         if login is None:
-            return None
+            return OUTCOME_MISSING_LOGIN, None
 
         if not self.multiple_values and len(login) > 1:
-            return None
+            return OUTCOME_TOO_MANY_VALUES, None
         elif not self.multiple_values:
             creds['login'] = login[0]
         else:
-            creds['login'] = login
+            creds['login'] = list(login)
 
-        return creds
+        return OUTCOME_IDENTIFIED, creds
+
+    def _find_login(self, subject_dn, dn_cache):
+        """
+        Gets the values of the login field from the subject distinguished name
+        (``None`` if there are none).
+        """
+        if dn_cache is not None:
+            return dn_cache(subject_dn).get(self.login_field)
+        return find_dn_attribute(subject_dn, self.login_field) or None
+
+    def _login_values(self, environ):
+        """
+        Gets the multiple values of the login field from the server variables
+        (``<key>_0``, ``<key>_1``, ...).
+        """
+        get = environ.get
+        values = []
+        for key in self._login_value_keys:
+            value = get(key)
+            if value is None:
+                return values
+            values.append(value)
+
+        while True:
+            value = get(self._login_key + '_' + str(len(values)))
+            if value is None:
+                return values
+            values.append(value)
 
     # IIdentifier
     def forget(self, environ, identity):
@@ -137,3 +507,29 @@ class X509Identifier(object):
         # We always remember as it is provided by the server
         return None
 
+
+_DEFAULT_CLASSIFICATIONS = ('browser',)
+
+
+# The outcomes that are remembered by the negative cache
+_NEGATIVE_OUTCOMES = frozenset([OUTCOME_VERIFY_FAILED, OUTCOME_EXPIRED,
+                                OUTCOME_REVOKED, OUTCOME_ISSUER_DENIED])
+
+# The outcome of a certificate that is not valid
+_STATUS_OUTCOMES = {
+    CERTIFICATE_NOT_VERIFIED: OUTCOME_VERIFY_FAILED,
+    CERTIFICATE_INVALID_DATES: OUTCOME_VERIFY_FAILED,
+    CERTIFICATE_EXPIRED: OUTCOME_EXPIRED,
+    CERTIFICATE_REVOKED: OUTCOME_REVOKED,
+    CERTIFICATE_ISSUER_DENIED: OUTCOME_ISSUER_DENIED,
+}
+
+
+def _copy_creds(creds):
+    # repoze.who modifies the identity, so the cached credentials are never
+    # given away.
+    copy = dict(creds)
+    if isinstance(copy.get('login'), list):
+        copy['login'] = list(copy['login'])
+    return copy
+
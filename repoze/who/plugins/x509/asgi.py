@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+ASGI middleware that identifies the clients with the certificates given by
+the server through the ``tls`` extension of the connection scope (Python 3.5
+or newer).
+
+The certificate is turned into the server variables that
+:class:`repoze.who.plugins.x509.X509Identifier` reads, so it is checked like
+any other request, and the credentials are stored in the scope for the
+application::
+
+    identifier = X509Identifier('SSL_CLIENT_S_DN', login_field='CN')
+    app = X509Middleware(app, identifier, checks=[blocking(check_revoked)])
+
+    # In the application
+    creds = scope['x509.identity']
+"""
+
+import asyncio
+import inspect
+from functools import partial
+
+from . import X509Identifier, _copy_creds
+from .cache import LRUCache
+from .der import DERError, parse_certificate, pem_to_der
+from .utils import format_openssl_date, openssl_date_to_epoch
+
+
+__all__ = ['X509Middleware', 'tls_environ', 'blocking']
+
+# The scope types that carry a connection with a client
+_SCOPE_TYPES = frozenset(['http', 'websocket'])
+_MISSING = object()
+
+
+def tls_environ(tls, identifier):
+    """
+    Returns the server variables (with the keys used by ``identifier``) of
+    the client certificate in the ``tls`` extension of an ASGI scope.
+
+    The subject is ``client_cert_name`` (:rfc:`4514`) when the server gives
+    it, otherwise it is read from the certificate, like the issuer, serial
+    number and validity range. The certificate is verified when the server
+    reports no ``client_cert_error``.
+
+    :param tls: The ``tls`` extension of the scope.
+    :param identifier: The :class:`X509Identifier`.
+    """
+    chain = tls.get('client_cert_chain') or ()
+    environ = {}
+    if not chain:
+        environ[identifier.verify_key] = 'NONE'
+        return environ
+
+    error = tls.get('client_cert_error')
+    try:
+        certificate = parse_certificate(pem_to_der(chain[0]))
+    except DERError:
+        certificate = None
+        if error is None:
+            error = 'invalid certificate'
+    environ[identifier.verify_key] = ('SUCCESS' if error is None else
+                                      'FAILED:' + error)
+
+    subject = tls.get('client_cert_name')
+    if certificate is not None:
+        if subject is None:
+            subject = certificate['subject']
+        environ[identifier.issuer_dn_key] = certificate['issuer']
+        environ[identifier.serial_key] = '%X' % certificate['serial']
+        environ[identifier.start_key] = format_openssl_date(
+            certificate['not_before'])
+        environ[identifier.end_key] = format_openssl_date(
+            certificate['not_after'])
+    if subject is not None:
+        environ[identifier.subject_dn_key] = subject
+    return environ
+
+
+def blocking(function):
+    """
+    Wraps a blocking check (e.g., one that queries a database) so the
+    middleware runs it in the default executor of the event loop instead of
+    in the loop itself.
+    """
+    async def check(creds, scope):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, partial(function, creds,
+                                                        scope))
+    return check
+
+
+class X509Middleware(object):
+    """
+    ASGI middleware that stores the credentials of the client certificate (or
+    ``None``) in the scope of every HTTP and WebSocket connection.
+
+    The connections reuse the TLS session for many requests, so the result of
+    the identifier is cached for each client address and certificate. The
+    ``checks`` run for every request, since they may depend on its scope.
+    """
+
+    def __init__(self, app, identifier, scope_key='x509.identity', checks=(),
+                 connection_cache_size=1024, connection_cache_ttl=60,
+                 identify_in_executor=False):
+        """
+        :param app: The ASGI application.
+        :param identifier: The :class:`X509Identifier` that checks the
+            certificates.
+        :param scope_key: The key of the scope where the credentials are
+            stored.
+        :param checks: Functions that are called in order with the
+            credentials and the scope after identifying the client (e.g.,
+            revocation checks or user mappings). Each one returns the
+            credentials to use (``None`` rejects the client), or an awaitable
+            of them. Wrap the blocking ones with :func:`blocking`.
+        :param connection_cache_size: The number of connections whose
+            identifier results are remembered (``None`` disables the cache).
+        :param connection_cache_ttl: The maximum number of seconds that a
+            result is remembered. It never outlives the validity range of the
+            certificate.
+        :param identify_in_executor: Run ``identify`` in the default executor
+            (when the identifier uses a cache over the network).
+        """
+        if not isinstance(identifier, X509Identifier):
+            raise TypeError('An X509Identifier is required')
+        self.app = app
+        self.identifier = identifier
+        self.scope_key = scope_key
+        self.checks = tuple(checks)
+        self.connection_cache_ttl = connection_cache_ttl
+        if connection_cache_size is not None:
+            self.connection_cache = LRUCache(connection_cache_size,
+                                             identifier.clock)
+        else:
+            self.connection_cache = None
+        self.identify_in_executor = identify_in_executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in _SCOPE_TYPES:
+            scope = dict(scope)
+            scope[self.scope_key] = await self.identify(scope)
+        await self.app(scope, receive, send)
+
+    async def identify(self, scope):
+        """
+        Returns the credentials of the client of a connection scope (``None``
+        if it could not be identified).
+        """
+        tls = (scope.get('extensions') or {}).get('tls')
+        if tls is None:
+            return None
+        chain = tls.get('client_cert_chain') or ()
+        key = (tuple(scope.get('client') or ()), chain[0] if chain else None,
+               tls.get('client_cert_name'), tls.get('client_cert_error'))
+        cache = self.connection_cache
+        creds = _MISSING
+        if cache is not None:
+            creds = cache.get(key, _MISSING)
+            if creds is not _MISSING and creds is not None:
+                creds = _copy_creds(creds)
+
+        if creds is _MISSING:
+            environ = tls_environ(tls, self.identifier)
+            if self.identify_in_executor:
+                loop = asyncio.get_event_loop()
+                creds = await loop.run_in_executor(
+                    None, self.identifier.identify, environ)
+            else:
+                creds = self.identifier.identify(environ)
+            if cache is not None:
+                expires = self.identifier.clock() + self.connection_cache_ttl
+                end = environ.get(self.identifier.end_key)
+                if end is not None:
+                    expires = min(expires, openssl_date_to_epoch(end))
+                cache.set(key, creds, expires)
+                if creds is not None:
+                    creds = _copy_creds(creds)
+
+        # The checks may depend on the scope (e.g., its path), so they are
+        # not cached.
+        for check in self.checks:
+            if creds is None:
+                break
+            creds = check(creds, scope)
+            if inspect.isawaitable(creds):
+                creds = await creds
+        return creds
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Bloom filters, to answer quickly that a key is not in a set (e.g., that a
+serial number is not revoked) before looking it up in the exact index or
+backend.
+"""
+
+from math import ceil, log
+from threading import Lock
+
+
+__all__ = ['BloomFilter', 'Prefilter']
+
+# Makes the second hash of a key independent of the first one
+_SALT = 0x5bd1e995
+
+
+class BloomFilter(object):
+    """
+    A set that may answer that it contains a key that was never added (with
+    the configured probability), but never that it does not contain an added
+    key.
+
+    It uses the built-in ``hash`` of the keys, so it is only valid inside the
+    process that built it.
+    """
+
+    __slots__ = ('capacity', 'error_rate', 'bits', 'hashes', '_bits', 'count')
+
+    def __init__(self, capacity, error_rate=0.01, keys=()):
+        """
+        :param capacity: The expected number of keys. More keys can be added,
+            but the false positive rate grows.
+        :param error_rate: The false positive rate for ``capacity`` keys.
+        :param keys: The initial keys.
+
+        :raise ValueError: When the error rate is not between 0 and 1.
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError('The error rate must be between 0 and 1')
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) * log(2))))
+        self._bits = bytearray((self.bits + 7) // 8)
+        self.count = 0
+        for key in keys:
+            self.add(key)
+
+    def _positions(self, key):
+        # Double hashing: the positions are h1 + i * h2 (modulo the size)
+        size = self.bits
+        position = hash(key) % size
+        step = hash((key, _SALT)) % size or 1
+        for _ in range(self.hashes):
+            yield position
+            position += step
+            if position >= size:
+                position -= size
+
+    def add(self, key):
+        """
+        Adds a key.
+        """
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        # The same positions as _positions, inlined as this is the hot path
+        size = self.bits
+        bits = self._bits
+        position = hash(key) % size
+        step = hash((key, _SALT)) % size or 1
+        for _ in range(self.hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+            if position >= size:
+                position -= size
+        return True
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def size(self):
+        """
+        The memory used by the bits, in bytes.
+        """
+        return len(self._bits)
+
+
+class Prefilter(object):
+    """
+    A :class:`BloomFilter` in front of an exact membership test, which is only
+    used for the keys that the filter reports. It counts the ``checks``, the
+    ``positives`` of the filter and how many of them were ``false_positives``.
+
+    It only saves time when the exact test is slower than the filter (e.g., a
+    backend in another process or host). In front of an in-memory index,
+    like :class:`repoze.who.plugins.x509.revocation.SerialIndex`, the lookups
+    are not faster (``python -m benchmarks.bench_crl``).
+    """
+
+    def __init__(self, keys, exact=None, error_rate=0.01):
+        """
+        :param keys: The keys of the set (an iterable that can be read once,
+            or a sized collection).
+        :param exact: Any object that supports ``in`` for the exact test
+            (e.g., an index or a backend). By default it is a ``frozenset`` of
+            ``keys``.
+        :param error_rate: The false positive rate of the filter.
+        """
+        if exact is None:
+            keys = exact = frozenset(keys)
+        elif not hasattr(keys, '__len__'):
+            keys = list(keys)
+        self.exact = exact
+        self.filter = BloomFilter(len(keys), error_rate, keys)
+        self.checks = 0
+        self.positives = 0
+        self.false_positives = 0
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        if key not in self.filter:
+            with self._lock:
+                self.checks += 1
+            return False
+        found = key in self.exact
+        with self._lock:
+            self.checks += 1
+            self.positives += 1
+            if not found:
+                self.false_positives += 1
+        return found
+
+    def __len__(self):
+        return len(self.filter)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``keys``, the ``size`` of the
+        filter (in bytes), its ``error_rate`` and the ``checks``,
+        ``positives`` and ``false_positives`` counters.
+        """
+        with self._lock:
+            return {
+                'keys': len(self.filter),
+                'size': self.filter.size,
+                'error_rate': self.filter.error_rate,
+                'checks': self.checks,
+                'positives': self.positives,
+                'false_positives': self.false_positives
+            }
@@ -0,0 +1,831 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Caches used by the repoze who x509 plugin.
+
+Every cache implements the interface of :class:`CacheBackend`, so any of them
+can keep the parsed distinguished names, the verified identities or the
+rejected certificates:
+
+* :class:`LRUCache`: inside the process.
+* :class:`SharedMemoryCache`: shared by the processes of a host.
+* :class:`MemcachedCache`: shared by the hosts, in memcached servers.
+"""
+
+from binascii import hexlify
+from collections import OrderedDict
+from threading import Lock
+import fcntl
+import hashlib
+import hmac
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+
+__all__ = ['CacheBackend', 'LRUCache', 'SharedMemoryCache', 'MemcachedCache',
+           'MemcachedError']
+
+_MISSING = object()
+
+
+def _key_digest(key):
+    """
+    Returns the SHA-256 digest of a key, the same in every process.
+    """
+    return hashlib.sha256(repr(key).encode('utf-8')).digest()
+
+
+class CacheBackend(object):
+    """
+    The interface of the caches. The keys are tuples of strings (or
+    ``None``), or strings, and the values are picklable. Every entry may have
+    an expiration time, in seconds since the epoch.
+
+    The bulk operations are implemented with the single ones, the backends
+    override them when they can do better (e.g., in one network round trip).
+    """
+
+    hits = 0
+    misses = 0
+
+    def get(self, key, default=None):
+        """
+        Gets the value stored for ``key`` (``default`` if it is not cached).
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, expires=None):
+        """
+        Stores ``value`` for ``key`` until ``expires`` (forever by default).
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache (if present).
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Returns a dictionary with (at least) the ``hits`` and ``misses``.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the cached values of ``keys`` (the missing
+        keys are not included).
+
+        :param keys: An iterable of keys.
+        """
+        values = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                values[key] = value
+        return values
+
+    def set_many(self, items, expires=None):
+        """
+        Stores many values with the same expiration time.
+
+        :param items: A dictionary (or an iterable of pairs) of keys and
+            values.
+        :param expires: The time (in seconds since the epoch) when the entries
+            stop being valid. By default they never expire.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        for key, value in items:
+            self.set(key, value, expires)
+
+
+class LRUCache(CacheBackend):
+    """
+    A bounded, thread-safe mapping that evicts the least recently used entry
+    when it is full. Entries may also have an expiration time. It keeps count
+    of its hits and misses.
+    """
+
+    def __init__(self, maxsize=1024, timer=time.time):
+        """
+        :param maxsize: The maximum number of entries kept in the cache.
+        :param timer: Function that returns the current time (in seconds since
+            the epoch) used to check the expiration of the entries.
+
+        :raise ValueError: When ``maxsize`` is not a positive number.
+        """
+        if maxsize <= 0:
+            raise ValueError('The cache size must be a positive number')
+        self.maxsize = maxsize
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Gets the value stored for ``key`` and marks it as the most recently
+        used entry.
+
+        :param key: The key of the entry.
+        :param default: The value returned when ``key`` is not cached.
+        """
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is _MISSING or (entry[1] is not None and
+                                     entry[1] <= self.timer()):
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires=None):
+        """
+        Stores ``value`` for ``key``, evicting the least recently used entry if
+        the cache is full.
+
+        :param key: The key of the entry.
+        :param value: The value to store.
+        :param expires: The time (in seconds since the epoch) when the entry
+            stops being valid. By default it never expires.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the cached values of ``keys`` (see
+        :meth:`CacheBackend.get_many`), taking the lock only once.
+        """
+        values = {}
+        with self._lock:
+            now = None
+            for key in keys:
+                entry = self._data.pop(key, _MISSING)
+                if entry is not _MISSING and entry[1] is not None:
+                    if now is None:
+                        now = self.timer()
+                    if entry[1] <= now:
+                        entry = _MISSING
+                if entry is _MISSING:
+                    self.misses += 1
+                    continue
+                self._data[key] = entry
+                self.hits += 1
+                values[key] = entry[0]
+        return values
+
+    def set_many(self, items, expires=None):
+        """
+        Stores many values (see :meth:`CacheBackend.set_many`), taking the
+        lock only once.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        with self._lock:
+            for key, value in items:
+                self._data.pop(key, None)
+                self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache (if present).
+
+        :param key: The key of the entry.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the ``hits``, ``misses``, current ``size``
+        and ``maxsize`` of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and (entry[1] is None or
+                                      entry[1] > self.timer())
+
+
+# Layout of the file of SharedMemoryCache: a header followed by the slots of
+# every shard. Each slot has its state, the length of the pickled value, the
+# expiration time and the digest of the key, followed by the value.
+_SHM_MAGIC = b'X509SHM1'
+_SHM_HEADER = struct.Struct('<8sIII')
+_SHM_SLOT = struct.Struct('<BxHd32s')
+_SHM_MAX_VALUE = 0xFFFF
+_SLOT_EMPTY = 0
+_SLOT_USED = 1
+_SLOT_DELETED = 2
+_NEVER = float('inf')
+
+
+class SharedMemoryCache(CacheBackend):
+    """
+    A fixed-size hash table in a memory-mapped file, shared by every process
+    that opens the same file (e.g., the workers of a prefork server), so they
+    all use one warm cache.
+
+    The table uses open addressing with linear probing inside a number of
+    shards. Each shard is protected by a ``fcntl`` lock (between processes)
+    and a thread lock (inside a process), so readers of a shard do not block
+    the readers of another one. When the probed slots are full, the entry that
+    expires first is evicted; the memory used never grows.
+
+    The keys are stored as their SHA-256 digests and the values are pickled,
+    so the file must only be writable by the user of the application (it is
+    created with mode ``0600``). Values that do not fit in a slot are not
+    cached. The ``hits`` and ``misses`` are counted per process.
+
+    Use a single instance per file in each process: ``fcntl`` locks do not
+    exclude each other inside a process, and closing any descriptor of the
+    file releases all of them.
+
+    It has the same interface as :class:`LRUCache`, so it can be given to
+    :class:`repoze.who.plugins.x509.X509Identifier` as its ``identity_cache``.
+    """
+
+    def __init__(self, path=None, maxsize=4096, slot_size=512, shards=64,
+                 max_probes=32, timer=time.time):
+        """
+        :param path: The file shared by the processes. It is created if it
+            does not exist. If not given, an anonymous temporary file is used,
+            which is only shared with the processes forked after creating the
+            cache (e.g., by a server that loads the application before
+            forking).
+        :param maxsize: The minimum number of slots of the table.
+        :param slot_size: The size in bytes of each slot (including its
+            header of 44 bytes), at most 65579.
+        :param shards: The number of independently locked parts of the table.
+        :param max_probes: The maximum number of slots probed for a key.
+        :param timer: Function that returns the current time (in seconds since
+            the epoch) used to check the expiration of the entries.
+
+        :raise ValueError: When the sizes are not valid or when the existing
+            file was created with a different layout.
+        """
+        if maxsize <= 0 or shards <= 0 or max_probes <= 0:
+            raise ValueError('The cache sizes must be positive numbers')
+        if slot_size <= _SHM_SLOT.size:
+            raise ValueError('The slots must be larger than %d bytes' %
+                             _SHM_SLOT.size)
+        if slot_size > _SHM_MAX_VALUE + _SHM_SLOT.size:
+            raise ValueError('The slots must not be larger than %d bytes' %
+                             (_SHM_MAX_VALUE + _SHM_SLOT.size))
+        shards = min(shards, maxsize)
+        self.shards = shards
+        self.shard_size = -(-maxsize // shards)
+        self.maxsize = self.shards * self.shard_size
+        self.slot_size = slot_size
+        self.max_probes = min(max_probes, self.shard_size)
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.path = path
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._file = os.fdopen(fd, 'r+b')
+        self._fd = self._file.fileno()
+        length = _SHM_HEADER.size + self.maxsize * slot_size
+        try:
+            self._init_file(length)
+        except Exception:
+            self._file.close()
+            raise
+        self._map = mmap.mmap(self._fd, length)
+        self._locks = [Lock() for _ in range(shards)]
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _init_file(self, length):
+        header = _SHM_HEADER.pack(_SHM_MAGIC, self.shards, self.shard_size,
+                                  self.slot_size)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, length)
+                os.write(self._fd, header)
+            elif os.read(self._fd, len(header)) != header:
+                raise ValueError('%s is not a cache with the same layout' %
+                                 self.path)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _reset_locks(self):
+        # A thread of the parent may have been holding them while forking
+        self._locks = [Lock() for _ in range(self.shards)]
+
+    def _locate(self, key):
+        """
+        Returns the digest of ``key``, its shard and the offsets of the slots
+        that are probed for it.
+        """
+        digest = _key_digest(key)
+        number = struct.unpack_from('<Q', digest)[0]
+        shard = number % self.shards
+        start = (number // self.shards) % self.shard_size
+        base = _SHM_HEADER.size + shard * self.shard_size * self.slot_size
+        offsets = [base + ((start + n) % self.shard_size) * self.slot_size
+                   for n in range(self.max_probes)]
+        return digest, shard, offsets
+
+    def _lock(self, shard, exclusive):
+        self._locks[shard].acquire()
+        try:
+            fcntl.lockf(self._fd,
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+                        1, shard)
+        except Exception:
+            self._locks[shard].release()
+            raise
+
+    def _unlock(self, shard):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, shard)
+        self._locks[shard].release()
+
+    def _find(self, digest, offsets):
+        """
+        Returns the offset and slot header of ``digest`` (``None`` if it is
+        not in the table).
+        """
+        for offset in offsets:
+            slot = _SHM_SLOT.unpack_from(self._map, offset)
+            if slot[0] == _SLOT_EMPTY:
+                break
+            if slot[0] == _SLOT_USED and slot[3] == digest:
+                return offset, slot
+        return None, None
+
+    def get(self, key, default=None):
+        """
+        Gets the value stored for ``key``.
+
+        :param key: The key of the entry.
+        :param default: The value returned when ``key`` is not cached.
+        """
+        digest, shard, offsets = self._locate(key)
+        self._lock(shard, False)
+        try:
+            offset, slot = self._find(digest, offsets)
+            if offset is not None and slot[2] > self.timer():
+                start = offset + _SHM_SLOT.size
+                data = self._map[start:start + slot[1]]
+            else:
+                data = None
+        finally:
+            self._unlock(shard)
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value, expires=None):
+        """
+        Stores ``value`` for ``key``, evicting the probed entry that expires
+        first if there is no free slot.
+
+        :param key: The key of the entry.
+        :param value: The value to store (it must be picklable).
+        :param expires: The time (in seconds since the epoch) when the entry
+            stops being valid. By default it never expires.
+        """
+        data = pickle.dumps(value, 2)
+        if len(data) > self.slot_size - _SHM_SLOT.size:
+            self.delete(key)
+            return
+        if expires is None:
+            expires = _NEVER
+        digest, shard, offsets = self._locate(key)
+        self._lock(shard, True)
+        try:
+            now = self.timer()
+            target = free = oldest = None
+            for offset in offsets:
+                slot = _SHM_SLOT.unpack_from(self._map, offset)
+                if slot[0] == _SLOT_USED and slot[3] == digest:
+                    target = offset
+                    break
+                if slot[0] != _SLOT_USED or slot[2] <= now:
+                    if free is None:
+                        free = offset
+                elif oldest is None or slot[2] < oldest[1]:
+                    oldest = (offset, slot[2])
+                if slot[0] == _SLOT_EMPTY:
+                    break
+            if target is None:
+                target = free if free is not None else oldest[0]
+            _SHM_SLOT.pack_into(self._map, target, _SLOT_USED, len(data),
+                                expires, digest)
+            start = target + _SHM_SLOT.size
+            self._map[start:start + len(data)] = data
+        finally:
+            self._unlock(shard)
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache (if present).
+
+        :param key: The key of the entry.
+        """
+        digest, shard, offsets = self._locate(key)
+        self._lock(shard, True)
+        try:
+            offset = self._find(digest, offsets)[0]
+            if offset is not None:
+                self._map[offset:offset + 1] = struct.pack('B', _SLOT_DELETED)
+        finally:
+            self._unlock(shard)
+
+    def clear(self):
+        """
+        Removes every entry (for every process) and resets the counters.
+        """
+        for shard in range(self.shards):
+            self._lock(shard, True)
+        try:
+            for slot in range(self.maxsize):
+                offset = _SHM_HEADER.size + slot * self.slot_size
+                self._map[offset:offset + 1] = struct.pack('B', _SLOT_EMPTY)
+        finally:
+            for shard in range(self.shards):
+                self._unlock(shard)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the ``hits`` and ``misses`` of this
+        process, and the current ``size`` and ``maxsize`` of the shared
+        table.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize
+        }
+
+    def close(self):
+        """
+        Unmaps and closes the file of the cache.
+        """
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        now = self.timer()
+        size = 0
+        for slot in range(self.maxsize):
+            offset = _SHM_HEADER.size + slot * self.slot_size
+            state, _, expires, _ = _SHM_SLOT.unpack_from(self._map, offset)
+            if state == _SLOT_USED and expires > now:
+                size += 1
+        return size
+
+    def __contains__(self, key):
+        digest, shard, offsets = self._locate(key)
+        self._lock(shard, False)
+        try:
+            offset, slot = self._find(digest, offsets)
+        finally:
+            self._unlock(shard)
+        return offset is not None and slot[2] > self.timer()
+
+
+# Memcached takes the lifetimes longer than 30 days as absolute times
+_MEMCACHED_MAX_RELATIVE = 30 * 24 * 60 * 60
+# Keys requested by each of the pipelined get commands
+_MEMCACHED_GET_CHUNK = 64
+
+
+class MemcachedError(Exception):
+    """
+    An unexpected response of a memcached server.
+    """
+
+
+class _MemcachedConnection(object):
+
+    def __init__(self, address, timeout):
+        self.socket = socket.create_connection(address, timeout)
+        self.reader = self.socket.makefile('rb')
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+    def readline(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise MemcachedError('The connection was closed')
+        return line[:-2]
+
+    def read(self, size):
+        data = self.reader.read(size + 2)
+        if len(data) != size + 2:
+            raise MemcachedError('The connection was closed')
+        return data[:-2]
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+class MemcachedCache(CacheBackend):
+    """
+    A client of the memcached text protocol, so every host can share the
+    cache (e.g., the verified identities of the nodes behind a proxy).
+
+    It keeps a pool of connections, and :meth:`get_many` and :meth:`set_many`
+    pipeline their commands. Any network error is counted in ``errors`` and
+    the cache behaves as if it were empty, so the authentication does not
+    depend on the availability of the servers.
+
+    The keys are sent as the prefixed SHA-256 digests of the keys and the
+    values are pickled. memcached does not authenticate its clients, and
+    anyone who can write to the server could forge cached identities or run
+    code in the application when the values are unpickled, so the values are
+    signed with a ``secret`` shared by the hosts, and the unsigned or
+    tampered ones are ignored without being unpickled.
+    """
+
+    def __init__(self, secret, host='127.0.0.1', port=11211, prefix='x509:',
+                 pool_size=8, timeout=0.5, timer=time.time):
+        """
+        :param secret: The key used to sign the values (HMAC-SHA256). It must
+            be the same in every host, and unknown to anyone else.
+        :param host: The host of the memcached server.
+        :param port: The port of the memcached server.
+        :param prefix: Prepended to the keys, to share a server with other
+            applications.
+        :param pool_size: The maximum number of idle connections kept open.
+        :param timeout: The timeout (in seconds) of the network operations.
+        :param timer: Function that returns the current time (in seconds since
+            the epoch) used to compute the lifetime of the entries.
+
+        :raise ValueError: When the secret is empty.
+        """
+        if not secret:
+            raise ValueError('The memcached values must be signed with a '
+                             'secret')
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self.address = (host, port)
+        self.prefix = prefix
+        self.secret = secret
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._pool = []
+        self._pool_lock = Lock()
+
+    def _key(self, key):
+        return self.prefix.encode('ascii') + hexlify(_key_digest(key))
+
+    def _dumps(self, value):
+        data = pickle.dumps(value, 2)
+        return hmac.new(self.secret, data, hashlib.sha256).digest() + data
+
+    def _loads(self, data):
+        signature, data = data[:32], data[32:]
+        expected = hmac.new(self.secret, data, hashlib.sha256).digest()
+        # Only the values written by the hosts with the secret are unpickled
+        if not hmac.compare_digest(signature, expected):
+            return _MISSING
+        return pickle.loads(data)
+
+    def _exptime(self, expires):
+        """
+        Returns the memcached expiration time (``None`` when it has already
+        expired).
+        """
+        if expires is None:
+            return 0
+        lifetime = int(expires - self.timer())
+        if lifetime <= 0:
+            return None
+        if lifetime > _MEMCACHED_MAX_RELATIVE:
+            return int(expires)
+        return lifetime
+
+    def _execute(self, command, *args):
+        """
+        Runs ``command`` with a connection of the pool. Returns ``None`` when
+        the server fails (the connection is then discarded).
+        """
+        with self._pool_lock:
+            connection = self._pool.pop() if self._pool else None
+        try:
+            if connection is None:
+                connection = _MemcachedConnection(self.address, self.timeout)
+            result = command(connection, *args)
+        except (socket.error, MemcachedError):
+            self.errors += 1
+            if connection is not None:
+                connection.close()
+            return None
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+        return result
+
+    def get(self, key, default=None):
+        """
+        Gets the value stored for ``key``.
+
+        :param key: The key of the entry.
+        :param default: The value returned when ``key`` is not cached.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the cached values of ``keys`` (see
+        :meth:`CacheBackend.get_many`). The keys are requested by pipelined
+        ``get`` commands, in a single round trip.
+        """
+        names = {}
+        for key in keys:
+            names[self._key(key)] = key
+        found = self._execute(self._get_many, list(names)) or {}
+        values = {}
+        for name, data in found.items():
+            value = self._loads(data)
+            if value is not _MISSING:
+                values[names[name]] = value
+        self.hits += len(values)
+        self.misses += len(names) - len(values)
+        return values
+
+    def _get_many(self, connection, names):
+        commands = []
+        for start in range(0, len(names), _MEMCACHED_GET_CHUNK):
+            commands.append(b'get ' +
+                            b' '.join(names[start:start +
+                                            _MEMCACHED_GET_CHUNK]) +
+                            b'\r\n')
+        connection.send(b''.join(commands))
+        found = {}
+        for _ in commands:
+            while True:
+                line = connection.readline()
+                if line == b'END':
+                    break
+                parts = line.split()
+                if (len(parts) != 4 or parts[0] != b'VALUE' or
+                        not parts[3].isdigit()):
+                    raise MemcachedError(line)
+                found[parts[1]] = connection.read(int(parts[3]))
+        return found
+
+    def set(self, key, value, expires=None):
+        """
+        Stores ``value`` for ``key``.
+
+        :param key: The key of the entry.
+        :param value: The value to store (it must be picklable).
+        :param expires: The time (in seconds since the epoch) when the entry
+            stops being valid. By default it never expires.
+        """
+        self.set_many([(key, value)], expires)
+
+    def set_many(self, items, expires=None):
+        """
+        Stores many values (see :meth:`CacheBackend.set_many`) with
+        pipelined ``set`` commands, in a single round trip.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        exptime = self._exptime(expires)
+        if exptime is None:
+            for key, _ in items:
+                self.delete(key)
+            return
+        commands = []
+        for key, value in items:
+            data = self._dumps(value)
+            commands.append(b''.join([
+                b'set ', self._key(key),
+                (' 0 %d %d\r\n' % (exptime, len(data))).encode('ascii'),
+                data, b'\r\n'
+            ]))
+        if commands:
+            self._execute(self._store, commands, b'STORED')
+
+    def _store(self, connection, commands, *replies):
+        connection.send(b''.join(commands))
+        for _ in commands:
+            line = connection.readline()
+            if line not in replies:
+                raise MemcachedError(line)
+        return True
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache (if present).
+
+        :param key: The key of the entry.
+        """
+        self._execute(self._store, [b'delete ' + self._key(key) + b'\r\n'],
+                      b'DELETED', b'NOT_FOUND')
+
+    def clear(self):
+        """
+        Removes every entry of the server (including the ones of other
+        prefixes) and resets the counters.
+        """
+        self._execute(self._store, [b'flush_all\r\n'], b'OK')
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the ``hits``, ``misses`` and network
+        ``errors`` of this client.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors}
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for connection in pool:
+            connection.close()
+
+    def __contains__(self, key):
+        return key in self.get_many([key])
+
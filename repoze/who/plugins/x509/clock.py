@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Clocks used by the repoze who x509 plugin to check the validity range of the
+certificates and the expiration of the cache entries. A clock is any callable
+that returns the current time in seconds since the epoch, like
+:func:`time.time` (the default).
+"""
+
+from threading import Thread, Lock
+import os
+import time
+
+
+__all__ = ['system_clock', 'CoarseClock']
+
+system_clock = time.time
+
+
+class CoarseClock(object):
+    """
+    Clock that returns the current time truncated to whole seconds. The value
+    is refreshed by a daemon thread, so reading it costs only an attribute
+    lookup and a check of the process id.
+
+    The thread is started on the first call. If the process forks afterwards
+    (e.g., a preforking server that loads the application before forking),
+    each child starts its own thread on its first call.
+    """
+
+    def __init__(self, resolution=1.0):
+        """
+        :param resolution: Seconds between the updates of the time.
+        """
+        self.resolution = resolution
+        self.now = int(time.time())
+        self._thread = None
+        self._pid = None
+        self._generation = 0
+        self._lock = Lock()
+
+    def __call__(self):
+        if self._pid != os.getpid():
+            if self._pid is None:
+                self._start()
+            else:
+                # A forked process: its threads (and maybe the lock) are gone
+                self.restart()
+        return self.now
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.now = int(time.time())
+            self._generation += 1
+            thread = Thread(target=self._run, args=(self._generation,),
+                            name='x509-coarse-clock')
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    def _run(self, generation, now=time.time, sleep=time.sleep, int=int):
+        # It stops when restart() starts a newer thread. The functions are
+        # bound as arguments, so it survives the interpreter shutdown.
+        while generation == self._generation:
+            self.now = int(now())
+            sleep(self.resolution)
+
+    def restart(self):
+        """
+        Updates the time and starts a new updating thread (needed in the child
+        processes, as threads do not survive a fork).
+        """
+        self._lock = Lock()
+        self._pid = None
+        self._start()
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A minimal reader of the DER encoding of X.509 certificates, enough to get the
+fields that the web servers pass as server variables (e.g., when a server only
+gives the certificate itself), and a writer of the few elements of the
+requests of :mod:`repoze.who.plugins.x509.ocsp`.
+"""
+
+from binascii import a2b_base64, hexlify, unhexlify
+from calendar import timegm
+import re
+
+
+__all__ = ['pem_to_der', 'parse_certificate', 'parse_crl', 'encode',
+           'encode_integer', 'encode_oid', 'DERError']
+
+# Universal tags
+TAG_INTEGER = 0x02
+TAG_BIT_STRING = 0x03
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_ENUMERATED = 0x0a
+TAG_UTF8_STRING = 0x0c
+TAG_PRINTABLE_STRING = 0x13
+TAG_T61_STRING = 0x14
+TAG_IA5_STRING = 0x16
+TAG_UTC_TIME = 0x17
+TAG_GENERALIZED_TIME = 0x18
+TAG_UNIVERSAL_STRING = 0x1c
+TAG_BMP_STRING = 0x1e
+TAG_SEQUENCE = 0x30
+TAG_SET = 0x31
+# [0] EXPLICIT, used for the version of the certificate and the extensions
+# of the CRL
+TAG_CONTEXT_0 = 0xa0
+
+# Extensions
+OID_CRL_NUMBER = '2.5.29.20'
+
+# The short names used by OpenSSL for the common attribute types
+ATTRIBUTE_NAMES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.4': 'SN',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.9': 'street',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+    '2.5.4.12': 'title',
+    '2.5.4.42': 'GN',
+    '2.5.4.46': 'dnQualifier',
+    '0.9.2342.19200300.100.1.1': 'UID',
+    '0.9.2342.19200300.100.1.25': 'DC',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+}
+
+_PEM_REGEX = re.compile(
+    r'-----BEGIN ([A-Z0-9 ]+)-----(.*?)-----END \1-----',
+    re.DOTALL
+)
+
+
+class DERError(ValueError):
+    """
+    The data is not a valid DER encoding of the expected structure.
+    """
+
+
+def pem_to_der(pem, label='CERTIFICATE'):
+    """
+    Returns the DER encoding of the first PEM block with ``label``.
+
+    :param pem: The PEM encoded data.
+    :param label: The label of the block (``CERTIFICATE``, ``X509 CRL``...).
+
+    :raise DERError: When there is no such block.
+    """
+    if isinstance(pem, bytes):
+        pem = pem.decode('ascii')
+    for match in _PEM_REGEX.finditer(pem):
+        if match.group(1) == label:
+            return a2b_base64(''.join(match.group(2).split()))
+    raise DERError('There is no %s in the PEM data' % label)
+
+
+def read(data, offset=0, end=None):
+    """
+    Reads the element that starts at ``offset``. Returns its tag, the
+    offsets of the start and end of its contents.
+
+    :param data: A ``bytearray`` with the DER encoding.
+    """
+    if end is None:
+        end = len(data)
+    if offset + 2 > end:
+        raise DERError('Truncated element')
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or count > 4 or offset + count > end:
+            raise DERError('Invalid length')
+        length = 0
+        for byte in data[offset:offset + count]:
+            length = (length << 8) | byte
+        offset += count
+    if offset + length > end:
+        raise DERError('Truncated element')
+    return tag, offset, offset + length
+
+
+def children(data, start, end):
+    """
+    Yields the ``(tag, start, end)`` of the elements inside a constructed
+    element.
+    """
+    while start < end:
+        tag, content, start = read(data, start, end)
+        yield tag, content, start
+
+
+def expect(data, offset, end, tag):
+    """
+    Reads the element at ``offset``, which must have ``tag``. Returns the
+    start and end of its contents.
+    """
+    found, start, stop = read(data, offset, end)
+    if found != tag:
+        raise DERError('Expected tag 0x%02x, found 0x%02x' % (tag, found))
+    return start, stop
+
+
+def parse_integer(data, start, end):
+    """
+    Returns the (signed) value of an INTEGER.
+    """
+    if end - start > 8:
+        value = int(hexlify(bytes(data[start:end])), 16)
+    else:
+        value = 0
+        for byte in data[start:end]:
+            value = (value << 8) | byte
+    if end > start and data[start] & 0x80:
+        value -= 1 << (8 * (end - start))
+    return value
+
+
+def parse_oid(data, start, end):
+    """
+    Returns the dotted representation of an OBJECT IDENTIFIER.
+    """
+    if start == end:
+        raise DERError('Empty object identifier')
+    parts = []
+    value = 0
+    for byte in data[start:end]:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    first = min(parts[0] // 40, 2)
+    return '.'.join(str(part) for part in
+                    [first, parts[0] - 40 * first] + parts[1:])
+
+
+def parse_time(data, tag, start, end):
+    """
+    Returns the seconds since the epoch of an UTCTime or GeneralizedTime.
+    """
+    try:
+        text = bytes(data[start:end]).decode('ascii')
+    except UnicodeError:
+        raise DERError('Invalid time')
+    if not text.endswith('Z'):
+        raise DERError('The time is not in UTC: %s' % text)
+    if not text[:-1].replace('.', '', 1).isdigit():
+        raise DERError('Invalid time: %s' % text)
+    if tag == TAG_UTC_TIME and len(text) == 13:
+        year = int(text[:2])
+        # RFC 5280: the years 50 to 99 are 1950 to 1999
+        year += 1900 if year >= 50 else 2000
+        text = text[2:]
+    elif tag == TAG_GENERALIZED_TIME and len(text) >= 15:
+        # Some OCSP responders add fractions of a second
+        if len(text) > 15:
+            if text[14] != '.' or not text[15:-1].isdigit():
+                raise DERError('Invalid time: %s' % text)
+            text = text[:14] + 'Z'
+        year = int(text[:4])
+        text = text[4:]
+    else:
+        raise DERError('Invalid time: %s' % text)
+    try:
+        return timegm((year, int(text[0:2]), int(text[2:4]), int(text[4:6]),
+                       int(text[6:8]), int(text[8:10]), 0, 0, 0))
+    except ValueError:
+        raise DERError('Invalid time: %s' % text)
+
+
+def parse_string(data, tag, start, end):
+    """
+    Returns the text of a directory string.
+    """
+    value = bytes(data[start:end])
+    if tag == TAG_BMP_STRING:
+        encoding = 'utf-16-be'
+    elif tag == TAG_UNIVERSAL_STRING:
+        encoding = 'utf-32-be'
+    elif tag == TAG_T61_STRING:
+        encoding = 'latin-1'
+    else:
+        encoding = 'utf-8'
+    try:
+        return value.decode(encoding)
+    except UnicodeError:
+        raise DERError('Invalid %s string' % encoding)
+
+
+def parse_name(data, start, end):
+    """
+    Returns a distinguished name in the OpenSSL format (e.g.,
+    ``/C=US/O=Company/CN=Name``), as written by ``mod_ssl``.
+    """
+    parts = []
+    for tag, rdn_start, rdn_end in children(data, start, end):
+        if tag != TAG_SET:
+            raise DERError('Invalid relative distinguished name')
+        separator = '/'
+        for tag, atv_start, atv_end in children(data, rdn_start, rdn_end):
+            oid_start, oid_end = expect(data, atv_start, atv_end, TAG_OID)
+            oid = parse_oid(data, oid_start, oid_end)
+            value_tag, value_start, value_end = read(data, oid_end, atv_end)
+            value = parse_string(data, value_tag, value_start, value_end)
+            parts.append('%s%s=%s' % (separator, ATTRIBUTE_NAMES.get(oid, oid),
+                                      value))
+            # The values of a multi-valued RDN are joined with '+'
+            separator = '+'
+    return ''.join(parts)
+
+
+def parse_certificate(der):
+    """
+    Returns a dictionary with the ``serial`` number (an integer), the
+    ``issuer`` and ``subject`` distinguished names (see :func:`parse_name`),
+    the validity range (``not_before`` and ``not_after``, in seconds since
+    the epoch), the DER encoding of the subject name (``subject_der``) and
+    the ``public_key`` (the contents of its BIT STRING) of a certificate.
+
+    The signature is not checked.
+
+    :param der: The DER encoding of the certificate.
+
+    :raise DERError: When the certificate cannot be read.
+    """
+    data = bytearray(der)
+    start, end = expect(data, 0, len(data), TAG_SEQUENCE)
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    elements = list(children(data, start, end))
+    if elements and elements[0][0] == TAG_CONTEXT_0:
+        elements = elements[1:]
+    if len(elements) < 6:
+        raise DERError('Invalid certificate')
+    serial, _, issuer, validity, subject = elements[:5]
+    for element, tag in ((serial, TAG_INTEGER), (issuer, TAG_SEQUENCE),
+                         (validity, TAG_SEQUENCE), (subject, TAG_SEQUENCE)):
+        if element[0] != tag:
+            raise DERError('Invalid certificate')
+    times = list(children(data, validity[1], validity[2]))
+    if len(times) != 2:
+        raise DERError('Invalid validity range')
+    key_info = elements[5]
+    if key_info[0] != TAG_SEQUENCE:
+        raise DERError('Invalid certificate')
+    key_info = list(children(data, key_info[1], key_info[2]))
+    if len(key_info) != 2 or key_info[1][0] != TAG_BIT_STRING:
+        raise DERError('Invalid public key')
+    return {
+        'serial': parse_integer(data, serial[1], serial[2]),
+        'issuer': parse_name(data, issuer[1], issuer[2]),
+        'subject': parse_name(data, subject[1], subject[2]),
+        'not_before': parse_time(data, *times[0]),
+        'not_after': parse_time(data, *times[1]),
+        # The subject starts where the validity range ends
+        'subject_der': bytes(data[validity[2]:subject[2]]),
+        # Without the number of unused bits
+        'public_key': bytes(data[key_info[1][1] + 1:key_info[1][2]]),
+    }
+
+
+def parse_crl(der):
+    """
+    Returns a dictionary with the ``issuer`` distinguished name (see
+    :func:`parse_name`), the ``this_update`` and ``next_update`` times (in
+    seconds since the epoch, ``next_update`` may be ``None``), the CRL
+    ``number`` (``None`` if the extension is not present) and ``serials``,
+    an iterator over the serial numbers of the revoked certificates (read as
+    they are needed, as a CRL may have many entries).
+
+    The signature is not checked.
+
+    :param der: The DER encoding of the CRL.
+
+    :raise DERError: When the CRL cannot be read.
+    """
+    data = bytearray(der)
+    start, end = expect(data, 0, len(data), TAG_SEQUENCE)
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    elements = list(children(data, start, end))
+    if elements and elements[0][0] == TAG_INTEGER:
+        elements = elements[1:]
+    if len(elements) < 3 or elements[1][0] != TAG_SEQUENCE:
+        raise DERError('Invalid CRL')
+    issuer = parse_name(data, elements[1][1], elements[1][2])
+    this_update = parse_time(data, *elements[2])
+    next_update = None
+    revoked = number = None
+    for tag, element_start, element_end in elements[3:]:
+        if tag in (TAG_UTC_TIME, TAG_GENERALIZED_TIME):
+            next_update = parse_time(data, tag, element_start, element_end)
+        elif tag == TAG_SEQUENCE:
+            revoked = (element_start, element_end)
+        elif tag == TAG_CONTEXT_0:
+            number = _crl_number(data, element_start, element_end)
+    return {
+        'issuer': issuer,
+        'this_update': this_update,
+        'next_update': next_update,
+        'number': number,
+        'serials': _iter_revoked(data, revoked),
+    }
+
+
+def _crl_number(data, start, end):
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    for _, extension_start, extension_end in children(data, start, end):
+        oid_start, oid_end = expect(data, extension_start, extension_end,
+                                    TAG_OID)
+        if parse_oid(data, oid_start, oid_end) != OID_CRL_NUMBER:
+            continue
+        # The criticality flag is never set for this extension
+        value_start, value_end = expect(data, oid_end, extension_end,
+                                        TAG_OCTET_STRING)
+        value_start, value_end = expect(data, value_start, value_end,
+                                        TAG_INTEGER)
+        return parse_integer(data, value_start, value_end)
+    return None
+
+
+def _iter_revoked(data, revoked):
+    if revoked is None:
+        return
+    start, end = revoked
+    while start < end:
+        tag, entry_start, start = read(data, start, end)
+        if tag != TAG_SEQUENCE:
+            raise DERError('Invalid revoked certificate')
+        tag, serial_start, serial_end = read(data, entry_start, start)
+        if tag != TAG_INTEGER:
+            raise DERError('Invalid revoked certificate')
+        yield parse_integer(data, serial_start, serial_end)
+
+
+def encode(tag, *contents):
+    """
+    Returns the DER encoding of an element.
+
+    :param tag: The tag of the element.
+    :param contents: The encoded contents (for a constructed element, the
+        encodings of its elements).
+    """
+    content = b''.join(contents)
+    length = len(content)
+    if length < 0x80:
+        header = bytearray((tag, length))
+    else:
+        octets = bytearray()
+        while length:
+            octets.insert(0, length & 0xff)
+            length >>= 8
+        header = bytearray((tag, 0x80 | len(octets))) + octets
+    return bytes(header) + content
+
+
+def encode_integer(value):
+    """
+    Returns the DER encoding of an INTEGER.
+    """
+    length = (value if value >= 0 else ~value).bit_length() // 8 + 1
+    if value < 0:
+        value += 1 << (8 * length)
+    text = '%0*x' % (2 * length, value)
+    return encode(TAG_INTEGER, unhexlify(text.encode('ascii')))
+
+
+def encode_oid(oid):
+    """
+    Returns the DER encoding of an OBJECT IDENTIFIER.
+
+    :param oid: The dotted representation of the identifier.
+    """
+    parts = [int(part) for part in oid.split('.')]
+    content = bytearray()
+    for part in [40 * parts[0] + parts[1]] + parts[2:]:
+        octets = bytearray((part & 0x7f,))
+        part >>= 7
+        while part:
+            octets.insert(0, 0x80 | (part & 0x7f))
+            part >>= 7
+        content += octets
+    return encode(TAG_OID, bytes(content))
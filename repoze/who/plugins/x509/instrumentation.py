@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Optional instrumentation of the hot path of the repoze who x509 plugin.
+
+When an :class:`Instrumentation` object is given to
+:class:`repoze.who.plugins.x509.X509Identifier` it counts the outcome of every
+call to ``identify`` and times its stages. Nothing is measured otherwise.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+from timeit import default_timer
+import socket
+
+
+__all__ = ['Instrumentation', 'StatsdSink', 'DEFAULT_BUCKETS', 'STAGES',
+           'OUTCOMES']
+
+# Upper bounds (in seconds) of the buckets of the timing histograms. There is
+# always an extra bucket for anything slower.
+DEFAULT_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+                   0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+# The stages timed by X509Identifier
+STAGE_VERIFY = 'verify_certificate'
+STAGE_DATES = 'parse_dates'
+STAGE_PARSE_DN = 'parse_dn'
+STAGE_LOGIN_VALUES = 'login_values'
+STAGE_REVOCATION = 'revocation'
+STAGES = (STAGE_VERIFY, STAGE_DATES, STAGE_PARSE_DN, STAGE_LOGIN_VALUES,
+          STAGE_REVOCATION)
+
+# The outcomes counted by X509Identifier
+OUTCOME_IDENTIFIED = 'identified'
+OUTCOME_NO_DN = 'no_dn'
+OUTCOME_VERIFY_FAILED = 'verify_failed'
+OUTCOME_EXPIRED = 'expired'
+OUTCOME_MISSING_LOGIN = 'missing_login'
+OUTCOME_TOO_MANY_VALUES = 'too_many_values'
+OUTCOME_REVOKED = 'revoked'
+OUTCOME_ISSUER_DENIED = 'issuer_denied'
+OUTCOMES = (OUTCOME_IDENTIFIED, OUTCOME_NO_DN, OUTCOME_VERIFY_FAILED,
+            OUTCOME_EXPIRED, OUTCOME_MISSING_LOGIN, OUTCOME_TOO_MANY_VALUES,
+            OUTCOME_REVOKED, OUTCOME_ISSUER_DENIED)
+
+# Other counters of X509Identifier
+COUNTER_NEGATIVE_CACHE_HIT = 'negative_cache_hit'
+
+
+class _Timing(object):
+
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self, size):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * size
+
+
+class Instrumentation(object):
+    """
+    Thread-safe collection of counters and timings (with their cumulative time
+    and histogram).
+    """
+
+    timer = staticmethod(default_timer)
+
+    def __init__(self, sink=None, buckets=DEFAULT_BUCKETS):
+        """
+        :param sink: Optional callable that receives every event as
+            ``sink(kind, name, value)``, where ``kind`` is ``'count'`` (the
+            value is the increment) or ``'timing'`` (the value is in seconds).
+            See :class:`StatsdSink`.
+        :param buckets: The sorted upper bounds (in seconds) of the buckets of
+            the timing histograms.
+        """
+        self.sink = sink
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def count(self, name, value=1):
+        """
+        Increments a counter.
+
+        :param name: The name of the counter.
+        :param value: The increment.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        if self.sink is not None:
+            self.sink('count', name, value)
+
+    def timing(self, name, elapsed):
+        """
+        Records the duration of a stage.
+
+        :param name: The name of the stage.
+        :param elapsed: The duration (in seconds).
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing(len(self.buckets) + 1)
+            timing.count += 1
+            timing.total += elapsed
+            timing.buckets[bisect_left(self.buckets, elapsed)] += 1
+        if self.sink is not None:
+            self.sink('timing', name, elapsed)
+
+    def snapshot(self):
+        """
+        Returns a copy of the collected data as a dictionary with the
+        ``counters`` (name to value) and the ``timings`` (name to a dictionary
+        with the ``count``, ``total`` seconds and the histogram ``buckets``, a
+        list of ``(upper bound, count)`` where the last upper bound is
+        ``None``).
+        """
+        bounds = self.buckets + (None,)
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': dict(
+                    (name, {'count': timing.count,
+                            'total': timing.total,
+                            'buckets': list(zip(bounds, timing.buckets))})
+                    for name, timing in self._timings.items()
+                ),
+            }
+
+    def reset(self):
+        """
+        Discards the collected data.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+class StatsdSink(object):
+    """
+    Sink for :class:`Instrumentation` that sends every event as a statsd line
+    over UDP (e.g., to a local statsd agent). Errors are ignored.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='repoze.who.x509'):
+        """
+        :param host: The host of the statsd server.
+        :param port: The UDP port of the statsd server.
+        :param prefix: The prefix of the names of the metrics.
+        """
+        self.address = (host, port)
+        self.prefix = prefix + '.' if prefix else ''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def __call__(self, kind, name, value):
+        if kind == 'timing':
+            line = '%s%s:%.3f|ms' % (self.prefix, name, value * 1000)
+        else:
+            line = '%s%s:%d|c' % (self.prefix, name, value)
+        try:
+            self.socket.sendto(line.encode('ascii'), self.address)
+        except (socket.error, UnicodeError):
+            pass
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Policies of the issuers whose certificates are accepted, for servers that
+trust several certificate authorities but applications that only accept
+some of them.
+"""
+
+from .utils import normalize_dn
+
+
+__all__ = ['IssuerPolicy']
+
+
+class IssuerPolicy(object):
+    """
+    An allowlist and a denylist of issuer distinguished names.
+
+    The names are normalized with
+    :func:`repoze.who.plugins.x509.utils.normalize_dn` when the policy is
+    created, into a dictionary of decisions, so checking an issuer is one
+    lookup whatever the size of the lists. The decisions are also remembered
+    by the issuer string as the server gives it, so the name is only
+    normalized the first time.
+    """
+
+    __slots__ = ('allowed', 'denied', 'cache_size', '_decisions', '_default',
+                 '_cache')
+
+    def __init__(self, allowed=None, denied=(), cache_size=1024):
+        """
+        :param allowed: The distinguished names of the accepted issuers (in
+            any format, see :func:`repoze.who.plugins.x509.utils.parse_dn`).
+            By default every issuer that is not denied is accepted.
+        :param denied: The distinguished names of the rejected issuers, which
+            are rejected even if they are also allowed.
+        :param cache_size: How many issuer strings are remembered. The cache
+            is emptied when it is full (there are usually few issuers).
+
+        :raise ValueError: When one of the names is invalid.
+        """
+        self.allowed = None if allowed is None else tuple(allowed)
+        self.denied = tuple(denied)
+        self.cache_size = cache_size
+        self._default = self.allowed is None
+        decisions = {}
+        for dn in self.allowed or ():
+            decisions[normalize_dn(dn)] = True
+        for dn in self.denied:
+            decisions[normalize_dn(dn)] = False
+        self._decisions = decisions
+        self._cache = {}
+
+    def allows(self, issuer_dn):
+        """
+        Checks if the certificates of an issuer are accepted. An invalid or
+        missing issuer is never accepted.
+
+        :param issuer_dn: The distinguished name of the issuer (e.g., the
+            ``SSL_CLIENT_I_DN`` server variable).
+        """
+        decision = self._cache.get(issuer_dn)
+        if decision is not None:
+            return decision
+        if not issuer_dn:
+            return False
+        try:
+            decision = self._decisions.get(normalize_dn(issuer_dn),
+                                           self._default)
+        except ValueError:
+            decision = False
+        cache = self._cache
+        if len(cache) >= self.cache_size:
+            cache = self._cache = {}
+        cache[issuer_dn] = decision
+        return decision
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A cache around slow lookups (e.g., of the user ids or metadata of the
+certificates in a database or directory), which keeps the latency flat when
+the backend slows down:
+
+* Concurrent misses of the same key make a single call (single flight).
+* Expired entries are still served for ``stale_ttl`` seconds while a
+  background thread refreshes them (stale-while-revalidate).
+* The callers wait at most ``deadline`` seconds for a missing entry, and get
+  :class:`LookupTimeout` afterwards (the call goes on, and its result is
+  cached when it finishes).
+"""
+
+from threading import Event, Lock, Thread
+import os
+
+try:
+    from queue import Queue
+except ImportError:  # pragma: no cover
+    from Queue import Queue
+
+from .cache import LRUCache
+from .clock import system_clock
+
+
+__all__ = ['CachedLookup', 'LookupTimeout']
+
+
+class LookupTimeout(Exception):
+    """
+    The lookup did not finish within its deadline.
+    """
+
+
+class _Flight(object):
+    """
+    A call in progress, which the other callers of the same key wait for.
+    """
+
+    __slots__ = ('key', 'done', 'value', 'error')
+
+    def __init__(self, key):
+        self.key = key
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class CachedLookup(object):
+    """
+    Caches the results of a function of one key (``None`` results included).
+
+    The calls that cannot block the caller (the refreshes, and the misses
+    when there is a ``deadline``) are made by up to ``workers`` threads,
+    started when they are first needed (and again in the child processes
+    after a fork).
+    """
+
+    def __init__(self, function, ttl=300, negative_ttl=None, stale_ttl=0,
+                 deadline=None, cache_size=1024, cache=None, prefix=None,
+                 workers=2, clock=system_clock):
+        """
+        :param function: The lookup, called with the key. Its exceptions are
+            raised to the callers that wait for it.
+        :param ttl: Seconds that the results are fresh.
+        :param negative_ttl: Seconds that the ``None`` results are fresh (by
+            default ``ttl``).
+        :param stale_ttl: Seconds after ``ttl`` that a result is still served
+            while it is refreshed in the background.
+        :param deadline: Seconds that a caller waits for a missing entry (by
+            default it waits until the call finishes).
+        :param cache_size: The size of the LRU cache of the results.
+        :param cache: The cache to use instead of creating a LRU cache of
+            ``cache_size`` (any
+            :class:`repoze.who.plugins.x509.cache.CacheBackend`).
+        :param prefix: If given, the keys of the cache are ``(prefix, key)``
+            tuples, so the cache can be shared with other users.
+        :param workers: The number of threads that make the background calls.
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+        """
+        self.function = function
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.stale_ttl = stale_ttl
+        self.deadline = deadline
+        if cache is None:
+            cache = LRUCache(cache_size, clock)
+        self.cache = cache
+        self.prefix = prefix
+        self.workers = workers
+        self.clock = clock
+        self.calls = 0
+        self.stale = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._flights = {}
+        self._lock = Lock()
+        self._queue = None
+        self._pid = None
+
+    def _cache_key(self, key):
+        if self.prefix is None:
+            return key
+        return (self.prefix, key)
+
+    def __call__(self, key):
+        """
+        Returns the result of the function for ``key``.
+
+        :raise LookupTimeout: When the entry is missing and the call does not
+            finish within ``deadline``.
+        """
+        entry = self.cache.get(self._cache_key(key))
+        if entry is not None:
+            if self.clock() < entry[1]:
+                return entry[0]
+            # Stale: served while it is refreshed
+            with self._lock:
+                self.stale += 1
+            flight, leader = self._flight(key)
+            if leader:
+                self._submit(flight)
+            return entry[0]
+
+        flight, leader = self._flight(key)
+        if leader:
+            if self.deadline is None:
+                self._call(flight)
+            else:
+                self._submit(flight)
+        if not flight.done.wait(self.deadline):
+            with self._lock:
+                self.timeouts += 1
+            raise LookupTimeout('The lookup of %r took more than %s s' %
+                                (key, self.deadline))
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _flight(self, key):
+        """
+        Returns the call in progress for ``key`` (starting one if there is
+        none), and whether it was started.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight(key)
+            return flight, True
+
+    def _call(self, flight):
+        with self._lock:
+            self.calls += 1
+        try:
+            flight.value = self.function(flight.key)
+            self.set(flight.key, flight.value)
+        except Exception as error:
+            # Any error, as it is given to the callers
+            with self._lock:
+                self.errors += 1
+            flight.error = error
+        finally:
+            with self._lock:
+                del self._flights[flight.key]
+            flight.done.set()
+
+    def _submit(self, flight):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A new process (or the first call): its threads are gone
+                self._start()
+            self._queue.put(flight)
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = queue = Queue()
+        for number in range(self.workers):
+            thread = Thread(target=self._run, args=(queue,),
+                            name='x509-lookup-%d' % number)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, queue):
+        while True:
+            self._call(queue.get())
+
+    def set(self, key, value):
+        """
+        Caches the result for a key, as if the function returned it.
+        """
+        ttl = self.negative_ttl if value is None else self.ttl
+        fresh_until = self.clock() + ttl
+        self.cache.set(self._cache_key(key), (value, fresh_until),
+                       fresh_until + self.stale_ttl)
+
+    def set_many(self, items):
+        """
+        Caches many results (e.g., to fill the cache when the application
+        starts).
+
+        :param items: A dictionary (or an iterable of pairs) of keys and
+            results.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        now = self.clock()
+        groups = {}
+        for key, value in items:
+            ttl = self.negative_ttl if value is None else self.ttl
+            groups.setdefault(ttl, []).append((key, value))
+        for ttl, group in groups.items():
+            fresh_until = now + ttl
+            self.cache.set_many([(self._cache_key(key), (value, fresh_until))
+                                 for key, value in group],
+                                fresh_until + self.stale_ttl)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``calls`` of the function,
+        the ones that raised an exception (``errors``), the callers that got
+        a ``stale`` result or a ``timeout``, and the statistics of the cache.
+        """
+        with self._lock:
+            stats = {'calls': self.calls, 'errors': self.errors,
+                     'stale': self.stale, 'timeouts': self.timeouts}
+        stats.update(self.cache.stats())
+        return stats
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+An authenticator that maps the identities of :class:`X509Identifier` to user
+ids with a mapping file, loaded into memory so that authenticating does not
+read files or query a database.
+
+Every line of the file has a key and a user id, separated by a tab
+(``<TAB>`` below, which cannot appear in the keys)::
+
+    # Comments and empty lines are ignored
+    /C=US/O=Company/CN=John Smith<TAB>jsmith
+    CN=Jane Doe,O=Company,C=US<TAB>jdoe
+    admin@example.com<TAB>admin
+
+A key with ``=`` is a distinguished name, matched against the subject of the
+certificate in any format (see
+:func:`repoze.who.plugins.x509.utils.normalize_dn`). Any other key is matched
+against the login, ignoring its case.
+"""
+
+from array import array
+from threading import Lock, Thread
+import mmap
+import os
+
+try:
+    from sys import intern
+except ImportError:  # pragma: no cover
+    # Python 2
+    pass
+
+from zope.interface import implementer
+from repoze.who.interfaces import IAuthenticator
+
+from .clock import system_clock
+from .utils import normalize_dn
+
+
+__all__ = ['X509Authenticator', 'MappingIndex', 'MmapMappingIndex',
+           'MappingError', 'load_mapping', 'mapping_key']
+
+# Separates the pairs of the keys of the distinguished names
+_DN_SEPARATOR = '\x1f'
+# The offsets of the records (4 bytes, enough for 4 GB of records)
+_OFFSET_TYPECODE = 'I'
+
+
+class MappingError(ValueError):
+    """
+    The mapping file has an invalid line.
+    """
+
+
+def _native(data):
+    # The lines are native strings: bytes in Python 2, text in Python 3
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8')
+
+
+def _to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def mapping_key(key):
+    """
+    Returns the key used in the index for a distinguished name or a login.
+
+    :raise ValueError: When the distinguished name is invalid.
+    """
+    if '=' not in key:
+        return key.lower()
+    return _DN_SEPARATOR + _DN_SEPARATOR.join(
+        '%s=%s' % pair for pair in normalize_dn(key))
+
+
+class MappingIndex(object):
+    """
+    The mapping in a dictionary of interned strings.
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, items):
+        """
+        :param items: The ``(key, userid)`` pairs, with the keys already
+            returned by :func:`mapping_key`. The last pair of a repeated key
+            wins.
+        """
+        data = {}
+        userids = {}
+        for key, userid in items:
+            # Many keys may map to the same user id
+            data[intern(key)] = userids.setdefault(userid, userid)
+        self._data = data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MmapMappingIndex(object):
+    """
+    The mapping in an anonymous memory map (one record per entry, without the
+    overhead of the Python objects), found with an open addressing table of
+    the offsets of the records. The pages of the map are never written after
+    it is built, so the processes forked afterwards keep sharing them.
+    """
+
+    __slots__ = ('_records', '_table', '_mask', '_size')
+
+    def __init__(self, items):
+        """
+        :param items: The ``(key, userid)`` pairs, with the keys already
+            returned by :func:`mapping_key`. The last pair of a repeated key
+            wins.
+
+        :raise ValueError: When a key or a user id contains a tab or a new
+            line (the separators of the records).
+        """
+        records = bytearray()
+        self._table = array(_OFFSET_TYPECODE, [0]) * 8
+        self._mask = 7
+        self._size = 0
+        for key, userid in items:
+            data = _to_bytes(key)
+            value = _to_bytes(userid)
+            if (b'\t' in data or b'\n' in data or b'\t' in value or
+                    b'\n' in value):
+                raise ValueError('Invalid mapping of %r to %r' %
+                                 (key, userid))
+            # The offsets are stored plus one (zero is an empty slot)
+            offset = self._find(records, key, data)
+            record = len(records) + 1
+            records += data + b'\t' + value + b'\n'
+            if self._table[offset]:
+                # The previous record of the key is left unused
+                self._table[offset] = record
+                continue
+            self._table[offset] = record
+            self._size += 1
+            if 2 * self._size > len(self._table):
+                self._grow(records)
+        self._records = mmap.mmap(-1, max(len(records), 1))
+        self._records.write(bytes(records))
+
+    def _find(self, records, key, data):
+        """
+        Returns the slot of the table with the key, or the empty slot where
+        it goes.
+        """
+        table = self._table
+        mask = self._mask
+        slot = hash(key) & mask
+        while True:
+            offset = table[slot]
+            if not offset:
+                return slot
+            start = offset - 1
+            end = start + len(data)
+            if records[start:end] == data and records[end:end + 1] == b'\t':
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self, records):
+        offsets = [offset for offset in self._table if offset]
+        size = 2 * len(self._table)
+        self._table = table = array(_OFFSET_TYPECODE, [0]) * size
+        self._mask = mask = len(table) - 1
+        for offset in offsets:
+            # The key ends at the last tab of the record, as in the file
+            start = offset - 1
+            end = records.rindex(b'\t', start, records.index(b'\n', start))
+            key = _native(bytes(records[start:end]))
+            slot = hash(key) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = offset
+
+    def get(self, key, default=None):
+        records = self._records
+        table = self._table
+        mask = self._mask
+        data = _to_bytes(key)
+        slot = hash(key) & mask
+        while True:
+            offset = table[slot]
+            if not offset:
+                return default
+            start = offset - 1
+            end = start + len(data)
+            if records[start:end] == data and records[end:end + 1] == b'\t':
+                return _native(records[end + 1:records.find(b'\n', end)])
+            slot = (slot + 1) & mask
+
+    def __len__(self):
+        return self._size
+
+
+def _read_mapping(path):
+    """
+    Yields the ``(key, userid)`` pairs of a mapping file, with the keys
+    returned by :func:`mapping_key`.
+    """
+    with open(path, 'rb') as mapping:
+        for number, line in enumerate(mapping, 1):
+            line = _native(line).strip()
+            if not line or line.startswith('#'):
+                continue
+            key, tab, userid = line.rpartition('\t')
+            key = key.strip()
+            userid = userid.strip()
+            if not tab or not key or not userid or '\t' in key:
+                raise MappingError('%s:%d: expected a key and a user id '
+                                   'separated by a tab' % (path, number))
+            try:
+                yield mapping_key(key), userid
+            except ValueError:
+                raise MappingError('%s:%d: invalid distinguished name' %
+                                   (path, number))
+
+
+def load_mapping(path, use_mmap=False):
+    """
+    Reads a mapping file. Returns a :class:`MappingIndex` (or a
+    :class:`MmapMappingIndex` if ``use_mmap`` is true). The last line of a
+    repeated key wins.
+
+    :raise MappingError: When a line is invalid.
+    :raise IOError: When the file cannot be read.
+    """
+    index_class = MmapMappingIndex if use_mmap else MappingIndex
+    return index_class(_read_mapping(path))
+
+
+@implementer(IAuthenticator)
+class X509Authenticator(object):
+    """
+    IAuthenticator of the identities of
+    :class:`repoze.who.plugins.x509.X509Identifier` with a mapping file (see
+    :mod:`repoze.who.plugins.x509.mapping`). The subject is looked up first,
+    then every login.
+
+    The identities without a ``subject``, or with a ``password`` (i.e., from
+    other identifiers), are ignored.
+
+    The file is checked again every ``check_interval`` seconds, and read
+    again when its modification time or size changes. The new index is built
+    in a background thread and swapped in at once, so the requests never
+    wait for a reload. A file that cannot be read keeps the previous mapping.
+    """
+
+    def __init__(self, path, check_interval=60, use_mmap=False,
+                 subject_cache_size=1024, clock=system_clock,
+                 background=True):
+        """
+        :param path: The path of the mapping file.
+        :param check_interval: Seconds between the checks of the file.
+        :param use_mmap: Keep the mapping in a memory map instead of Python
+            strings (less memory, slightly slower lookups).
+        :param subject_cache_size: How many subjects are remembered with
+            their key in the index, so they are normalized only once. The
+            cache is emptied when it is full.
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+        :param background: Reload the file in a background thread (otherwise
+            the request that finds it outdated reloads it).
+
+        :raise MappingError: When the file has an invalid line.
+        :raise IOError: When the file cannot be read.
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.use_mmap = use_mmap
+        self.subject_cache_size = subject_cache_size
+        self.clock = clock
+        self.background = background
+        self._reload_lock = Lock()
+        self._schedule_lock = Lock()
+        self._reloader = None
+        self._subject_keys = {}
+        stat = os.stat(path)
+        self._index = load_mapping(path, use_mmap)
+        self._stat = (stat.st_mtime, stat.st_size)
+        self._next_check = clock() + check_interval
+
+    # IAuthenticator
+    def authenticate(self, environ, identity):
+        """
+        Returns the user id mapped to the subject or login of an identity
+        (``None`` if there is none).
+
+        :param environ: The WSGI environment.
+        :param identity: The identity (the credentials of
+            :class:`repoze.who.plugins.x509.X509Identifier`).
+        """
+        subject = identity.get('subject')
+        if subject is None or 'password' in identity:
+            return None
+        if self.clock() >= self._next_check:
+            self._maybe_reload()
+        index = self._index
+
+        key = self._subject_keys.get(subject)
+        if key is None:
+            try:
+                key = mapping_key(subject)
+            except ValueError:
+                key = ''
+            keys = self._subject_keys
+            if len(keys) >= self.subject_cache_size:
+                keys = self._subject_keys = {}
+            keys[subject] = key
+        userid = index.get(key)
+        if userid is not None:
+            return userid
+
+        login = identity.get('login')
+        if not login:
+            return None
+        if not isinstance(login, list):
+            login = [login]
+        for value in login:
+            if '=' not in value:
+                userid = index.get(value.lower())
+                if userid is not None:
+                    return userid
+        return None
+
+    def reload(self):
+        """
+        Reads the file if it changed since it was loaded. Returns whether the
+        mapping was replaced.
+        """
+        with self._reload_lock:
+            return self._reload()
+
+    def _reload(self):
+        replaced = False
+        try:
+            stat = os.stat(self.path)
+            if (stat.st_mtime, stat.st_size) != self._stat:
+                self._index = load_mapping(self.path, self.use_mmap)
+                self._stat = (stat.st_mtime, stat.st_size)
+                replaced = True
+        except (OSError, IOError, MappingError):
+            # Maybe it is being written, try again in the next check
+            pass
+        self._next_check = self.clock() + self.check_interval
+        return replaced
+
+    def _maybe_reload(self):
+        if not self.background:
+            # Only one of the requests reloads, the others go on
+            if self._reload_lock.acquire(False):
+                try:
+                    self._reload()
+                finally:
+                    self._reload_lock.release()
+            return
+        with self._schedule_lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                return
+            self._reloader = Thread(target=self.reload)
+            self._reloader.daemon = True
+            self._reloader.start()
+
+    def __len__(self):
+        return len(self._index)
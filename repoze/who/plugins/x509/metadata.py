@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A metadata provider that gives the parsed distinguished names of the
+certificate to the application, so every consumer reads the same parse::
+
+    names = identity['x509']
+    names['subject'].get('OU')
+    names['issuer']['O'][0]
+"""
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    # Python 2
+    from collections import Mapping
+
+from zope.interface import implementer
+from repoze.who.interfaces import IMetadataProvider
+
+from .utils import FrozenDN, ISSUER_DN_KEY, parse_dn
+
+
+__all__ = ['X509MetadataProvider', 'CertificateNames']
+
+
+def _parse_frozen_dn(dn):
+    return FrozenDN(parse_dn(dn))
+
+
+class CertificateNames(Mapping):
+    """
+    A read-only mapping of ``subject`` (and ``issuer``, if the server gave
+    it) to the parsed distinguished names (see
+    :class:`repoze.who.plugins.x509.utils.FrozenDN`). Each name is parsed the
+    first time it is read, and only then.
+    """
+
+    __slots__ = ('_names', '_parsed', '_parse')
+
+    def __init__(self, names, parse=_parse_frozen_dn):
+        """
+        :param names: A dictionary with the distinguished names.
+        :param parse: Function that returns the parsed distinguished name
+            (e.g., a :class:`repoze.who.plugins.x509.utils.CachedDNParser`).
+        """
+        self._names = names
+        self._parsed = {}
+        self._parse = parse
+
+    def __getitem__(self, name):
+        """
+        Returns a parsed distinguished name.
+
+        :raise KeyError: When there is no such name.
+        :raise ValueError: When the distinguished name is invalid.
+        """
+        parsed = self._parsed.get(name)
+        if parsed is None:
+            parsed = self._parsed[name] = self._parse(self._names[name])
+        return parsed
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self._names)
+
+
+@implementer(IMetadataProvider)
+class X509MetadataProvider(object):
+    """
+    IMetadataProvider that adds a :class:`CertificateNames` mapping to the
+    identities of :class:`repoze.who.plugins.x509.X509Identifier`.
+    """
+
+    def __init__(self, key='x509', issuer_dn_key=ISSUER_DN_KEY,
+                 dn_cache=None):
+        """
+        :param key: The key of the mapping in the identity.
+        :param issuer_dn_key: The WSGI environment key for the issuer
+            distinguished name.
+        :param dn_cache: Optional
+            :class:`repoze.who.plugins.x509.utils.CachedDNParser` used to
+            parse the names (e.g., the ``dn_cache`` of the identifier, so
+            the subject parsed to get the login is not parsed again).
+        """
+        self.key = key
+        self.issuer_dn_key = issuer_dn_key
+        self.dn_cache = dn_cache
+        self._parse = _parse_frozen_dn if dn_cache is None else dn_cache
+
+    # IMetadataProvider
+    def add_metadata(self, environ, identity):
+        """
+        Adds the mapping to the identities with a ``subject``.
+
+        :param environ: The WSGI environment.
+        :param identity: The identity.
+        """
+        subject = identity.get('subject')
+        if subject is None:
+            return
+        names = {'subject': subject}
+        issuer = environ.get(self.issuer_dn_key)
+        if issuer:
+            names['issuer'] = issuer
+        identity[self.key] = CertificateNames(names, self._parse)
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Revocation checks with the Online Certificate Status Protocol (:rfc:`6960`).
+
+The responses are cached by issuer and serial number until their
+``nextUpdate``, and refreshed by background workers shortly before, so the
+requests of the certificates in use do not wait for the responder. A request
+waits at most ``deadline`` seconds for a response that is not cached, and a
+response past its ``nextUpdate`` is still used for ``stale_if_error`` seconds
+while a new one is requested in the background.
+
+The signatures of the responses are not checked, and the requests have no
+nonce, so anyone who can change the traffic between the application and the
+responder could answer that a revoked certificate is good. The responder
+must therefore be reached with HTTPS (whose certificate is verified by
+:func:`http_fetch`), unless the checker is told that the transport is
+trusted (e.g., a responder on the same host or on an isolated network).
+"""
+
+from binascii import hexlify
+from threading import Event, Lock, Thread
+import hashlib
+import os
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import Request, urlopen
+
+try:
+    from queue import Queue
+except ImportError:  # pragma: no cover
+    from Queue import Queue
+
+from .cache import LRUCache
+from .clock import system_clock
+from .der import (DERError, children, encode, encode_integer, encode_oid,
+                  expect, parse_certificate, parse_integer, parse_oid,
+                  parse_time, pem_to_der, read, TAG_CONTEXT_0,
+                  TAG_ENUMERATED, TAG_GENERALIZED_TIME, TAG_INTEGER, TAG_NULL,
+                  TAG_OCTET_STRING, TAG_OID, TAG_SEQUENCE)
+from .revocation import _issuer_key
+
+
+__all__ = ['OCSPChecker', 'OCSPError', 'CertificateID', 'encode_request',
+           'parse_response', 'http_fetch', 'STATUS_GOOD', 'STATUS_REVOKED',
+           'STATUS_UNKNOWN']
+
+STATUS_GOOD = 'good'
+STATUS_REVOKED = 'revoked'
+STATUS_UNKNOWN = 'unknown'
+
+OID_SHA1 = '1.3.14.3.2.26'
+OID_BASIC_RESPONSE = '1.3.6.1.5.5.7.48.1.1'
+
+CONTENT_TYPE_REQUEST = 'application/ocsp-request'
+
+# The IMPLICIT tags of the CertStatus choices
+_CERT_STATUSES = {0x80: STATUS_GOOD, 0xa1: STATUS_REVOKED,
+                  0x82: STATUS_UNKNOWN}
+# The values of OCSPResponseStatus other than successful (0)
+_RESPONSE_STATUSES = {1: 'malformedRequest', 2: 'internalError',
+                      3: 'tryLater', 5: 'sigRequired', 6: 'unauthorized'}
+_SHA1_ALGORITHM = encode(TAG_SEQUENCE, encode_oid(OID_SHA1),
+                         encode(TAG_NULL))
+# long is another integer type in Python 2
+_INTEGER_TYPES = (int, type(1 << 64))
+
+
+class OCSPError(Exception):
+    """
+    The responder could not be reached, or did not give the status of the
+    certificate.
+    """
+
+
+class CertificateID(object):
+    """
+    Identifies the certificates of an issuer in the OCSP requests, with the
+    SHA-1 digests of its name and public key.
+    """
+
+    __slots__ = ('name', 'name_hash', 'key_hash', '_hex')
+
+    def __init__(self, certificate):
+        """
+        :param certificate: The certificate of the issuer (PEM or DER).
+
+        :raise DERError: When the certificate cannot be read.
+        """
+        if not isinstance(certificate, bytes) or b'-----BEGIN' in certificate:
+            certificate = pem_to_der(certificate)
+        fields = parse_certificate(certificate)
+        self.name = fields['subject']
+        self.name_hash = hashlib.sha1(fields['subject_der']).digest()
+        self.key_hash = hashlib.sha1(fields['public_key']).digest()
+        self._hex = str(hexlify(self.name_hash + self.key_hash).decode())
+
+    def key(self, serial):
+        """
+        Returns the cache key of the certificate with ``serial``.
+        """
+        return ('ocsp', self._hex, '%x' % serial)
+
+
+def encode_request(issuer, serial):
+    """
+    Returns the DER encoding of the OCSP request of a certificate.
+
+    There is no nonce: the responses are cached, so the responder may as well
+    give precomputed ones.
+
+    :param issuer: The :class:`CertificateID` of its issuer.
+    :param serial: Its serial number.
+    """
+    cert_id = encode(TAG_SEQUENCE, _SHA1_ALGORITHM,
+                     encode(TAG_OCTET_STRING, issuer.name_hash),
+                     encode(TAG_OCTET_STRING, issuer.key_hash),
+                     encode_integer(serial))
+    request_list = encode(TAG_SEQUENCE, encode(TAG_SEQUENCE, cert_id))
+    return encode(TAG_SEQUENCE, encode(TAG_SEQUENCE, request_list))
+
+
+def parse_response(der):
+    """
+    Returns the single responses of an OCSP response: a list of dictionaries
+    with the ``name_hash``, ``key_hash`` and ``serial`` of the certificate,
+    its ``status`` (:data:`STATUS_GOOD`, :data:`STATUS_REVOKED` or
+    :data:`STATUS_UNKNOWN`) and the ``this_update`` and ``next_update`` times
+    (in seconds since the epoch, ``next_update`` may be ``None``).
+
+    The signature is not checked.
+
+    :param der: The DER encoding of the response.
+
+    :raise OCSPError: When the responder did not succeed.
+    :raise DERError: When the response cannot be read.
+    """
+    data = bytearray(der)
+    start, end = expect(data, 0, len(data), TAG_SEQUENCE)
+    status_start, status_end = expect(data, start, end, TAG_ENUMERATED)
+    status = parse_integer(data, status_start, status_end)
+    if status != 0:
+        raise OCSPError('The responder answered %s' %
+                        _RESPONSE_STATUSES.get(status, status))
+    start, end = expect(data, status_end, end, TAG_CONTEXT_0)
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    oid_start, oid_end = expect(data, start, end, TAG_OID)
+    if parse_oid(data, oid_start, oid_end) != OID_BASIC_RESPONSE:
+        raise DERError('Unsupported response type')
+    start, end = expect(data, oid_end, end, TAG_OCTET_STRING)
+    # BasicOCSPResponse, then its ResponseData
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    start, end = expect(data, start, end, TAG_SEQUENCE)
+    elements = list(children(data, start, end))
+    if elements and elements[0][0] == TAG_CONTEXT_0:
+        elements = elements[1:]
+    # The responder ID, the time it was produced and the responses
+    if len(elements) < 3 or elements[2][0] != TAG_SEQUENCE:
+        raise DERError('Invalid OCSP response')
+    return [_parse_single_response(data, single_start, single_end)
+            for tag, single_start, single_end
+            in children(data, elements[2][1], elements[2][2])
+            if tag == TAG_SEQUENCE]
+
+
+def _parse_single_response(data, start, end):
+    elements = list(children(data, start, end))
+    if (len(elements) < 3 or elements[0][0] != TAG_SEQUENCE or
+            elements[1][0] not in _CERT_STATUSES):
+        raise DERError('Invalid single response')
+    cert_id = list(children(data, elements[0][1], elements[0][2]))
+    if len(cert_id) != 4 or cert_id[3][0] != TAG_INTEGER:
+        raise DERError('Invalid certificate ID')
+    algorithm = cert_id[0]
+    oid_start, oid_end = expect(data, algorithm[1], algorithm[2], TAG_OID)
+    if parse_oid(data, oid_start, oid_end) != OID_SHA1:
+        raise DERError('Unsupported hash algorithm')
+    if elements[2][0] != TAG_GENERALIZED_TIME:
+        raise DERError('Invalid single response')
+    next_update = None
+    for tag, element_start, element_end in elements[3:]:
+        if tag == TAG_CONTEXT_0:
+            next_update = parse_time(
+                data, *read(data, element_start, element_end))
+    return {
+        'name_hash': bytes(data[cert_id[1][1]:cert_id[1][2]]),
+        'key_hash': bytes(data[cert_id[2][1]:cert_id[2][2]]),
+        'serial': parse_integer(data, cert_id[3][1], cert_id[3][2]),
+        'status': _CERT_STATUSES[elements[1][0]],
+        'this_update': parse_time(data, *elements[2]),
+        'next_update': next_update,
+    }
+
+
+def http_fetch(url, request, timeout):
+    """
+    Sends an OCSP request with a HTTP POST. Returns the body of the answer.
+    The certificates of the HTTPS responders are verified with the default
+    certificate authorities of the system.
+
+    :param url: The URL of the responder.
+    :param request: The DER encoding of the request.
+    :param timeout: Seconds to wait for each network operation.
+    """
+    answer = urlopen(Request(url, request,
+                             {'Content-Type': CONTENT_TYPE_REQUEST}),
+                     timeout=timeout)
+    try:
+        return answer.read()
+    finally:
+        answer.close()
+
+
+class _Fetch(object):
+    """
+    A request to the responder, which may be waited for.
+    """
+
+    __slots__ = ('issuer', 'serial', 'done')
+
+    def __init__(self, issuer, serial):
+        self.issuer = issuer
+        self.serial = serial
+        self.done = Event()
+
+
+class OCSPChecker(object):
+    """
+    Checks if certificates are revoked with an OCSP responder. It can be the
+    ``revocation`` of :class:`repoze.who.plugins.x509.X509Identifier`, like
+    :class:`repoze.who.plugins.x509.revocation.RevocationChecker`.
+
+    A cached response is refreshed in the background when a request finds it
+    within ``refresh_before`` seconds of its ``nextUpdate``. The requests are
+    sent by up to ``workers`` threads (started when they are first needed,
+    and again in the child processes after a fork), and only once for each
+    certificate at a time.
+    """
+
+    def __init__(self, url, issuers, deadline=1.0, timeout=10,
+                 refresh_before=300, stale_if_error=3600, default_ttl=3600,
+                 cache_size=4096, cache=None, strict=False, workers=2,
+                 clock=system_clock, fetch=http_fetch,
+                 trusted_transport=False):
+        """
+        :param url: The URL of the responder. It must be an HTTPS URL unless
+            ``trusted_transport`` is true.
+        :param issuers: The certificates of the issuers (PEM or DER), whose
+            certificates are checked.
+        :param deadline: Seconds that a request waits for a response that is
+            not cached. The response is still cached when it comes later.
+        :param timeout: Seconds that the workers wait for each network
+            operation.
+        :param refresh_before: Seconds before the ``nextUpdate`` of a response
+            when it is refreshed.
+        :param stale_if_error: Seconds after the ``nextUpdate`` of a response
+            when it is still used while a new one is requested (in the
+            background), or if a new one cannot be obtained.
+        :param default_ttl: Seconds that the responses without
+            ``nextUpdate`` are cached.
+        :param cache_size: The size of the LRU cache of the responses.
+        :param cache: The cache to use instead of creating a LRU cache of
+            ``cache_size`` (e.g., a
+            :class:`repoze.who.plugins.x509.cache.SharedMemoryCache`, so the
+            worker processes of a host share the responses).
+        :param strict: If true, the certificates are considered revoked when
+            they cannot be checked: their issuer is unknown, the responder
+            does not know them or cannot be reached in time.
+        :param workers: The number of threads that send the requests.
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+        :param fetch: Function that sends a request, with the arguments of
+            :func:`http_fetch`.
+        :param trusted_transport: If true, the responses may come through an
+            unauthenticated transport (e.g., plain HTTP). Nobody must be able
+            to change the traffic between the application and the responder
+            (see :mod:`repoze.who.plugins.x509.ocsp`).
+
+        :raise DERError: When one of the certificates cannot be read.
+        :raise ValueError: When the URL is not an HTTPS URL and the transport
+            is not trusted.
+        """
+        if not trusted_transport and not url.lower().startswith('https://'):
+            raise ValueError('The OCSP responses are not signed: use an HTTPS '
+                             'URL, or trusted_transport=True if nobody can '
+                             'change the traffic to %s' % url)
+        self.url = url
+        self.trusted_transport = trusted_transport
+        self.deadline = deadline
+        self.timeout = timeout
+        self.refresh_before = refresh_before
+        self.stale_if_error = stale_if_error
+        self.default_ttl = default_ttl
+        self.strict = strict
+        self.workers = workers
+        self.clock = clock
+        self.fetch = fetch
+        if cache is None:
+            cache = LRUCache(cache_size, clock)
+        self.cache = cache
+        self._issuers = {}
+        for certificate in issuers:
+            issuer = CertificateID(certificate)
+            self._issuers[_issuer_key(issuer.name)] = issuer
+        self._pending = {}
+        self._lock = Lock()
+        self._queue = None
+        self._pid = None
+        self.fetches = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.stale = 0
+
+    def is_revoked(self, issuer_dn, serial):
+        """
+        Checks if a certificate is revoked.
+
+        :param issuer_dn: The distinguished name of the issuer of the
+            certificate (OpenSSL or :rfc:`4514` format).
+        :param serial: The serial number, as an integer or an hexadecimal
+            string (like ``SSL_CLIENT_M_SERIAL``).
+        """
+        if not issuer_dn or serial is None:
+            return self.strict
+        try:
+            issuer = self._issuers.get(_issuer_key(issuer_dn))
+        except ValueError:
+            issuer = None
+        if issuer is None:
+            return self.strict
+        if not isinstance(serial, _INTEGER_TYPES):
+            try:
+                serial = int(serial.replace(':', ''), 16)
+            except ValueError:
+                return self.strict
+
+        entry = self.cache.get(issuer.key(serial))
+        now = self.clock()
+        if entry is not None:
+            if now >= entry[1] - self.refresh_before:
+                self._submit(issuer, serial)
+            if now >= entry[1]:
+                # Past its nextUpdate, but still within stale_if_error: it is
+                # used while the new one is requested.
+                with self._lock:
+                    self.stale += 1
+            return self._revoked(entry[0])
+
+        fetch = self._submit(issuer, serial)
+        if fetch.done.wait(self.deadline):
+            fresh = self.cache.get(issuer.key(serial))
+            if fresh is not None and now < fresh[1]:
+                return self._revoked(fresh[0])
+        else:
+            with self._lock:
+                self.timeouts += 1
+        return self.strict
+
+    def _revoked(self, status):
+        if status == STATUS_UNKNOWN:
+            return self.strict
+        return status == STATUS_REVOKED
+
+    def _submit(self, issuer, serial):
+        """
+        Queues the request of a certificate, unless it is already pending.
+        Returns its :class:`_Fetch`.
+        """
+        key = issuer.key(serial)
+        with self._lock:
+            if self._pid != os.getpid():
+                # A new process (or the first call): its threads are gone
+                self._start()
+            fetch = self._pending.get(key)
+            if fetch is not None:
+                return fetch
+            fetch = self._pending[key] = _Fetch(issuer, serial)
+            self._queue.put(fetch)
+        return fetch
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._pending = {}
+        self._queue = queue = Queue()
+        for number in range(self.workers):
+            thread = Thread(target=self._run, args=(queue,),
+                            name='x509-ocsp-%d' % number)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, queue):
+        while True:
+            fetch = queue.get()
+            try:
+                self.refresh(fetch.issuer, fetch.serial)
+            except Exception:
+                # Any error, so the worker keeps running
+                with self._lock:
+                    self.errors += 1
+            finally:
+                with self._lock:
+                    if self._pending.get(
+                            fetch.issuer.key(fetch.serial)) is fetch:
+                        del self._pending[fetch.issuer.key(fetch.serial)]
+                fetch.done.set()
+
+    def refresh(self, issuer, serial):
+        """
+        Asks the responder for the status of a certificate and caches it.
+        Returns the status.
+
+        :param issuer: The :class:`CertificateID` of its issuer.
+        :param serial: Its serial number.
+
+        :raise OCSPError: When the responder does not give its status.
+        :raise DERError: When the response cannot be read.
+        """
+        with self._lock:
+            self.fetches += 1
+        try:
+            answer = self.fetch(self.url, encode_request(issuer, serial),
+                                self.timeout)
+        except (EnvironmentError, ValueError) as error:
+            # URLError, HTTPError and socket errors are EnvironmentErrors
+            raise OCSPError('The responder cannot be reached: %s' % error)
+        for response in parse_response(answer):
+            if (response['serial'] == serial and
+                    response['name_hash'] == issuer.name_hash and
+                    response['key_hash'] == issuer.key_hash):
+                break
+        else:
+            raise OCSPError('The response does not have the certificate')
+
+        now = self.clock()
+        next_update = response['next_update']
+        if next_update is None:
+            next_update = now + self.default_ttl
+        if next_update > now:
+            self.cache.set(issuer.key(serial), (response['status'],
+                                                next_update),
+                           next_update + self.stale_if_error)
+        return response['status']
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``fetches`` sent to the
+        responder, the ones that failed (``errors``), the requests that did
+        not get a response in time (``timeouts``) and the ones that used a
+        ``stale`` response.
+        """
+        with self._lock:
+            return {'fetches': self.fetches, 'errors': self.errors,
+                    'timeouts': self.timeouts, 'stale': self.stale}
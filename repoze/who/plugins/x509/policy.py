@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Certificate policies: rules about the subject, the issuer and the validity
+range of the client certificate, per route of the application::
+
+    policy = CertificatePolicy(
+        rules=['issuer.O = Example Corp'],
+        routes=[
+            ('/admin', ['issuer.O = Example Corp',
+                        'subject.OU in Sales, Support',
+                        'expires > 7d']),
+        ])
+    if not policy.allows(environ):
+        ...
+
+A rule is a string (or a tuple of its three parts):
+
+* ``subject.<type> <operator> <values>`` and ``issuer.<type> <operator>
+  <values>``, where the operator is ``=``, ``!=``, ``in`` or ``not in`` and
+  the values of ``in`` are separated by commas. ``=`` and ``in`` hold when
+  one of the values of the attribute is given, ``!=`` and ``not in`` when
+  none is. The values are compared without case, and the types by any of
+  their names (e.g., ``Email`` and ``emailAddress``). The rules about a
+  distinguished name that is missing or invalid never hold.
+* ``expires > <duration>``, ``expires < <duration>``, ``issued >
+  <duration>`` and ``issued < <duration>`` compare the time until the end of
+  the validity range (or since its start) with a duration in seconds, or with
+  the ``s``, ``m``, ``h``, ``d`` or ``w`` suffixes. They never hold if the
+  date is missing or invalid.
+
+The rules are compiled when the policy is created. Each certificate is parsed
+once for all of the routes, and its decisions are cached as the time window
+in which each route accepts it, so the following requests only compare the
+current time.
+"""
+
+import re
+
+from .cache import LRUCache
+from .clock import system_clock
+from .utils import (openssl_date_to_epoch, parse_dn, ISSUER_DN_KEY,
+                    SUBJECT_DN_KEY, VALIDITY_START_KEY, VALIDITY_END_KEY,
+                    VERIFY_KEY, _TYPE_ALIASES)
+
+
+__all__ = ['CertificatePolicy', 'compile_rules', 'PolicyError']
+
+
+_DN_RULE_REGEX = re.compile(
+    r'^\s*(subject|issuer)\.([\w.-]+)\s*(=|!=|not\s+in\b|in\b)\s*(.*?)\s*$')
+_TIME_RULE_REGEX = re.compile(r'^\s*(expires|issued)\s*([<>])\s*(\S+)\s*$')
+_DURATION_REGEX = re.compile(r'^(\d+(?:\.\d*)?)([smhdw]?)$')
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400,
+                   'w': 604800}
+_DN_OPERATORS = frozenset(['=', '!=', 'in', 'not in'])
+_TIME_OPERATORS = frozenset(['<', '>'])
+_INFINITY = float('inf')
+_NEVER = (False, _INFINITY, -_INFINITY)
+
+
+class PolicyError(ValueError):
+    """
+    Exception raised when a rule is invalid.
+    """
+
+
+def _canonical_type(type_):
+    type_ = type_.lower()
+    return _TYPE_ALIASES.get(type_, type_)
+
+
+def _parse_duration(value):
+    if isinstance(value, (int, float)):
+        return value
+    match = _DURATION_REGEX.match(value.strip().lower())
+    if match is None:
+        raise PolicyError('Invalid duration: %r' % (value,))
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _split_rule(rule):
+    """
+    Returns the three parts of a rule given as a string.
+    """
+    match = _DN_RULE_REGEX.match(rule)
+    if match is not None:
+        name, type_, operator, values = match.groups()
+        operator = ' '.join(operator.split())
+        return ('%s.%s' % (name, type_), operator, values)
+    match = _TIME_RULE_REGEX.match(rule)
+    if match is not None:
+        return match.groups()
+    raise PolicyError('Invalid rule: %r' % (rule,))
+
+
+def _dn_check(index, type_, operator, values):
+    """
+    Returns the function that checks a rule against the names of a
+    certificate (a tuple with the attributes of the subject and the issuer).
+    """
+    values = frozenset(value.lower() for value in values)
+    present = operator in ('=', 'in')
+
+    def check(names):
+        attributes = names[index]
+        if attributes is None:
+            return False
+        return values.isdisjoint(attributes.get(type_, ())) != present
+    return check
+
+
+def compile_rules(rules):
+    """
+    Compiles the rules of a route. Returns a tuple with the functions that
+    check the distinguished names and the bounds of the time rules, as
+    ``(checks, expires_above, expires_below, issued_above, issued_below)``
+    (``None`` for the bounds without rules).
+
+    :param rules: Iterable of rules (strings or ``(name, operator, value)``
+        tuples, see :mod:`repoze.who.plugins.x509.policy`).
+
+    :raise PolicyError: When one of the rules is invalid.
+    """
+    checks = []
+    bounds = {}
+    for rule in rules:
+        if isinstance(rule, tuple):
+            try:
+                name, operator, value = rule
+            except ValueError:
+                raise PolicyError('Invalid rule: %r' % (rule,))
+        else:
+            name, operator, value = _split_rule(rule)
+
+        if name in ('expires', 'issued'):
+            if operator not in _TIME_OPERATORS:
+                raise PolicyError('Invalid operator in rule: %r' % (rule,))
+            duration = _parse_duration(value)
+            # Only the strictest bound of each kind matters
+            key = (name, operator)
+            strictest = max if operator == '>' else min
+            bounds[key] = strictest(bounds.get(key, duration), duration)
+            continue
+
+        dn_name, _, type_ = name.partition('.')
+        if dn_name not in ('subject', 'issuer') or not type_:
+            raise PolicyError('Invalid name in rule: %r' % (rule,))
+        if operator not in _DN_OPERATORS:
+            raise PolicyError('Invalid operator in rule: %r' % (rule,))
+        if operator in ('=', '!='):
+            values = [value]
+        elif hasattr(value, 'split'):
+            values = [item.strip() for item in value.split(',')]
+        else:
+            values = list(value)
+        if not values or not all(values):
+            raise PolicyError('Empty value in rule: %r' % (rule,))
+        checks.append(_dn_check(0 if dn_name == 'subject' else 1,
+                                _canonical_type(type_), operator, values))
+
+    return (tuple(checks), bounds.get(('expires', '>')),
+            bounds.get(('expires', '<')), bounds.get(('issued', '>')),
+            bounds.get(('issued', '<')))
+
+
+def _attributes(dn, parse):
+    """
+    Returns the values of a distinguished name in lower case, by the
+    canonical name of their types (``None`` if it is missing or invalid).
+    """
+    if not dn:
+        return None
+    try:
+        parsed = parse(dn)
+    except ValueError:
+        return None
+    attributes = {}
+    for type_, values in parsed.items():
+        type_ = _canonical_type(type_)
+        attributes[type_] = attributes.get(type_, frozenset()).union(
+            value.lower() for value in values)
+    return attributes
+
+
+def _epoch(value):
+    if not value:
+        return None
+    try:
+        return openssl_date_to_epoch(value)
+    except ValueError:
+        return None
+
+
+def _window(compiled, names, start, end):
+    """
+    Returns the decision of a route for a certificate, as ``(accepted,
+    not_before, not_after)``: it is accepted between those times.
+    """
+    (checks, expires_above, expires_below, issued_above,
+     issued_below) = compiled
+    for check in checks:
+        if not check(names):
+            return _NEVER
+    lower = -_INFINITY
+    upper = _INFINITY
+    if expires_above is not None or expires_below is not None:
+        if end is None:
+            return _NEVER
+        if expires_above is not None:
+            upper = end - expires_above
+        if expires_below is not None:
+            lower = end - expires_below
+    if issued_above is not None or issued_below is not None:
+        if start is None:
+            return _NEVER
+        if issued_above is not None:
+            lower = max(lower, start + issued_above)
+        if issued_below is not None:
+            upper = min(upper, start + issued_below)
+    return (lower < upper, lower, upper)
+
+
+class CertificatePolicy(object):
+    """
+    The rules that the client certificates must follow, by route of the
+    application (see :mod:`repoze.who.plugins.x509.policy`).
+    """
+
+    def __init__(self, rules=(), routes=(), subject_dn_key=SUBJECT_DN_KEY,
+                 issuer_dn_key=ISSUER_DN_KEY, verify_key=VERIFY_KEY,
+                 start_key=VALIDITY_START_KEY, end_key=VALIDITY_END_KEY,
+                 dn_cache=None, cache_size=1024, cache=None,
+                 clock=system_clock):
+        """
+        :param rules: The rules of the paths that are not in any route. By
+            default every certificate is accepted there.
+        :param routes: Iterable of ``(path, rules)`` pairs. A route applies to
+            its path and the paths below it, and the longest one wins. Its
+            rules replace the ones given in ``rules``.
+        :param subject_dn_key: The WSGI environment key for the subject
+            distinguished name.
+        :param issuer_dn_key: The WSGI environment key for the issuer
+            distinguished name.
+        :param verify_key: The WSGI environment key where the server says if
+            the client certificate is valid. The certificates that it did not
+            verify never follow the rules.
+        :param start_key: The WSGI environment key with the encoded datetime of
+            the start of the validity range.
+        :param end_key: The WSGI environment key with the encoded datetime of
+            the end of the validity range.
+        :param dn_cache: Optional
+            :class:`repoze.who.plugins.x509.utils.CachedDNParser` used to
+            parse the names (e.g., the ``dn_cache`` of the identifier).
+        :param cache_size: The number of certificates whose decisions are
+            kept in a LRU cache.
+        :param cache: The cache to use instead of a :class:`LRUCache` of
+            ``cache_size`` (any
+            :class:`repoze.who.plugins.x509.cache.CacheBackend`).
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+
+        :raise PolicyError: When one of the rules is invalid.
+        """
+        self.subject_dn_key = subject_dn_key
+        self.issuer_dn_key = issuer_dn_key
+        self.verify_key = verify_key
+        self.start_key = start_key
+        self.end_key = end_key
+        self.clock = clock
+        self._parse = parse_dn if dn_cache is None else dn_cache
+        if cache is None:
+            cache = LRUCache(cache_size, timer=clock)
+        self.cache = cache
+
+        compiled = [compile_rules(rules)]
+        paths = []
+        for path, route_rules in routes:
+            paths.append((path.rstrip('/'), len(compiled)))
+            compiled.append(compile_rules(route_rules))
+        self._compiled = tuple(compiled)
+        # The longest paths first
+        paths.sort(key=lambda item: len(item[0]), reverse=True)
+        self._paths = tuple(paths)
+        self._routes = {}
+
+    def route(self, path):
+        """
+        Returns the index of the route of a path (0 for the paths that are not
+        in any route).
+
+        :param path: The path (e.g., ``PATH_INFO``).
+        """
+        index = self._routes.get(path)
+        if index is not None:
+            return index
+        index = 0
+        for prefix, route in self._paths:
+            if (not prefix or path == prefix or
+                    path.startswith(prefix + '/')):
+                index = route
+                break
+        routes = self._routes
+        if len(routes) >= 1024:
+            routes = self._routes = {}
+        routes[path] = index
+        return index
+
+    def decisions(self, environ):
+        """
+        Returns the decisions of every route for the certificate of a request
+        (see :meth:`allows`). They are computed from a single parse of the
+        certificate and cached.
+
+        :param environ: The WSGI environment.
+        """
+        key = ('x509-policy', environ.get(self.subject_dn_key),
+               environ.get(self.issuer_dn_key), environ.get(self.start_key),
+               environ.get(self.end_key))
+        decisions = self.cache.get(key)
+        if decisions is None:
+            names = (_attributes(key[1], self._parse),
+                     _attributes(key[2], self._parse))
+            start = _epoch(key[3])
+            end = _epoch(key[4])
+            decisions = tuple(_window(compiled, names, start, end)
+                              for compiled in self._compiled)
+            self.cache.set(key, decisions)
+        return decisions
+
+    def allows(self, environ, path=None):
+        """
+        Checks if the certificate of a request follows the rules of its route.
+        The requests without a subject distinguished name, or whose
+        certificate was not verified by the server, are never accepted.
+
+        :param environ: The WSGI environment.
+        :param path: The path used to find the route. By default it is the
+            ``PATH_INFO`` of the request.
+        """
+        if (not environ.get(self.subject_dn_key) or
+                environ.get(self.verify_key) != 'SUCCESS'):
+            return False
+        if path is None:
+            path = environ.get('PATH_INFO', '')
+        accepted, lower, upper = self.decisions(environ)[self.route(path)]
+        return accepted and lower < self.clock() < upper
+
+    def stats(self):
+        """
+        Returns the statistics of the cache of decisions.
+        """
+        return self.cache.stats()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Replays access logs through :class:`repoze.who.plugins.x509.X509Identifier`
+to measure its throughput offline (``x509-replay`` console script).
+
+By default the last four double-quoted fields of every line are the subject
+DN, the verification result and the start and end of the validity range, as
+written by these formats::
+
+    # Apache
+    LogFormat "%h %l %u %t \\"%r\\" %>s %b \\"%{SSL_CLIENT_S_DN}x\\" \\
+    \\"%{SSL_CLIENT_VERIFY}x\\" \\"%{SSL_CLIENT_V_START}x\\" \\
+    \\"%{SSL_CLIENT_V_END}x\\"" x509
+
+    # Nginx
+    log_format x509 '$remote_addr - $remote_user [$time_local] "$request" '
+                    '$status $body_bytes_sent "$ssl_client_s_dn" '
+                    '"$ssl_client_verify" "$ssl_client_v_start" '
+                    '"$ssl_client_v_end"';
+
+Other layouts can be read with ``--fields`` or ``--pattern``.
+"""
+
+from optparse import OptionParser
+from timeit import default_timer
+import random
+import re
+import sys
+
+from . import X509Identifier
+from .instrumentation import Instrumentation, OUTCOMES
+from .utils import (openssl_date_to_epoch, SUBJECT_DN_KEY, VERIFY_KEY,
+                    VALIDITY_START_KEY, VALIDITY_END_KEY)
+
+
+__all__ = ['main', 'LogReader', 'replay', 'DEFAULT_FIELDS']
+
+DEFAULT_FIELDS = (SUBJECT_DN_KEY, VERIFY_KEY, VALIDITY_START_KEY,
+                  VALIDITY_END_KEY)
+PERCENTILES = (50, 90, 99, 99.9)
+
+# A double-quoted field of Apache or Nginx (with backslash escapes)
+_QUOTED_REGEX = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_ESCAPE_REGEX = re.compile(r'\\(x[0-9A-Fa-f]{2}|.)')
+# Values logged for unset variables
+_EMPTY_VALUES = frozenset(['', '-'])
+
+
+def _unescape_match(match):
+    escaped = match.group(1)
+    if len(escaped) == 3:
+        return chr(int(escaped[1:], 16))
+    return escaped
+
+
+def _unescape(value):
+    if '\\' not in value:
+        return value
+    return _ESCAPE_REGEX.sub(_unescape_match, value)
+
+
+class LogReader(object):
+    """
+    Turns the lines of an access log into minimal WSGI environments.
+    """
+
+    def __init__(self, fields=DEFAULT_FIELDS, pattern=None):
+        """
+        :param fields: The WSGI environment keys of the last double-quoted
+            fields of each line.
+        :param pattern: Regular expression used instead of the quoted fields.
+            The names of its groups are the WSGI environment keys.
+        """
+        self.fields = tuple(fields)
+        self.pattern = re.compile(pattern) if pattern else None
+        self.unparsed = 0
+
+    def environ(self, line):
+        """
+        Returns the WSGI environment of a line (``None`` if it does not have
+        the expected fields).
+        """
+        if self.pattern is not None:
+            match = self.pattern.search(line)
+            if match is None:
+                return None
+            items = match.groupdict().items()
+        else:
+            values = _QUOTED_REGEX.findall(line)
+            if len(values) < len(self.fields):
+                return None
+            items = zip(self.fields, values[len(values) - len(self.fields):])
+
+        environ = {}
+        for key, value in items:
+            if value is not None and value not in _EMPTY_VALUES:
+                environ[key] = _unescape(value)
+        return environ
+
+    def read(self, lines):
+        """
+        Yields the WSGI environments of the lines, skipping (and counting in
+        ``unparsed``) the ones that cannot be read.
+        """
+        for line in lines:
+            environ = self.environ(line)
+            if environ is None:
+                self.unparsed += 1
+            else:
+                yield environ
+
+
+def replay(identifier, environs, batch=False, sample_size=100000,
+           timer=default_timer):
+    """
+    Identifies every environment and measures it. Returns a dictionary with
+    the number of ``requests``, the total ``elapsed`` seconds spent in the
+    identifier and a sorted ``sample`` of the latency of each call (a uniform
+    sample of at most ``sample_size`` calls, so the memory is bounded).
+
+    :param identifier: The :class:`X509Identifier`.
+    :param environs: Iterable of WSGI environments.
+    :param batch: Use :meth:`X509Identifier.identify_many` instead of calling
+        ``identify`` for each environment.
+    """
+    sample = []
+    requests = 0
+    elapsed = 0.0
+    if batch:
+        # Feed identify_many one environment at a time, so reading the log is
+        # not measured as part of the calls.
+        pending = []
+
+        def feed():
+            while True:
+                yield pending.pop()
+
+        results = identifier.identify_many(feed())
+
+        def call(environ):
+            pending.append(environ)
+            return next(results)
+    else:
+        call = identifier.identify
+
+    for environ in environs:
+        started = timer()
+        call(environ)
+        latency = timer() - started
+        elapsed += latency
+        requests += 1
+        if len(sample) < sample_size:
+            sample.append(latency)
+        else:
+            index = random.randint(0, requests - 1)
+            if index < sample_size:
+                sample[index] = latency
+
+    sample.sort()
+    return {'requests': requests, 'elapsed': elapsed, 'sample': sample}
+
+
+def percentile(sample, percent):
+    """
+    Returns the percentile of a sorted sample (``None`` if it is empty).
+    """
+    if not sample:
+        return None
+    index = int(round(percent / 100.0 * (len(sample) - 1)))
+    return sample[index]
+
+
+def report(result, counters, unparsed, wall, out):
+    """
+    Writes the report of a replay. The outcomes are only written if there are
+    ``counters`` (``None`` when the identifier was not instrumented).
+    """
+    requests = result['requests']
+    out.write('requests:    %d (%d unparsed lines)\n' % (requests, unparsed))
+    out.write('wall time:   %.3f s (%.0f requests/s)\n' % (
+        wall, requests / wall if wall else 0))
+    out.write('identifier:  %.3f s (%.0f requests/s)\n' % (
+        result['elapsed'],
+        requests / result['elapsed'] if result['elapsed'] else 0))
+
+    if counters is not None:
+        out.write('outcomes:\n')
+        names = list(OUTCOMES) + sorted(set(counters) - set(OUTCOMES))
+        for name in names:
+            count = counters.get(name, 0)
+            if count or name in OUTCOMES:
+                out.write('  %-20s %10d %6.1f%%\n' % (
+                    name, count, 100.0 * count / requests if requests else 0))
+
+    sample = result['sample']
+    if sample:
+        out.write('latency (us):\n')
+        for percent in PERCENTILES:
+            out.write('  p%-19s %10.2f\n' % (
+                ('%g' % percent), percentile(sample, percent) * 1e6))
+        out.write('  %-20s %10.2f\n' % ('max', sample[-1] * 1e6))
+
+
+def _parse_now(value):
+    try:
+        return float(value)
+    except ValueError:
+        return openssl_date_to_epoch(value)
+
+
+def _lines(paths):
+    """
+    Yields the lines of the files as they are read (never the whole file).
+    """
+    for path in paths:
+        if path == '-':
+            for line in sys.stdin:
+                yield line
+            continue
+        with open(path) as log:
+            for line in log:
+                yield line
+
+
+def main(argv=None, out=None):
+    """
+    Entry point of the ``x509-replay`` console script.
+    """
+    if out is None:
+        out = sys.stdout
+    parser = OptionParser(
+        usage='%prog [options] LOG [LOG ...]',
+        description='Replays access logs (use - for the standard input) '
+                    'through X509Identifier and reports its throughput.'
+    )
+    parser.add_option('--fields', default=','.join(DEFAULT_FIELDS),
+                      help='comma separated WSGI keys of the last quoted '
+                           'fields of each line (default: %default)')
+    parser.add_option('--pattern',
+                      help='regular expression whose named groups are the '
+                           'WSGI keys (instead of --fields)')
+    parser.add_option('--subject-key', default=SUBJECT_DN_KEY,
+                      help='WSGI key of the subject DN (default: %default)')
+    parser.add_option('--login-field', default='Email',
+                      help='DN field used as login (default: %default)')
+    parser.add_option('--multiple-values', action='store_true',
+                      default=False, help='allow multiple login values')
+    parser.add_option('--dn-cache-size', type='int',
+                      help='size of the parsed DN cache')
+    parser.add_option('--identity-cache-size', type='int',
+                      help='size of the verified identity cache')
+    parser.add_option('--negative-cache-size', type='int',
+                      help='size of the rejected certificate cache')
+    parser.add_option('--batch', action='store_true', default=False,
+                      help='use identify_many instead of identify')
+    parser.add_option('--stats', action='store_true', default=False,
+                      help='count the outcomes (instruments the identifier, '
+                           'which makes it slower)')
+    parser.add_option('--now',
+                      help='check the validity ranges at this time (seconds '
+                           'since the epoch or an OpenSSL date) instead of '
+                           'the current time')
+    parser.add_option('--sample-size', type='int', default=100000,
+                      help='latencies kept for the percentiles '
+                           '(default: %default)')
+    options, paths = parser.parse_args(argv)
+    if not paths:
+        parser.error('no log files given')
+
+    kwargs = {}
+    if options.now is not None:
+        try:
+            now = _parse_now(options.now)
+        except ValueError:
+            parser.error('invalid --now: %s' % options.now)
+        kwargs['clock'] = lambda: now
+
+    stats = Instrumentation() if options.stats else None
+    identifier = X509Identifier(
+        options.subject_key,
+        login_field=options.login_field,
+        multiple_values=options.multiple_values,
+        dn_cache_size=options.dn_cache_size,
+        identity_cache_size=options.identity_cache_size,
+        negative_cache_size=options.negative_cache_size,
+        instrumentation=stats,
+        **kwargs
+    )
+    reader = LogReader(options.fields.split(','), options.pattern)
+
+    started = default_timer()
+    result = replay(identifier, reader.read(_lines(paths)),
+                    batch=options.batch, sample_size=options.sample_size)
+    wall = default_timer() - started
+    counters = stats.snapshot()['counters'] if stats is not None else None
+    report(result, counters, reader.unparsed, wall, out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
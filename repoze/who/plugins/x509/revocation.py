@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Revocation checks with local certificate revocation lists (CRL), for when the
+server that verified the certificate cannot be trusted to have up-to-date
+CRLs (e.g., a shared TLS-terminating proxy).
+
+The revoked serial numbers are kept in a :class:`SerialIndex`: a sorted array
+of 64-bit integers (8 bytes per entry), and a packed array of fixed-width
+numbers for the longer serials (indexed by their first 8 bytes), so large CRLs
+use little memory and each lookup is a binary search.
+"""
+
+from array import array
+from binascii import hexlify, unhexlify
+from bisect import bisect_left
+from threading import Lock, Thread
+import os
+
+from .bloom import Prefilter
+from .clock import system_clock
+from .der import DERError, parse_crl, pem_to_der
+from .utils import normalize_dn
+
+
+__all__ = ['RevocationChecker', 'SerialIndex', 'load_crl']
+
+_UINT64_MAX = (1 << 64) - 1
+# long is another integer type in Python 2
+_INTEGER_TYPES = (int, type(_UINT64_MAX))
+
+
+def _uint64_typecode():
+    for typecode in ('Q', 'L'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            # Python 2 does not have 'Q'
+            continue
+    return None  # pragma: no cover
+
+_UINT64 = _uint64_typecode()
+
+
+class SerialIndex(object):
+    """
+    An immutable set of serial numbers, optimized for memory and lookups.
+    """
+
+    __slots__ = ('_narrow', '_prefixes', '_wide', '_width', '_shift',
+                 '_negative', '_size')
+
+    def __init__(self, serials):
+        """
+        :param serials: An iterable of serial numbers (integers).
+        """
+        narrow = []
+        wide = []
+        negative = set()
+        for serial in serials:
+            if serial < 0:
+                # Not valid, but some CAs have issued them
+                negative.add(serial)
+            elif serial <= _UINT64_MAX and _UINT64 is not None:
+                narrow.append(serial)
+            else:
+                wide.append(serial)
+        narrow.sort()
+        self._narrow = _uint64_array(narrow)
+        del narrow
+        # The longer serials are packed with the same width, and their first
+        # 8 bytes are also kept in a sorted array to search them quickly.
+        wide.sort()
+        self._width = max([_byte_length(serial) for serial in wide] + [8])
+        self._shift = 8 * (self._width - 8)
+        self._prefixes = _uint64_array([serial >> self._shift
+                                        for serial in wide])
+        self._wide = b''.join(self._encode(serial) for serial in wide)
+        self._negative = frozenset(negative)
+        self._size = len(self._narrow) + len(wide) + len(negative)
+
+    def _encode(self, serial):
+        return unhexlify('%0*x' % (self._width * 2, serial))
+
+    def __contains__(self, serial):
+        if serial < 0:
+            return serial in self._negative
+        if serial <= _UINT64_MAX and _UINT64 is not None:
+            narrow = self._narrow
+            index = bisect_left(narrow, serial)
+            return index < len(narrow) and narrow[index] == serial
+        if _byte_length(serial) > self._width:
+            return False
+        prefixes = self._prefixes
+        prefix = serial >> self._shift
+        index = bisect_left(prefixes, prefix)
+        if index == len(prefixes) or prefixes[index] != prefix:
+            return False
+        key = self._encode(serial)
+        width = self._width
+        while index < len(prefixes) and prefixes[index] == prefix:
+            if self._wide[index * width:(index + 1) * width] == key:
+                return True
+            index += 1
+        return False
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for serial in self._narrow:
+            yield serial
+        width = self._width
+        for start in range(0, len(self._wide), width):
+            yield int(hexlify(self._wide[start:start + width]), 16)
+        for serial in self._negative:
+            yield serial
+
+
+def _uint64_array(numbers):
+    if _UINT64 is None:  # pragma: no cover
+        return numbers
+    return array(_UINT64, numbers)
+
+
+def _byte_length(number):
+    return (number.bit_length() + 7) // 8
+
+
+def _issuer_key(dn):
+    """
+    Returns a key of a distinguished name that does not depend on its
+    spelling (see :func:`repoze.who.plugins.x509.utils.normalize_dn`), like
+    the issuers of :class:`repoze.who.plugins.x509.issuers.IssuerPolicy`.
+
+    :raise ValueError: When the distinguished name is invalid (or a byte
+        string that is not UTF-8).
+    """
+    if isinstance(dn, bytes):
+        # The WSGI servers of Python 2 give byte strings (UTF-8), while the
+        # names read from the CRL files are unicode.
+        dn = dn.decode('utf-8')
+    return normalize_dn(dn)
+
+
+class _CRL(object):
+    """
+    A loaded CRL file. It is never modified, a new one replaces it.
+    """
+
+    __slots__ = ('path', 'mtime', 'size', 'issuer', 'number', 'next_update',
+                 'index')
+
+    def __init__(self, path, mtime, size, issuer, number, next_update, index):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.issuer = issuer
+        self.number = number
+        self.next_update = next_update
+        self.index = index
+
+
+def load_crl(path, previous=None, bloom_error_rate=None):
+    """
+    Loads a CRL file (DER or PEM). When ``previous`` (the last load of the same
+    file) has the same issuer and CRL number its index is reused instead of
+    building it again.
+
+    :param bloom_error_rate: If given, the index is a
+        :class:`repoze.who.plugins.x509.bloom.Prefilter` with this false
+        positive rate in front of the :class:`SerialIndex`.
+
+    :raise DERError: When the file is not a valid CRL.
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as crl_file:
+        data = crl_file.read()
+    if data.lstrip().startswith(b'-----BEGIN'):
+        data = pem_to_der(data, 'X509 CRL')
+    crl = parse_crl(data)
+    issuer = _issuer_key(crl['issuer'])
+    if (previous is not None and crl['number'] is not None and
+            previous.number == crl['number'] and previous.issuer == issuer):
+        index = previous.index
+    else:
+        index = SerialIndex(crl['serials'])
+        if bloom_error_rate is not None:
+            index = Prefilter(index, index, bloom_error_rate)
+    return _CRL(path, stat.st_mtime, stat.st_size, issuer, crl['number'],
+                crl['next_update'], index)
+
+
+class RevocationChecker(object):
+    """
+    Checks if certificates are revoked with the CRLs of local files.
+
+    The files are checked again every ``check_interval`` seconds, and a CRL
+    is only read again when its modification time or size changes (and its
+    index only rebuilt when its CRL number changes). The new indexes are
+    built in a background thread and swapped in at once, so the requests
+    never wait for a reload; they use the previous CRLs meanwhile. A file
+    that cannot be read keeps its previous CRL.
+
+    The signatures of the CRLs are not checked: the files must come from a
+    trusted source.
+    """
+
+    def __init__(self, paths, check_interval=60, strict=False,
+                 clock=system_clock, background=True, bloom_error_rate=None):
+        """
+        :param paths: The paths of the CRL files (DER or PEM).
+        :param check_interval: Seconds between the checks of the files.
+        :param strict: If true, the certificates are considered revoked when
+            they cannot be checked: their issuer has no CRL, their CRL is
+            past its next update or the serial number is unknown.
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+        :param background: Reload the files in a background thread (otherwise
+            the request that finds them outdated reloads them).
+        :param bloom_error_rate: If given, each CRL has a Bloom filter with
+            this false positive rate, which answers for most of the serial
+            numbers that are not revoked without searching the index (see
+            :class:`repoze.who.plugins.x509.bloom.Prefilter`). It is off by
+            default because the in-memory index is about as fast; it only
+            adds the statistics of the filter.
+
+        :raise DERError: When one of the files is not a valid CRL.
+        :raise OSError: When one of the files cannot be read.
+        """
+        self.paths = tuple(paths)
+        self.check_interval = check_interval
+        self.strict = strict
+        self.clock = clock
+        self.background = background
+        self.bloom_error_rate = bloom_error_rate
+        self._files = {}
+        self._issuers = {}
+        self._reload_lock = Lock()
+        self._schedule_lock = Lock()
+        self._reloader = None
+        self._next_check = 0
+        for path in self.paths:
+            self._files[path] = load_crl(path,
+                                         bloom_error_rate=bloom_error_rate)
+        self._issuers = self._index(self._files)
+        self._next_check = clock() + check_interval
+
+    @staticmethod
+    def _index(files):
+        issuers = {}
+        for crl in files.values():
+            issuers[crl.issuer] = crl
+        return issuers
+
+    def reload(self):
+        """
+        Reads the files that changed since they were loaded. Returns the
+        number of CRLs that were replaced.
+        """
+        with self._reload_lock:
+            return self._reload()
+
+    def _reload(self):
+        files = dict(self._files)
+        replaced = 0
+        for path in self.paths:
+            previous = files.get(path)
+            try:
+                stat = os.stat(path)
+                if (previous is not None and
+                        previous.mtime == stat.st_mtime and
+                        previous.size == stat.st_size):
+                    continue
+                files[path] = load_crl(path, previous,
+                                       self.bloom_error_rate)
+            except (OSError, IOError, DERError):
+                # Maybe it is being written, try again in the next check
+                continue
+            replaced += 1
+        if replaced:
+            issuers = self._index(files)
+            # Readers see either the old or the new CRLs, never a mix
+            self._files, self._issuers = files, issuers
+        self._next_check = self.clock() + self.check_interval
+        return replaced
+
+    def _maybe_reload(self):
+        if self.clock() < self._next_check:
+            return
+        if not self.background:
+            # Only one of the requests reloads, the others go on
+            if self._reload_lock.acquire(False):
+                try:
+                    self._reload()
+                finally:
+                    self._reload_lock.release()
+            return
+        with self._schedule_lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                return
+            self._reloader = Thread(target=self.reload)
+            self._reloader.daemon = True
+            self._reloader.start()
+
+    def is_revoked(self, issuer_dn, serial):
+        """
+        Checks if a certificate is revoked.
+
+        :param issuer_dn: The distinguished name of the issuer of the
+            certificate (OpenSSL or :rfc:`4514` format).
+        :param serial: The serial number, as an integer or an hexadecimal
+            string (like ``SSL_CLIENT_M_SERIAL``).
+        """
+        self._maybe_reload()
+        if not issuer_dn or serial is None:
+            return self.strict
+        try:
+            crl = self._issuers.get(_issuer_key(issuer_dn))
+        except ValueError:
+            crl = None
+        if crl is None:
+            return self.strict
+        if (self.strict and crl.next_update is not None and
+                crl.next_update < self.clock()):
+            return True
+        if not isinstance(serial, _INTEGER_TYPES):
+            try:
+                serial = int(serial.replace(':', ''), 16)
+            except ValueError:
+                return self.strict
+        return serial in crl.index
+
+    def stats(self):
+        """
+        Returns a list with the ``path``, ``number``, ``next_update`` and
+        number of ``revoked`` serials of each loaded CRL, and the statistics
+        of its Bloom filter (``bloom``, see
+        :meth:`repoze.who.plugins.x509.bloom.Prefilter.stats`).
+        """
+        stats = []
+        for crl in self._files.values():
+            crl_stats = {'path': crl.path, 'number': crl.number,
+                         'next_update': crl.next_update,
+                         'revoked': len(crl.index)}
+            if isinstance(crl.index, Prefilter):
+                crl_stats['bloom'] = crl.index.stats()
+            stats.append(crl_stats)
+        return stats
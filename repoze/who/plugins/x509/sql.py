@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+An authenticator that maps the identities of :class:`X509Identifier` to user
+ids with a database table, through any DB-API 2.0 driver.
+
+The lookups share a bounded pool of connections, and their results are
+cached (including the misses, for a shorter time) by a
+:class:`repoze.who.plugins.x509.lookup.CachedLookup`, so the requests of a
+certificate only query the database when its entry expires. Concurrent
+misses of the same certificate make a single query.
+"""
+
+from threading import Condition, Lock
+from timeit import default_timer
+
+from zope.interface import implementer
+from repoze.who.interfaces import IAuthenticator
+
+from .clock import system_clock
+from .lookup import CachedLookup
+
+
+__all__ = ['SQLAuthenticator', 'ConnectionPool', 'PoolTimeout']
+
+# The cache may be shared with other users (e.g., a DN parser)
+_CACHE_PREFIX = 'sql-userid'
+
+
+class PoolTimeout(Exception):
+    """
+    No connection of the pool became available in time.
+    """
+
+
+class ConnectionPool(object):
+    """
+    A bounded, thread-safe pool of DB-API connections. The connections are
+    opened when they are first needed, and reused afterwards.
+    """
+
+    def __init__(self, connect, size=4, timeout=5):
+        """
+        :param connect: Function that opens a new connection.
+        :param size: The maximum number of connections open at once.
+        :param timeout: Seconds to wait for a connection when all of them are
+            in use (``None`` waits forever).
+        """
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._condition = Condition(Lock())
+
+    def acquire(self):
+        """
+        Returns an idle connection, opening one if the pool is not full.
+
+        :raise PoolTimeout: When all the connections are in use for longer
+            than ``timeout``.
+        """
+        with self._condition:
+            if not self._idle and self._open >= self.size:
+                # Other waiters may take the connection first, and wait()
+                # may return early, so it waits again for the rest of the
+                # timeout.
+                if self.timeout is not None:
+                    deadline = default_timer() + self.timeout
+                while not self._idle and self._open >= self.size:
+                    if self.timeout is None:
+                        self._condition.wait()
+                        continue
+                    remaining = deadline - default_timer()
+                    if remaining <= 0:
+                        raise PoolTimeout('No connection available after '
+                                          '%s s' % self.timeout)
+                    self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        try:
+            return self.connect()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection, broken=False):
+        """
+        Gives back a connection to the pool.
+
+        :param connection: The connection returned by :meth:`acquire`.
+        :param broken: If true, the connection is closed instead (e.g., after
+            a database error).
+        """
+        if broken:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._condition:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for connection in idle:
+            connection.close()
+
+
+@implementer(IAuthenticator)
+class SQLAuthenticator(object):
+    """
+    IAuthenticator of the identities of
+    :class:`repoze.who.plugins.x509.X509Identifier` with a database query.
+
+    The identities without a ``subject``, or with a ``password`` (i.e., from
+    other identifiers), are ignored. A database error is not raised: the
+    identity is not authenticated, and the error is counted (see
+    :meth:`stats`).
+    """
+
+    def __init__(self, connect, query, key='subject', prewarm_query=None,
+                 pool_size=4, pool_timeout=5, cache_ttl=300,
+                 negative_cache_ttl=30, stale_ttl=0, deadline=None,
+                 cache_size=10000, cache=None, clock=system_clock):
+        """
+        :param connect: Function that opens a new DB-API connection.
+        :param query: The query of the user id, with one parameter for the
+            key in the style of the driver (e.g.,
+            ``SELECT userid FROM certificates WHERE subject = ?``). It is
+            always sent with the same text, so the drivers that cache their
+            prepared statements only prepare it once.
+        :param key: The credential looked up: ``subject`` or ``login`` (with
+            multiple values, the first one that is found).
+        :param prewarm_query: Optional query of every ``(key, userid)`` pair,
+            which fills the cache when :meth:`prewarm` is called.
+        :param pool_size: The maximum number of open connections.
+        :param pool_timeout: Seconds that a request waits for a connection.
+        :param cache_ttl: Seconds that the found user ids are cached.
+        :param negative_cache_ttl: Seconds that the keys that are not found
+            are cached.
+        :param stale_ttl: Seconds after the expiration of an entry that it is
+            still used while it is queried again in the background.
+        :param deadline: Seconds that a request waits for a query (by default
+            until it finishes). The identities whose query takes longer are
+            not authenticated.
+        :param cache_size: The size of the LRU cache of the results.
+        :param cache: The cache to use instead of creating a LRU cache of
+            ``cache_size`` (any
+            :class:`repoze.who.plugins.x509.cache.CacheBackend`).
+        :param clock: Function that returns the current time in seconds since
+            the epoch.
+
+        :raise ValueError: When ``key`` is not supported.
+        """
+        if key not in ('subject', 'login'):
+            raise ValueError('The key must be subject or login')
+        self.query = query
+        self.key = key
+        self.prewarm_query = prewarm_query
+        self.pool = ConnectionPool(connect, pool_size, pool_timeout)
+        self.queries = 0
+        self._lock = Lock()
+        self._lookup = CachedLookup(
+            self._query, ttl=cache_ttl, negative_ttl=negative_cache_ttl,
+            stale_ttl=stale_ttl, deadline=deadline, cache_size=cache_size,
+            cache=cache, prefix=_CACHE_PREFIX, clock=clock
+        )
+        self.cache = self._lookup.cache
+
+    # IAuthenticator
+    def authenticate(self, environ, identity):
+        """
+        Returns the user id of an identity (``None`` if it is not found).
+
+        :param environ: The WSGI environment.
+        :param identity: The identity (the credentials of
+            :class:`repoze.who.plugins.x509.X509Identifier`).
+        """
+        if identity.get('subject') is None or 'password' in identity:
+            return None
+        values = identity.get(self.key)
+        if not values:
+            return None
+        if not isinstance(values, list):
+            return self.lookup(values)
+        for value in values:
+            userid = self.lookup(value)
+            if userid is not None:
+                return userid
+        return None
+
+    def lookup(self, value):
+        """
+        Returns the user id of a key (``None`` if it is not found), from the
+        cache or the database.
+        """
+        try:
+            return self._lookup(value)
+        except Exception:
+            # Any error of the driver or the pool (which have their own
+            # classes), or a LookupTimeout
+            return None
+
+    def _query(self, value):
+        row = self._execute(self.query, (value,), fetch_all=False)
+        if row is None:
+            return None
+        return row[0]
+
+    def _execute(self, query, parameters, fetch_all):
+        with self._lock:
+            self.queries += 1
+        connection = self.pool.acquire()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, parameters)
+                if fetch_all:
+                    result = cursor.fetchall()
+                else:
+                    result = cursor.fetchone()
+            finally:
+                cursor.close()
+        except Exception:
+            self.pool.release(connection, broken=True)
+            raise
+        # The drivers that open a transaction for any statement (e.g.,
+        # psycopg2 or MySQLdb) would keep the idle connection in it, and
+        # return the same snapshot of the tables to the next queries.
+        try:
+            connection.rollback()
+        except Exception:
+            self.pool.release(connection, broken=True)
+        else:
+            self.pool.release(connection)
+        return result
+
+    def prewarm(self):
+        """
+        Fills the cache with every pair of ``prewarm_query``, in one query
+        (e.g., when the application starts). Returns the number of pairs.
+        Database errors are raised.
+        """
+        if self.prewarm_query is None:
+            return 0
+        rows = self._execute(self.prewarm_query, (), fetch_all=True)
+        self._lookup.set_many(rows)
+        return len(rows)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``queries`` (including the
+        failed ones and the prewarm) and the statistics of the lookups (see
+        :meth:`repoze.who.plugins.x509.lookup.CachedLookup.stats`).
+        """
+        stats = self._lookup.stats()
+        with self._lock:
+            stats['queries'] = self.queries
+        return stats
@@ -23,62 +23,549 @@ This module contains utilities related to repoze who x509 plugin.
 
 from dateutil.parser import parse as date_parse
 from dateutil.tz import tzutc
-from datetime import datetime
+from datetime import datetime, timedelta
+from calendar import timegm
+from time import gmtime, time
 import re
 
+from .cache import LRUCache
+from .instrumentation import STAGE_DATES
 
+
+SUBJECT_DN_KEY = 'SSL_CLIENT_S_DN'
 VERIFY_KEY = 'SSL_CLIENT_VERIFY'
 VALIDITY_START_KEY = 'SSL_CLIENT_V_START'
 VALIDITY_END_KEY = 'SSL_CLIENT_V_END'
+ISSUER_DN_KEY = 'SSL_CLIENT_I_DN'
+SERIAL_KEY = 'SSL_CLIENT_M_SERIAL'
+
+# Results of check_certificate
+CERTIFICATE_VALID = 'valid'
+CERTIFICATE_NOT_VERIFIED = 'not_verified'
+CERTIFICATE_INVALID_DATES = 'invalid_dates'
+CERTIFICATE_EXPIRED = 'expired'
+CERTIFICATE_REVOKED = 'revoked'
+CERTIFICATE_ISSUER_DENIED = 'issuer_denied'
 
 # OpenSSL's DNs are separated by /, but the problem is that it may have any
-# escaped characters as value.
+# escaped characters as value. So a RDN only starts with "/type=" (or with
+# "+type=" for multi-valued RDNs).
 # Thanks to David Esperanza
-_DN_SSL_REGEX = re.compile('(/\\s*\\w+=)')
+_DN_SSL_REGEX = re.compile('[/+]\\s*(\\w+)=')
+
+# RFC 4514 (and RFC 2253) attribute type and the characters with a meaning
+# inside of a value.
+_DN_RFC4514_TYPE_REGEX = re.compile('\\s*([\\w.-]+)\\s*=\\s*')
+_DN_RFC4514_SPECIAL_REGEX = re.compile('[,+;\\\\"]')
+_DN_RFC4514_QUOTED_REGEX = re.compile('[\\\\"]')
+_DN_RFC4514_SEPARATORS = frozenset(',+;')
+_DN_RFC4514_SEPARATOR_REGEX = re.compile('[,+;]')
+_DN_RFC4514_TYPE_CHARS_REGEX = re.compile('[\\w.-]+$')
+# The other names of the attribute types, in lower case
+_TYPE_ALIASES = {
+    'commonname': 'cn',
+    'countryname': 'c',
+    'e': 'email',
+    'emailaddress': 'email',
+    'localityname': 'l',
+    'organizationname': 'o',
+    'organizationalunitname': 'ou',
+    's': 'st',
+    'stateorprovincename': 'st',
+}
+
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
 
 _TZ_UTC = tzutc()
+_ZERO = timedelta(0)
+
+# OpenSSL always prints the validity dates as "%b %d %H:%M:%S %Y GMT" with
+# English month names, whatever the locale is.
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+_MONTH_NAMES = sorted(_MONTHS, key=_MONTHS.get)
+_UTC_ZONES = frozenset(['GMT', 'UTC'])
+# Seconds since the epoch at the start of each (year, month) already seen.
+_MONTH_EPOCHS = {}
+_MAX_MONTH_EPOCHS = 4096
 
 
-__all__ = ['parse_dn', 'verify_certificate', 'VERIFY_KEY',
-           'VALIDITY_START_KEY', 'VALIDITY_END_KEY']
+__all__ = ['parse_dn', 'iter_dn', 'find_dn_attribute', 'normalize_dn',
+           'verify_certificate',
+           'check_certificate', 'FrozenDN', 'CachedDNParser',
+           'parse_openssl_date', 'openssl_date_to_epoch',
+           'format_openssl_date', 'SUBJECT_DN_KEY', 'VERIFY_KEY',
+           'VALIDITY_START_KEY', 'VALIDITY_END_KEY', 'ISSUER_DN_KEY',
+           'SERIAL_KEY', 'CERTIFICATE_VALID', 'CERTIFICATE_NOT_VERIFIED',
+           'CERTIFICATE_INVALID_DATES', 'CERTIFICATE_EXPIRED',
+           'CERTIFICATE_REVOKED', 'CERTIFICATE_ISSUER_DENIED']
 
 def parse_dn(dn):
     """
-    Parses a OpenSSL-like distinguished name into a dictionary. The keys are
-    the attribute types and the values are lists (multiple values for that
-    type).
+    Parses a distinguished name into a dictionary. The keys are the attribute
+    types and the values are lists (multiple values for that type).
+
+    It supports both the OpenSSL-like format (``/C=MX/O=company/CN=name``),
+    where the values are returned as they are, and the RFC 4514 format
+    (``CN=name,O=company,C=MX``) used by Nginx and other proxies, where the
+    escaped characters and quoted values are decoded. Multi-valued RDNs (e.g.,
+    ``O=company+CN=name``) are supported in both formats.
 
-    "Multi-values" are not supported (e.g., O=company+CN=name).
-    
     :param dn: The distinguished name.
-    
+
     :raise ValueError: When you input an invalid or empty distinguished name.
     """
+    if dn.startswith('/'):
+        return _parse_openssl_dn(dn)
     parsed = {}
-    split_string = _DN_SSL_REGEX.split(dn)
-    if split_string[0] == '':
-        split_string.pop(0)
-    for i in range(0, len(split_string), 2):
-        try:
-            type_, value = split_string[i][1:-1], split_string[i + 1]
-        except IndexError:
-            raise ValueError('Invalid DN')
+    for type_, value in iter_dn(dn):
+        values = parsed.get(type_)
+        if values is None:
+            parsed[type_] = [value]
+        else:
+            values.append(value)
+    return parsed
+
+
+def iter_dn(dn):
+    """
+    Iterates over the (type, value) pairs of a distinguished name (in any of
+    the formats supported by :func:`parse_dn`). The name is scanned lazily, so
+    the consumer can stop as soon as it finds what it is looking for.
+
+    :param dn: The distinguished name.
+
+    :raise ValueError: When the iteration reaches an invalid part of the
+        distinguished name, or if it is empty.
+    """
+    if dn.startswith('/'):
+        return _iter_openssl_dn(dn)
+    if '\\' in dn or '"' in dn:
+        return _scan_rfc4514_dn(dn)
+    return _iter_simple_rfc4514_dn(dn)
+
+
+def normalize_dn(dn):
+    """
+    Returns a tuple with the (type, value) pairs of a distinguished name that
+    is the same for every spelling of the name: in any of the formats (in the
+    order of the OpenSSL format), with any case of the types and values,
+    with the other names of the types (e.g., ``emailAddress`` for ``Email``),
+    with repeated spaces and with any order of the attributes of
+    multi-valued RDNs (e.g., ``O=Company+OU=Sales``). The attributes of a
+    multi-valued RDN are sorted, and the types of the ones after the first
+    are prefixed with ``+``.
+
+    :param dn: The distinguished name.
+
+    :raise ValueError: When you input an invalid or empty distinguished name.
+    """
+    openssl = dn.startswith('/')
+    if openssl:
+        pairs = list(_iter_openssl_dn(dn))
+        # The separator before each pair
+        separators = [dn[match.start()]
+                      for match in _DN_SSL_REGEX.finditer(dn)]
+    else:
+        separators = []
+        if '\\' in dn or '"' in dn:
+            pairs = list(_scan_rfc4514_dn(dn, separators))
+        else:
+            pairs = list(_iter_simple_rfc4514_dn(dn))
+            separators = _DN_RFC4514_SEPARATOR_REGEX.findall(dn)
+        separators.insert(0, ',')
+
+    rdns = []
+    for separator, (type_, value) in zip(separators, pairs):
+        pair = (_TYPE_ALIASES.get(type_.lower(), type_.lower()),
+                ' '.join(value.split()).lower())
+        if separator == '+' and rdns:
+            rdns[-1].append(pair)
+        else:
+            rdns.append([pair])
+    if not openssl:
+        # RFC 4514 starts with the last RDN
+        rdns.reverse()
+
+    normalized = []
+    for rdn in rdns:
+        if len(rdn) > 1:
+            rdn.sort()
+            rdn[1:] = [('+' + type_, value) for type_, value in rdn[1:]]
+        normalized.extend(rdn)
+    return tuple(normalized)
+
+
+def find_dn_attribute(dn, type_, first_only=False):
+    """
+    Finds the values of an attribute type in a distinguished name without
+    parsing all of it (when possible).
+
+    :param dn: The distinguished name.
+    :param type_: The attribute type (e.g., ``CN``).
+    :param first_only: If true, the scan stops at the first value and it is
+        returned alone (or ``None`` if there is none). Otherwise all the values
+        are returned in a list (which may be empty).
+
+    :raise ValueError: When you input an invalid or empty distinguished name.
+    """
+    if first_only:
+        for found_type, value in iter_dn(dn):
+            if found_type == type_:
+                return value
+        return None
+    if dn.startswith('/'):
+        # A full scan is needed anyway, and splitting is faster than iterating
+        pieces = _split_openssl_pieces(dn)
+        return [pieces[i + 1] for i in range(1, len(pieces), 2)
+                if pieces[i] == type_]
+    return [value for found_type, value in iter_dn(dn) if found_type == type_]
 
+
+def _split_openssl_pieces(dn):
+    """
+    Splits an OpenSSL-like distinguished name into ``['', type, value, type,
+    value...]``.
+    """
+    pieces = _DN_SSL_REGEX.split(dn)
+    if len(pieces) < 3 or pieces[0] != '':
+        raise ValueError('Invalid DN')
+    if '' in pieces[2::2]:
+        raise ValueError('Invalid DN: Invalid value')
+    return pieces
+
+
+def _parse_openssl_dn(dn):
+    # The same split as the parser before RFC 4514 support, so the most
+    # common format is not slower than it was
+    pieces = _DN_SSL_REGEX.split(dn)
+    if len(pieces) < 3 or pieces[0] != '':
+        raise ValueError('Invalid DN')
+    parsed = {}
+    for i in range(1, len(pieces), 2):
+        type_, value = pieces[i], pieces[i + 1]
+        if not value:
+            raise ValueError('Invalid DN: Invalid value')
+        values = parsed.get(type_)
+        if values is None:
+            parsed[type_] = [value]
+        else:
+            values.append(value)
+    return parsed
+
+
+def _iter_openssl_dn(dn):
+    matches = _DN_SSL_REGEX.finditer(dn)
+    match = next(matches, None)
+    if match is None or match.start() != 0:
+        raise ValueError('Invalid DN')
+
+    while match is not None:
+        next_match = next(matches, None)
+        if next_match is None:
+            value = dn[match.end():]
+        else:
+            value = dn[match.end():next_match.start()]
+        if len(value) == 0:
+            raise ValueError('Invalid DN: Invalid value')
+        yield match.group(1), value
+        match = next_match
+
+
+def _iter_simple_rfc4514_dn(dn):
+    for rdn in _DN_RFC4514_SEPARATOR_REGEX.split(dn):
+        type_, equals, value = rdn.partition('=')
+        type_ = type_.strip()
+        if not equals or _DN_RFC4514_TYPE_CHARS_REGEX.match(type_) is None:
+            raise ValueError('Invalid DN')
+        value = value.strip()
         if len(value) == 0:
             raise ValueError('Invalid DN: Invalid value')
+        yield type_, value
 
-        if type_ not in parsed:
-            parsed[type_] = []
-        parsed[type_].append(value)
 
-    if len(parsed) == 0:
+def _scan_rfc4514_dn(dn, separators=None):
+    """
+    Yields the (type, value) pairs of an :rfc:`4514` name with escaped or
+    quoted values. The separators between them are appended to
+    ``separators``, if given.
+    """
+    length = len(dn)
+    pos = 0
+    if len(dn.strip()) == 0:
         raise ValueError('Invalid DN: Empty DN')
 
-    return parsed
+    while True:
+        match = _DN_RFC4514_TYPE_REGEX.match(dn, pos)
+        if match is None:
+            raise ValueError('Invalid DN')
+        pos = match.end()
+        if pos < length and dn[pos] == '"':
+            value, pos = _scan_rfc4514_quoted(dn, pos + 1)
+        else:
+            value, pos = _scan_rfc4514_value(dn, pos)
+        if len(value) == 0:
+            raise ValueError('Invalid DN: Invalid value')
+        yield match.group(1), value
+
+        if pos >= length:
+            return
+        # Skip the separator (",", ";" or "+" for multi-valued RDNs)
+        if separators is not None:
+            separators.append(dn[pos])
+        pos += 1
+
+
+def _scan_rfc4514_value(dn, pos):
+    """
+    Scans an unquoted value starting at ``pos``. Returns the decoded value and
+    the position of the following separator (or the end of the string).
+    """
+    chunks = []
+    while True:
+        match = _DN_RFC4514_SPECIAL_REGEX.search(dn, pos)
+        if match is None:
+            chunks.append(dn[pos:])
+            pos = len(dn)
+            break
+        index = match.start()
+        chunks.append(dn[pos:index])
+        char = dn[index]
+        if char == '\\':
+            escaped, pos = _unescape(dn, index + 1)
+            chunks.append(escaped)
+        elif char == '"':
+            raise ValueError('Invalid DN: Unexpected quote')
+        else:
+            pos = index
+            break
+
+    # Unescaped trailing spaces are not part of the value
+    chunks[-1] = chunks[-1].rstrip()
+    if len(chunks) == 1:
+        return chunks[0], pos
+    return ''.join(chunks), pos
+
+
+def _scan_rfc4514_quoted(dn, pos):
+    """
+    Scans a quoted value (RFC 2253) that starts after the quote at ``pos``.
+    Returns the decoded value and the position of the following separator (or
+    the end of the string).
+    """
+    chunks = []
+    while True:
+        match = _DN_RFC4514_QUOTED_REGEX.search(dn, pos)
+        if match is None:
+            raise ValueError('Invalid DN: Unterminated quoted value')
+        index = match.start()
+        chunks.append(dn[pos:index])
+        if dn[index] == '"':
+            pos = index + 1
+            break
+        escaped, pos = _unescape(dn, index + 1)
+        chunks.append(escaped)
+
+    length = len(dn)
+    while pos < length and dn[pos].isspace():
+        pos += 1
+    if pos < length and dn[pos] not in _DN_RFC4514_SEPARATORS:
+        raise ValueError('Invalid DN: Unexpected data after quoted value')
+    return ''.join(chunks), pos
+
+
+def _unescape(dn, pos):
+    """
+    Decodes the escape sequence after the backslash at ``pos - 1``. A run of
+    hexadecimal pairs (``\\C3\\A9``) is decoded as UTF-8. Returns the decoded
+    string and the position after the escape sequence.
+    """
+    length = len(dn)
+    if pos >= length:
+        raise ValueError('Invalid DN: Incomplete escape sequence')
+    if (dn[pos] not in _HEX_DIGITS or pos + 1 >= length or
+            dn[pos + 1] not in _HEX_DIGITS):
+        return dn[pos], pos + 1
+
+    raw = bytearray([int(dn[pos:pos + 2], 16)])
+    pos += 2
+    while (pos + 2 < length and dn[pos] == '\\' and
+           dn[pos + 1] in _HEX_DIGITS and dn[pos + 2] in _HEX_DIGITS):
+        raw.append(int(dn[pos + 1:pos + 3], 16))
+        pos += 3
+    if isinstance(dn, bytes):
+        return bytes(raw), pos
+    return raw.decode('utf-8'), pos
+
+
+class FrozenDN(dict):
+    """
+    A read-only version of the dictionary returned by :func:`parse_dn`. The
+    values are tuples instead of lists, so it can be shared safely between
+    requests.
+    """
+
+    def __init__(self, parsed):
+        dict.__init__(self, ((type_, tuple(values))
+                             for type_, values in parsed.items()))
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('A parsed distinguished name cannot be modified')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDN, (dict(self),))
+
+
+class CachedDNParser(object):
+    """
+    Memoizing version of :func:`parse_dn`. It keeps the most recently used
+    distinguished names in a bounded :class:`LRUCache`, and returns
+    :class:`FrozenDN` objects so the cached entries cannot be modified by the
+    callers.
+    """
+
+    def __init__(self, maxsize=1024, cache=None):
+        """
+        :param maxsize: The maximum number of distinguished names to keep.
+        :param cache: The cache to use instead of a :class:`LRUCache` of
+            ``maxsize`` (any
+            :class:`repoze.who.plugins.x509.cache.CacheBackend`).
+        """
+        if cache is None:
+            cache = LRUCache(maxsize)
+        self.cache = cache
+
+    def __call__(self, dn):
+        """
+        Parses the distinguished name (or gets it from the cache).
+
+        :param dn: The distinguished name.
+
+        :raise ValueError: When you input an invalid or empty distinguished
+            name.
+        """
+        parsed = self.cache.get(dn)
+        if parsed is None:
+            parsed = FrozenDN(parse_dn(dn))
+            self.cache.set(dn, parsed)
+        return parsed
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def stats(self):
+        """
+        Returns the statistics of the underlying cache (see
+        :meth:`LRUCache.stats`).
+        """
+        return self.cache.stats()
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        self.cache.clear()
+
+
+def _split_openssl_date(value):
+    """
+    Splits an OpenSSL date into a (year, month, day, hour, minute, second)
+    tuple.
+
+    :raise ValueError: If the date is not in the OpenSSL format or it is not
+        in UTC.
+    """
+    try:
+        month, day, time, year, zone = value.split()
+        hour, minute, second = time.split(':')
+        month = _MONTHS[month]
+    except (ValueError, KeyError, AttributeError):
+        raise ValueError('Not an OpenSSL date: %r' % (value,))
+    if zone not in _UTC_ZONES:
+        raise ValueError('Not an UTC date: %r' % (value,))
+    return (int(year), month, int(day), int(hour), int(minute), int(second))
+
+
+def _month_epoch(year, month):
+    """
+    Returns the seconds since the epoch at the start of the given month.
+    """
+    key = (year, month)
+    start = _MONTH_EPOCHS.get(key)
+    if start is None:
+        start = timegm((year, month, 1, 0, 0, 0))
+        if len(_MONTH_EPOCHS) < _MAX_MONTH_EPOCHS:
+            _MONTH_EPOCHS[key] = start
+    return start
+
+
+def parse_openssl_date(value):
+    """
+    Parses a date in the format used by OpenSSL for the certificate validity
+    range (e.g., ``Jan  2 15:04:05 2012 GMT``) into an UTC datetime. If the
+    value is not in that format it falls back to ``dateutil``, so the result
+    may not be in UTC in that case.
+
+    :param value: The encoded datetime.
+
+    :raise ValueError: When the value cannot be parsed at all.
+    """
+    try:
+        return datetime(*_split_openssl_date(value), tzinfo=_TZ_UTC)
+    except ValueError:
+        return date_parse(value)
+
+
+def openssl_date_to_epoch(value):
+    """
+    Converts a date in the format used by OpenSSL for the certificate validity
+    range into seconds since the epoch. If the value is not in that format it
+    falls back to ``dateutil``.
+
+    :param value: The encoded datetime.
+
+    :raise ValueError: When the value cannot be parsed or it is not in UTC.
+    """
+    try:
+        year, month, day, hour, minute, second = _split_openssl_date(value)
+    except ValueError:
+        parsed = date_parse(value)
+        # dateutil < 2.0 parses "Z" as the local time zone when it is UTC
+        if parsed.utcoffset() != _ZERO:
+            raise ValueError('Not an UTC date: %r' % (value,))
+        return timegm(parsed.utctimetuple())
+    if not (1 <= day <= 31 and hour < 24 and minute < 60 and second < 61):
+        raise ValueError('Invalid OpenSSL date: %r' % (value,))
+    return (_month_epoch(year, month) + (day - 1) * 86400 + hour * 3600 +
+            minute * 60 + second)
+
+
+def format_openssl_date(epoch):
+    """
+    Formats seconds since the epoch as a date of the validity range in the
+    format used by OpenSSL (e.g., ``Jan  2 15:04:05 2012 GMT``).
+
+    :param epoch: The seconds since the epoch.
+    """
+    parts = gmtime(epoch)
+    return '%s %2d %02d:%02d:%02d %d GMT' % (
+        _MONTH_NAMES[parts.tm_mon - 1], parts.tm_mday, parts.tm_hour,
+        parts.tm_min, parts.tm_sec, parts.tm_year
+    )
 
 
 def verify_certificate(environ, verify_key, validity_start_key,
-                       validity_end_key):
+                       validity_end_key, clock=None):
     """
     Checks if the client certificate is valid. Start and end data is optional,
     as not all SSL mods give that information.
@@ -90,23 +577,68 @@ def verify_certificate(environ, verify_key, validity_start_key,
         the encoded datetime that indicates the start of the validity range.
     :param validity_end_key: The key for the value in the environment with the
         encoded datetime that indicates the end of the validity range.
+    :param clock: Function that returns the current time in seconds since the
+        epoch (see :mod:`repoze.who.plugins.x509.clock`). By default it is
+        :func:`time.time`.
+    """
+    return check_certificate(
+        environ,
+        verify_key,
+        validity_start_key,
+        validity_end_key,
+        clock=clock
+    ) == CERTIFICATE_VALID
+
+
+def check_certificate(environ, verify_key, validity_start_key,
+                      validity_end_key, instrumentation=None, clock=None):
+    """
+    Like :func:`verify_certificate`, but it tells why the certificate is not
+    valid. It returns one of:
+
+    * ``CERTIFICATE_VALID``
+    * ``CERTIFICATE_NOT_VERIFIED``: The server did not verify it.
+    * ``CERTIFICATE_INVALID_DATES``: The validity range is not in UTC (or it
+      cannot be parsed).
+    * ``CERTIFICATE_EXPIRED``: The current time is outside of the validity
+      range.
+
+    :param environ: The WSGI environment.
+    :param verify_key: The key for the value in the environment where it was
+        stored if the certificate is valid or not.
+    :param validity_start_key: The key for the value in the environment with
+        the encoded datetime that indicates the start of the validity range.
+    :param validity_end_key: The key for the value in the environment with the
+        encoded datetime that indicates the end of the validity range.
+    :param instrumentation: Optional
+        :class:`repoze.who.plugins.x509.instrumentation.Instrumentation` that
+        times the parsing of the dates.
+    :param clock: Function that returns the current time in seconds since the
+        epoch. By default it is :func:`time.time`.
     """
     verified = environ.get(verify_key)
     validity_start = environ.get(validity_start_key)
     validity_end = environ.get(validity_end_key)
     if verified != 'SUCCESS':
-        return False
+        return CERTIFICATE_NOT_VERIFIED
 
     if validity_start is None or validity_end is None:
-        return True
+        return CERTIFICATE_VALID
 
-    validity_start = date_parse(validity_start)
-    validity_end = date_parse(validity_end)
-
-    if validity_start.tzinfo != _TZ_UTC or validity_end.tzinfo != _TZ_UTC:
+    if instrumentation is not None:
+        started = instrumentation.timer()
+    try:
+        validity_start = openssl_date_to_epoch(validity_start)
+        validity_end = openssl_date_to_epoch(validity_end)
+    except ValueError:
         # Can't consider other timezones
-        return False
-
-    now = datetime.utcnow().replace(tzinfo=_TZ_UTC)
-    return validity_start <= now <= validity_end
+        return CERTIFICATE_INVALID_DATES
+    finally:
+        if instrumentation is not None:
+            instrumentation.timing(STAGE_DATES,
+                                   instrumentation.timer() - started)
 
+    now = time() if clock is None else clock()
+    if validity_start <= now <= validity_end:
+        return CERTIFICATE_VALID
+    return CERTIFICATE_EXPIRED
@@ -17,7 +17,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Command
 from ez_setup import use_setuptools
 import os
 
@@ -27,6 +27,37 @@ here = os.path.abspath(os.path.dirname(__file__))
 readme = open(os.path.join(here, 'README')).read()
 version = open(os.path.join(here, 'VERSION')).readline().strip()
 
+
+class Benchmark(Command):
+    """Runs the benchmark suite (see benchmarks/suite.py)."""
+
+    description = 'run the benchmark suite'
+    user_options = [
+        ('number=', 'n', 'calls per measurement'),
+        ('repeat=', 'r', 'measurements per operation'),
+        ('cases=', 'c', 'comma separated list of cases to run'),
+    ]
+
+    def initialize_options(self):
+        self.number = 10000
+        self.repeat = 3
+        self.cases = None
+
+    def finalize_options(self):
+        self.number = int(self.number)
+        self.repeat = int(self.repeat)
+        if self.cases:
+            self.cases = self.cases.split(',')
+
+    def run(self):
+        if self.distribution.install_requires:
+            self.distribution.fetch_build_eggs(
+                self.distribution.install_requires
+            )
+        from benchmarks.suite import run
+        run(self.cases, self.number, self.repeat)
+
+
 setup(name='repoze.who-x509',
       version=version,
       description='x509 repoze.who plugin',
@@ -48,7 +79,8 @@ setup(name='repoze.who-x509',
       url='http://www.ckluster.com/',
       license='Modified BSD License (http://www.ckluster.com/OPEN_LICENSE.txt)',
       packages=find_packages(exclude=['*.tests', '*.tests.*', 'tests.*',
-                                      'tests']),
+                                      'tests', 'benchmarks',
+                                      'benchmarks.*']),
       include_package_data=True,
       zip_safe=True,
       tests_require=[
@@ -63,5 +95,10 @@ setup(name='repoze.who-x509',
       ],
       setup_requires=['nose>=1.0'],
       test_suite='nose.collector',
-      entry_points=''
+      cmdclass={'benchmark': Benchmark},
+      entry_points={
+          'console_scripts': [
+              'x509-replay = repoze.who.plugins.x509.replay:main',
+          ],
+      }
 )
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Certificates and CRLs used by the tests.
+"""
+
+# The self-signed certificate of /C=US/O=Company/CN=Issuer
+ISSUER_CERTIFICATE = '''\
+-----BEGIN CERTIFICATE-----
+MIIBtDCCAVugAwIBAgIUdxCcFtcRyQ4urv2Ce4U36S26fwQwCgYIKoZIzj0EAwIw
+MDELMAkGA1UEBhMCVVMxEDAOBgNVBAoMB0NvbXBhbnkxDzANBgNVBAMMBklzc3Vl
+cjAeFw0yNjEwMTgxMDI3MTBaFw00NjEwMTMxMDI3MTBaMDAxCzAJBgNVBAYTAlVT
+MRAwDgYDVQQKDAdDb21wYW55MQ8wDQYDVQQDDAZJc3N1ZXIwWTATBgcqhkjOPQIB
+BggqhkjOPQMBBwNCAATYLGMI5lB69NgbdLnwMxKOtwoP2zJb44bMaFi/GHfvPSol
+Q5ErzbDaDXKlVK/iScv18th3wN+BTJ8JpYUrD4Woo1MwUTAdBgNVHQ4EFgQUpWmR
+QujS5IuJGoaDhiFcLfTGDXowHwYDVR0jBBgwFoAUpWmRQujS5IuJGoaDhiFcLfTG
+DXowDwYDVR0TAQH/BAUwAwEB/zAKBggqhkjOPQQDAgNHADBEAiB3t678FuAptAVa
+jQ7gs/L8HKfdxEYA/6J6CjMbI7JfdgIgahWhLctAngb+ZdGzurOF1J+KVIQdB9Xj
+qAYCrMaDLc8=
+-----END CERTIFICATE-----
+'''
+
+# Issued by /C=US/O=Company/CN=Issuer, serial 0x1000, valid from
+# Jan  1 00:00:00 2012 GMT to Jan  1 00:00:00 2030 GMT
+CLIENT_CERTIFICATE = '''\
+-----BEGIN CERTIFICATE-----
+MIIBjjCCATQCAhAAMAoGCCqGSM49BAMCMDAxCzAJBgNVBAYTAlVTMRAwDgYDVQQK
+DAdDb21wYW55MQ8wDQYDVQQDDAZJc3N1ZXIwHhcNMTIwMTAxMDAwMDAwWhcNMzAw
+MTAxMDAwMDAwWjB1MQswCQYDVQQGEwJVUzETMBEGA1UECAwKQ2FsaWZvcm5pYTEV
+MBMGA1UECgwMRXhhbXBsZSBDb3JwMRMwEQYDVQQDDApKb2huIFNtaXRoMSUwIwYJ
+KoZIhvcNAQkBFhZqb2huLnNtaXRoQGV4YW1wbGUuY29tMFkwEwYHKoZIzj0CAQYI
+KoZIzj0DAQcDQgAEXolpg0ad2frDAXpAgBK1YCxMeR/FIsFMdQr8Duy+MRyvAMvF
+1+GsH/VGVnaX0kNeohqsUSNFP1GD3cUoSFq2czAKBggqhkjOPQQDAgNIADBFAiAd
+db65SDBU44jjQ12Eg8J4QdtMUwzBPZHxeVrTxS9b1QIhAMEPuzFqsOO7VlAfpWal
+Ul4MEN+hdoWa7YHjuOVptr4f
+-----END CERTIFICATE-----
+'''
+CLIENT_SUBJECT = ('/C=US/ST=California/O=Example Corp/CN=John Smith/'
+                  'emailAddress=john.smith@example.com')
+CLIENT_ISSUER = '/C=US/O=Company/CN=Issuer'
+CLIENT_SERIAL = 0x1000
+CLIENT_NOT_BEFORE = 1325376000
+CLIENT_NOT_AFTER = 1893456000
+
+# CRL of /C=US/O=Company/CN=Issuer number 4096, revoking the client
+# certificate and 0x0123456789ABCDEF0123456789ABCDEF01
+CRL = '''\
+-----BEGIN X509 CRL-----
+MIIBBTCBqwIBATAKBggqhkjOPQQDAjAwMQswCQYDVQQGEwJVUzEQMA4GA1UECgwH
+Q29tcGFueTEPMA0GA1UEAwwGSXNzdWVyFw0yNjEwMTgxMDI5MzhaFw0yNjExMTcx
+MDI5MzhaMDkwEwICEAAXDTI2MTAxODEwMjkzOFowIgIRASNFZ4mrze8BI0VniavN
+7wEXDTEzMDEwMTAwMDAwMFqgDzANMAsGA1UdFAQEAgIQADAKBggqhkjOPQQDAgNJ
+ADBGAiEAlps6MUgxTYTyYB0PLt8s5BMciyI+UgQ3SKppInPZE20CIQDScOGyEfbu
+gVlvVOSkaOCnmApd7S85Yipa1GyrqTcLmg==
+-----END X509 CRL-----
+'''
+CRL_NUMBER = 4096
+CRL_NEXT_UPDATE = 1794911378
+
+# CRL number 4097, which also revokes 0x2000
+CRL_UPDATE = '''\
+-----BEGIN X509 CRL-----
+MIIBGTCBwAIBATAKBggqhkjOPQQDAjAwMQswCQYDVQQGEwJVUzEQMA4GA1UECgwH
+Q29tcGFueTEPMA0GA1UEAwwGSXNzdWVyFw0yNjEwMTgxMDI5NDJaFw0yNjExMTcx
+MDI5NDJaME4wEwICEAAXDTI2MTAxODEwMjkzOFowEwICIAAXDTEzMDEwMTAwMDAw
+MFowIgIRASNFZ4mrze8BI0VniavN7wEXDTEzMDEwMTAwMDAwMFqgDzANMAsGA1Ud
+FAQEAgIQATAKBggqhkjOPQQDAgNIADBFAiEAxmkLYrzrWY5Ws2PyZZ+QJRu5q9Ps
+muM3E4WdhN0/UJcCIAKTMqqUhMffSapreXhyyOQN8e0B4aBPHJS3QgS0CfKp
+-----END X509 CRL-----
+'''
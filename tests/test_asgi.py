@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import unittest
+from repoze.who.plugins.x509 import X509Identifier
+from tests.certificates import (CLIENT_CERTIFICATE, CLIENT_SUBJECT,
+                                CLIENT_ISSUER)
+
+# The middleware needs asyncio (Python 3.5 or newer)
+if sys.version_info >= (3, 5):
+    import asyncio
+    from repoze.who.plugins.x509.asgi import (X509Middleware, tls_environ,
+                                              blocking)
+
+NOW = 1370044800
+
+
+def resolved(value=None):
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'ASGI requires Python 3.5')
+class TestX509Middleware(unittest.TestCase):
+    """Unit tests for the ASGI middleware"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.scopes = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def app(self, scope, receive, send):
+        self.scopes.append(scope)
+        return resolved()
+
+    def make_identifier(self, **kwargs):
+        kwargs.setdefault('login_field', 'emailAddress')
+        kwargs.setdefault('clock', lambda: NOW)
+        return X509Identifier('SSL_CLIENT_S_DN', **kwargs)
+
+    def make_scope(self, chain=(CLIENT_CERTIFICATE,), name=None, error=None,
+                   client=('10.0.0.1', 40000), type_='http'):
+        return {
+            'type': type_,
+            'client': client,
+            'extensions': {'tls': {
+                'client_cert_chain': list(chain),
+                'client_cert_name': name,
+                'client_cert_error': error,
+            }}
+        }
+
+    def call(self, middleware, scope):
+        self.loop.run_until_complete(middleware(scope, None, None))
+        return self.scopes[-1]
+
+    def test_tls_environ(self):
+        identifier = self.make_identifier()
+        environ = tls_environ(self.make_scope()['extensions']['tls'],
+                              identifier)
+        self.assertEqual(environ, {
+            'SSL_CLIENT_VERIFY': 'SUCCESS',
+            'SSL_CLIENT_S_DN': CLIENT_SUBJECT,
+            'SSL_CLIENT_I_DN': CLIENT_ISSUER,
+            'SSL_CLIENT_M_SERIAL': '1000',
+            'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+            'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2030 GMT'
+        })
+
+    def test_tls_environ_without_certificate(self):
+        identifier = self.make_identifier()
+        environ = tls_environ(self.make_scope(chain=())['extensions']['tls'],
+                              identifier)
+        self.assertEqual(environ, {'SSL_CLIENT_VERIFY': 'NONE'})
+
+    def test_identify(self):
+        middleware = X509Middleware(self.app, self.make_identifier())
+        scope = self.call(middleware, self.make_scope())
+        self.assertEqual(scope['x509.identity'], {
+            'subject': CLIENT_SUBJECT,
+            'login': 'john.smith@example.com'
+        })
+
+    def test_client_cert_name(self):
+        middleware = X509Middleware(self.app,
+                                    self.make_identifier(login_field='CN'))
+        scope = self.call(middleware, self.make_scope(
+            name='CN=Other Name,O=Example Corp,C=US'))
+        self.assertEqual(scope['x509.identity']['login'], 'Other Name')
+
+    def test_certificate_error(self):
+        middleware = X509Middleware(self.app, self.make_identifier())
+        scope = self.call(middleware, self.make_scope(error='expired'))
+        self.assertEqual(scope['x509.identity'], None)
+
+    def test_without_tls(self):
+        middleware = X509Middleware(self.app, self.make_identifier())
+        scope = self.call(middleware, {'type': 'http'})
+        self.assertEqual(scope['x509.identity'], None)
+
+    def test_lifespan_is_not_identified(self):
+        middleware = X509Middleware(self.app, self.make_identifier())
+        scope = self.call(middleware, {'type': 'lifespan'})
+        self.assertFalse('x509.identity' in scope)
+
+    def test_connection_cache(self):
+        calls = []
+
+        def check(creds, scope):
+            calls.append(creds)
+            return creds
+
+        middleware = X509Middleware(self.app, self.make_identifier(),
+                                    checks=[check])
+        scope = self.make_scope()
+        first = self.call(middleware, scope)['x509.identity']
+        first['login'] = 'changed'
+        second = self.call(middleware, scope)['x509.identity']
+        self.assertEqual(second['login'], 'john.smith@example.com')
+        self.assertEqual(middleware.connection_cache.hits, 1)
+        # Another connection is identified again
+        self.call(middleware, self.make_scope(client=('10.0.0.1', 40001)))
+        self.assertEqual(middleware.connection_cache.misses, 2)
+        # The checks run for every request
+        self.assertEqual(len(calls), 3)
+
+    def test_checks_are_not_cached(self):
+        def admin_only(creds, scope):
+            return creds if scope['path'].startswith('/admin') else None
+
+        middleware = X509Middleware(self.app, self.make_identifier(),
+                                    checks=[admin_only])
+        scope = self.make_scope()
+        scope['path'] = '/admin'
+        assert self.call(middleware, scope)['x509.identity'] is not None
+        scope['path'] = '/public'
+        assert self.call(middleware, scope)['x509.identity'] is None
+        scope['path'] = '/admin/users'
+        assert self.call(middleware, scope)['x509.identity'] is not None
+        self.assertEqual(middleware.connection_cache.hits, 2)
+
+    def test_async_and_blocking_checks(self):
+        def add_user(creds, scope):
+            creds = dict(creds)
+            creds['repoze.who.userid'] = 'john'
+            return resolved(creds)
+
+        def reject(creds, scope):
+            return None
+
+        middleware = X509Middleware(self.app, self.make_identifier(),
+                                    checks=[add_user])
+        scope = self.call(middleware, self.make_scope())
+        self.assertEqual(scope['x509.identity']['repoze.who.userid'], 'john')
+
+        middleware = X509Middleware(self.app, self.make_identifier(),
+                                    checks=[add_user, blocking(reject)])
+        scope = self.call(middleware, self.make_scope())
+        self.assertEqual(scope['x509.identity'], None)
+
+    def test_identify_in_executor(self):
+        middleware = X509Middleware(self.app, self.make_identifier(),
+                                    identify_in_executor=True,
+                                    connection_cache_size=None)
+        scope = self.call(middleware, self.make_scope())
+        self.assertEqual(scope['x509.identity']['login'],
+                         'john.smith@example.com')
+
+    def test_requires_identifier(self):
+        self.assertRaises(TypeError, X509Middleware, self.app, object())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from repoze.who.plugins.x509.bloom import BloomFilter, Prefilter
+from repoze.who.plugins.x509.revocation import RevocationChecker
+from tests.certificates import CRL, CLIENT_ISSUER
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Unit tests for the Bloom filter"""
+
+    def test_invalid_error_rate(self):
+        self.assertRaises(ValueError, BloomFilter, 10, 0)
+        self.assertRaises(ValueError, BloomFilter, 10, 1)
+
+    def test_no_false_negatives(self):
+        keys = [random.getrandbits(128) for _ in range(1000)]
+        bloom = BloomFilter(len(keys), 0.01, keys)
+        self.assertEqual(len(bloom), 1000)
+        for key in keys:
+            assert key in bloom
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, 0.01, range(0, 20000, 2))
+        false_positives = sum(1 for key in range(1, 40001, 2) if key in bloom)
+        self.assertTrue(false_positives / 20000.0 < 0.02)
+
+    def test_size(self):
+        small = BloomFilter(1000, 0.1)
+        large = BloomFilter(1000, 0.001)
+        self.assertTrue(small.size < large.size)
+        self.assertTrue(small.hashes < large.hashes)
+
+    def test_strings(self):
+        bloom = BloomFilter(10, keys=['AB:CD', 'EF:01'])
+        assert 'AB:CD' in bloom
+
+
+class TestPrefilter(unittest.TestCase):
+    """Unit tests for the Bloom filter in front of an exact test"""
+
+    def test_default_exact_set(self):
+        prefilter = Prefilter(iter(['a', 'b']))
+        assert 'a' in prefilter
+        assert 'c' not in prefilter
+        self.assertEqual(len(prefilter), 2)
+
+    def test_only_positives_reach_the_exact_test(self):
+        class Exact(object):
+            def __init__(self, keys):
+                self.keys = set(keys)
+                self.lookups = 0
+
+            def __contains__(self, key):
+                self.lookups += 1
+                return key in self.keys
+
+        exact = Exact(range(100))
+        prefilter = Prefilter(range(100), exact, 0.01)
+        for key in range(1000):
+            self.assertEqual(key in prefilter, key < 100)
+        stats = prefilter.stats()
+        self.assertEqual(stats['checks'], 1000)
+        self.assertEqual(stats['positives'], exact.lookups)
+        self.assertEqual(stats['positives'] - stats['false_positives'], 100)
+        self.assertEqual(stats['keys'], 100)
+        self.assertEqual(stats['error_rate'], 0.01)
+        self.assertTrue(stats['size'] > 0)
+
+    def test_counters_with_threads(self):
+        prefilter = Prefilter(range(100), error_rate=0.01)
+
+        def check():
+            for key in range(2000):
+                key in prefilter
+
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = prefilter.stats()
+        self.assertEqual(stats['checks'], 16000)
+        self.assertEqual(stats['positives'] - stats['false_positives'], 800)
+
+    def test_revocation_checker(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'crl.pem')
+        with open(path, 'w') as crl_file:
+            crl_file.write(CRL)
+        checker = RevocationChecker([path], background=False,
+                                    bloom_error_rate=0.001)
+        assert checker.is_revoked(CLIENT_ISSUER, '1000')
+        assert not checker.is_revoked(CLIENT_ISSUER, '1001')
+        stats = checker.stats()[0]
+        self.assertEqual(stats['revoked'], 2)
+        self.assertEqual(stats['bloom']['checks'], 2)
+        self.assertEqual(stats['bloom']['keys'], 2)
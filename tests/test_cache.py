@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from repoze.who.plugins.x509.cache import (CacheBackend, LRUCache,
+                                           MemcachedCache, SharedMemoryCache)
+
+try:
+    import SocketServer as socketserver
+except ImportError:  # pragma: no cover
+    import socketserver
+
+
+class TestLRUCache(unittest.TestCase):
+    """Unit tests for the LRU cache"""
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, LRUCache, 0)
+        self.assertRaises(ValueError, LRUCache, -1)
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        assert cache.get('a') is None
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        assert 'a' in cache
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        self.assertEqual(len(cache), 2)
+
+    def test_counters(self):
+        cache = LRUCache(2)
+        cache.get('a')
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['maxsize'], 2)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        cache.delete('missing')
+        assert 'a' not in cache
+        cache.get('b')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 0)
+
+    def test_bulk_operations(self):
+        now = [1000]
+        cache = LRUCache(3, timer=lambda: now[0])
+        cache.set_many({'a': 1, 'b': 2}, expires=1010)
+        cache.set_many([('c', 3)])
+        self.assertEqual(cache.get_many(['a', 'c', 'missing']),
+                         {'a': 1, 'c': 3})
+        now[0] = 1010
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'c': 3})
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 3)
+        cache.set_many([('d', 4), ('e', 5)])
+        self.assertEqual(len(cache), 3)
+
+    def test_expiration(self):
+        now = [1000]
+        cache = LRUCache(2, timer=lambda: now[0])
+        cache.set('a', 1, expires=1010)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 1010
+        assert cache.get('a') is None
+        assert 'a' not in cache
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.misses, 1)
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+    """Unit tests for the shared memory cache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def make_cache(self, **kwargs):
+        kwargs.setdefault('path', self.path)
+        cache = SharedMemoryCache(**kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, SharedMemoryCache, maxsize=0)
+        self.assertRaises(ValueError, SharedMemoryCache, slot_size=44)
+        self.assertRaises(ValueError, SharedMemoryCache, slot_size=65580)
+
+    def test_largest_slot(self):
+        cache = self.make_cache(maxsize=1, slot_size=65579)
+        cache.set('a', 'x' * 65000)
+        self.assertEqual(cache.get('a'), 'x' * 65000)
+        cache.set('b', 'x' * 70000)
+        assert cache.get('b') is None
+
+    def test_get_and_set(self):
+        cache = self.make_cache(maxsize=16)
+        key = ('/CN=Name', '/CN=Issuer', '01', None, None)
+        assert cache.get(key) is None
+        self.assertEqual(cache.get(key, 'default'), 'default')
+        cache.set(key, {'login': ['a', 'b']})
+        self.assertEqual(cache.get(key), {'login': ['a', 'b']})
+        assert key in cache
+        self.assertEqual(len(cache), 1)
+        cache.set(key, {'login': 'c'})
+        self.assertEqual(cache.get(key), {'login': 'c'})
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'size': 1,
+                                         'maxsize': 16})
+
+    def test_shared_between_instances(self):
+        cache = self.make_cache(maxsize=16)
+        cache.set('a', 1)
+        other = self.make_cache(maxsize=16)
+        self.assertEqual(other.get('a'), 1)
+        other.delete('a')
+        assert cache.get('a') is None
+
+    def test_shared_between_processes(self):
+        cache = self.make_cache(path=None, maxsize=16)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                cache.set('a', os.getpid())
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(cache.get('a'), pid)
+
+    def test_different_layout(self):
+        self.make_cache(maxsize=16)
+        self.assertRaises(ValueError, SharedMemoryCache, self.path,
+                          maxsize=32)
+
+    def test_expiration(self):
+        now = [1000]
+        cache = self.make_cache(maxsize=4, timer=lambda: now[0])
+        cache.set('a', 1, expires=1010)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 1010
+        assert cache.get('a') is None
+        assert 'a' not in cache
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_bounded(self):
+        cache = self.make_cache(maxsize=8, shards=2, max_probes=2)
+        for n in range(100):
+            cache.set(n, n, expires=2e9 + n)
+        self.assertEqual(len(cache), 8)
+        # The entries that expire first are evicted
+        self.assertEqual(cache.get(99), 99)
+
+    def test_bulk_operations(self):
+        cache = self.make_cache(maxsize=16)
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+
+    def test_large_values_are_not_cached(self):
+        cache = self.make_cache(maxsize=4, slot_size=64)
+        cache.set('a', 'small')
+        cache.set('a', 'x' * 100)
+        assert cache.get('a') is None
+
+    def test_delete_and_clear(self):
+        cache = self.make_cache(maxsize=4)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        cache.delete('missing')
+        assert 'a' not in cache
+        self.assertEqual(cache.get('b'), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+
+
+_unpickled = []
+
+
+def _record_unpickling():
+    _unpickled.append(True)
+
+
+class _Payload(object):
+    """
+    Runs a function when it is unpickled.
+    """
+
+    def __reduce__(self):
+        return (_record_unpickling, ())
+
+
+class MemcachedHandler(socketserver.StreamRequestHandler):
+    """
+    The subset of the memcached text protocol used by MemcachedCache.
+    """
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            self.server.commands.append(parts[0])
+            if parts[0] == b'get' and self.server.reply is not None:
+                self.wfile.write(self.server.reply)
+            elif parts[0] == b'get':
+                for key in parts[1:]:
+                    entry = data.get(key)
+                    if entry is not None and (entry[1] == 0 or
+                                              entry[1] > time.time()):
+                        self.wfile.write(b'VALUE ' + key + b' 0 ' +
+                                         str(len(entry[0])).encode('ascii') +
+                                         b'\r\n' + entry[0] + b'\r\n')
+                self.wfile.write(b'END\r\n')
+            elif parts[0] == b'set':
+                value = self.rfile.read(int(parts[4]) + 2)[:-2]
+                exptime = int(parts[3])
+                if 0 < exptime <= 30 * 24 * 60 * 60:
+                    exptime += time.time()
+                data[parts[1]] = (value, exptime)
+                self.wfile.write(b'STORED\r\n')
+            elif parts[0] == b'delete':
+                found = data.pop(parts[1], None) is not None
+                self.wfile.write(b'DELETED\r\n' if found else
+                                 b'NOT_FOUND\r\n')
+            elif parts[0] == b'flush_all':
+                data.clear()
+                self.wfile.write(b'OK\r\n')
+            else:
+                self.wfile.write(b'ERROR\r\n')
+
+
+class MemcachedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 MemcachedHandler)
+        self.data = {}
+        self.commands = []
+        self.reply = None
+
+
+class TestMemcachedCache(unittest.TestCase):
+    """Unit tests for the memcached client"""
+
+    def setUp(self):
+        self.server = MemcachedServer()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.port = self.server.server_address[1]
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_cache(self, **kwargs):
+        kwargs.setdefault('port', self.port)
+        kwargs.setdefault('secret', b'secret')
+        cache = MemcachedCache(**kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_get_and_set(self):
+        cache = self.make_cache()
+        key = ('/CN=Name', '/CN=Issuer', '01', None, None)
+        assert cache.get(key) is None
+        self.assertEqual(cache.get(key, 'default'), 'default')
+        cache.set(key, {'login': ['a', 'b']})
+        self.assertEqual(cache.get(key), {'login': ['a', 'b']})
+        assert key in cache
+        cache.delete(key)
+        assert cache.get(key) is None
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 3,
+                                         'errors': 0})
+
+    def test_shared_between_clients(self):
+        cache = self.make_cache()
+        other = self.make_cache()
+        cache.set('a', 1)
+        self.assertEqual(other.get('a'), 1)
+        other.clear()
+        assert cache.get('a') is None
+
+    def test_prefix(self):
+        cache = self.make_cache()
+        other = self.make_cache(prefix='other:')
+        cache.set('a', 1)
+        assert other.get('a') is None
+
+    def test_pipelined_bulk_operations(self):
+        cache = self.make_cache()
+        items = dict((n, str(n)) for n in range(200))
+        cache.set_many(items)
+        del self.server.commands[:]
+        self.assertEqual(cache.get_many(list(items) + ['missing']), items)
+        # The keys were requested in chunks of the same connection
+        self.assertEqual(self.server.commands, [b'get'] * 4)
+
+    def test_expiration(self):
+        now = [time.time()]
+        cache = self.make_cache(timer=lambda: now[0])
+        cache.set('a', 1, expires=now[0] - 1)
+        assert cache.get('a') is None
+        cache.set('b', 2, expires=now[0] + 60)
+        name = cache._key('b')
+        self.assertTrue(0 < self.server.data[name][1] - time.time() <= 60)
+        cache.set('c', 3, expires=now[0] + 60 * 24 * 60 * 60)
+        self.assertEqual(self.server.data[cache._key('c')][1],
+                         int(now[0] + 60 * 24 * 60 * 60))
+
+    def test_signed_values(self):
+        cache = self.make_cache()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(self.make_cache(secret=u'secret').get('a'), 1)
+        # A value written without the secret is ignored
+        self.make_cache(secret=b'other').set('a', 2)
+        assert cache.get('a') is None
+
+    def test_unsigned_values_are_not_unpickled(self):
+        cache = self.make_cache()
+        cache.set('a', 1)
+        key = cache._key('a')
+        exptime = self.server.data[key][1]
+        del _unpickled[:]
+        payload = pickle.dumps(_Payload(), 2)
+        for data in [payload, b'\x00' * 32 + payload, b'']:
+            self.server.data[key] = (data, exptime)
+            assert cache.get('a') is None
+        self.assertEqual(_unpickled, [])
+
+    def test_secret_is_required(self):
+        self.assertRaises(ValueError, self.make_cache, secret=None)
+        self.assertRaises(ValueError, self.make_cache, secret=b'')
+
+    def test_connection_pool(self):
+        cache = self.make_cache(pool_size=1)
+        cache.set('a', 1)
+        cache.get('a')
+        self.assertEqual(len(cache._pool), 1)
+
+    def test_malformed_reply(self):
+        cache = self.make_cache(pool_size=1)
+        cache.set('a', 1)
+        self.assertEqual(len(cache._pool), 1)
+        self.server.reply = b'VALUE key 0 size\r\nEND\r\n'
+        assert cache.get('a') is None
+        self.assertEqual(len(cache._pool), 0)
+        self.assertEqual(cache.errors, 1)
+        self.server.reply = None
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_unavailable_server(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        cache = self.make_cache(port=port)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        self.assertEqual(cache.errors, 2)
+        self.assertEqual(cache.misses, 1)
+
+
+class TestCacheBackend(unittest.TestCase):
+    """Unit tests for the default bulk operations"""
+
+    def test_bulk_operations(self):
+        class DictCache(CacheBackend):
+            def __init__(self):
+                self.data = {}
+
+            def get(self, key, default=None):
+                return self.data.get(key, default)
+
+            def set(self, key, value, expires=None):
+                self.data[key] = value
+
+        cache = DictCache()
+        cache.set_many({'a': 1, 'b': None})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': None})
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import unittest
+from repoze.who.plugins.x509.clock import CoarseClock, system_clock
+
+
+class TestClock(unittest.TestCase):
+    """Unit tests for the clocks"""
+
+    def test_system_clock(self):
+        assert abs(system_clock() - time.time()) < 1
+
+    def test_coarse_clock(self):
+        clock = CoarseClock(resolution=0.01)
+        now = clock()
+        assert isinstance(now, int)
+        assert abs(now - time.time()) <= 1
+        clock.now = 0
+        deadline = time.time() + 5
+        while clock() == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert abs(clock() - time.time()) <= 1
+
+    def test_coarse_clock_restart(self):
+        clock = CoarseClock(resolution=0.01)
+        clock()
+        first = clock._thread
+        clock.restart()
+        assert clock._thread is not first
+        first.join(5)
+        assert not first.is_alive()
+        assert clock._thread.is_alive()
+
+    def test_coarse_clock_after_fork(self):
+        clock = CoarseClock(resolution=0.01)
+        clock()
+        first = clock._thread
+        # The process id of the parent, as seen by a forked child
+        clock._pid = -1
+        clock.now = 0
+        assert abs(clock() - time.time()) <= 1
+        assert clock._thread is not first
+        first.join(5)
+        assert not first.is_alive()
+        assert clock._thread.is_alive()
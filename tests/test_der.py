@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from repoze.who.plugins.x509 import der
+from tests.certificates import (CLIENT_CERTIFICATE, CLIENT_SUBJECT,
+                                CLIENT_ISSUER, CLIENT_SERIAL,
+                                CLIENT_NOT_BEFORE, CLIENT_NOT_AFTER)
+
+
+class TestDER(unittest.TestCase):
+    """Unit tests for the DER reader"""
+
+    def test_parse_certificate(self):
+        data = der.pem_to_der(CLIENT_CERTIFICATE)
+        certificate = der.parse_certificate(data)
+        subject_der = certificate.pop('subject_der')
+        public_key = certificate.pop('public_key')
+        self.assertEqual(certificate, {
+            'serial': CLIENT_SERIAL,
+            'issuer': CLIENT_ISSUER,
+            'subject': CLIENT_SUBJECT,
+            'not_before': CLIENT_NOT_BEFORE,
+            'not_after': CLIENT_NOT_AFTER
+        })
+        self.assertEqual(der.read(bytearray(subject_der))[2],
+                         len(subject_der))
+        assert subject_der in data
+        # An uncompressed P-256 point
+        self.assertEqual(len(public_key), 65)
+        self.assertEqual(public_key[:1], b'\x04')
+
+    def test_pem_without_block(self):
+        self.assertRaises(der.DERError, der.pem_to_der, CLIENT_CERTIFICATE,
+                          'X509 CRL')
+        self.assertRaises(der.DERError, der.pem_to_der, 'garbage')
+
+    def test_truncated_certificate(self):
+        data = der.pem_to_der(CLIENT_CERTIFICATE)
+        self.assertRaises(der.DERError, der.parse_certificate, data[:100])
+        self.assertRaises(der.DERError, der.parse_certificate, b'\x30')
+
+    def test_parse_integer(self):
+        self.assertEqual(der.parse_integer(bytearray(b'\x01\x00'), 0, 2), 256)
+        self.assertEqual(der.parse_integer(bytearray(b'\xff'), 0, 1), -1)
+
+    def test_parse_oid(self):
+        data = bytearray(b'\x2a\x86\x48\x86\xf7\x0d\x01\x09\x01')
+        self.assertEqual(der.parse_oid(data, 0, len(data)),
+                         '1.2.840.113549.1.9.1')
+
+    def test_parse_string(self):
+        data = bytearray(b'\xc3\xb1\x00\xf1\xff')
+        self.assertEqual(der.parse_string(data, der.TAG_UTF8_STRING, 0, 2),
+                         u'\xf1')
+        self.assertEqual(der.parse_string(data, der.TAG_BMP_STRING, 2, 4),
+                         u'\xf1')
+        self.assertRaises(der.DERError, der.parse_string, data,
+                          der.TAG_UTF8_STRING, 3, 5)
+        self.assertRaises(der.DERError, der.parse_string, data,
+                          der.TAG_BMP_STRING, 2, 5)
+        self.assertRaises(der.DERError, der.parse_string, data,
+                          der.TAG_UNIVERSAL_STRING, 1, 5)
+
+    def test_parse_time(self):
+        utc = bytearray(b'491231235959Z')
+        self.assertEqual(der.parse_time(utc, der.TAG_UTC_TIME, 0, len(utc)),
+                         2524607999)
+        utc = bytearray(b'500101000000Z')
+        self.assertEqual(der.parse_time(utc, der.TAG_UTC_TIME, 0, len(utc)),
+                         -631152000)
+        generalized = bytearray(b'20500101000000Z')
+        self.assertEqual(der.parse_time(generalized, der.TAG_GENERALIZED_TIME,
+                                        0, len(generalized)), 2524608000)
+        fraction = bytearray(b'20500101000000.25Z')
+        self.assertEqual(der.parse_time(fraction, der.TAG_GENERALIZED_TIME,
+                                        0, len(fraction)), 2524608000)
+        local = bytearray(b'20500101000000')
+        self.assertRaises(der.DERError, der.parse_time, local,
+                          der.TAG_GENERALIZED_TIME, 0, len(local))
+        invalid = bytearray(b'20500101000000,5Z')
+        self.assertRaises(der.DERError, der.parse_time, invalid,
+                          der.TAG_GENERALIZED_TIME, 0, len(invalid))
+        for invalid in (b'x91231235959Z', b'\xff91231235959Z'):
+            invalid = bytearray(invalid)
+            self.assertRaises(der.DERError, der.parse_time, invalid,
+                              der.TAG_UTC_TIME, 0, len(invalid))
+
+    def test_encode(self):
+        self.assertEqual(der.encode(der.TAG_NULL), b'\x05\x00')
+        null = der.encode(der.TAG_NULL)
+        self.assertEqual(der.encode(der.TAG_SEQUENCE, null, null),
+                         b'\x30\x04\x05\x00\x05\x00')
+        long_content = b'x' * 300
+        encoded = der.encode(der.TAG_OCTET_STRING, long_content)
+        self.assertEqual(encoded[:4], b'\x04\x82\x01\x2c')
+        self.assertEqual(der.read(bytearray(encoded)), (der.TAG_OCTET_STRING,
+                                                        4, 304))
+
+    def test_encode_integer(self):
+        for value in (0, 1, 127, 128, 255, 256, -1, -128, -129,
+                      0x0123456789ABCDEF0123456789ABCDEF01):
+            data = bytearray(der.encode_integer(value))
+            tag, start, end = der.read(data)
+            self.assertEqual(tag, der.TAG_INTEGER)
+            self.assertEqual(der.parse_integer(data, start, end), value)
+        self.assertEqual(der.encode_integer(128), b'\x02\x02\x00\x80')
+        self.assertEqual(der.encode_integer(-128), b'\x02\x01\x80')
+
+    def test_encode_oid(self):
+        encoded = der.encode_oid('1.2.840.113549.1.9.1')
+        self.assertEqual(encoded,
+                         b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x09\x01')
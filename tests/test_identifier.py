@@ -17,12 +17,18 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
 from zope.interface.verify import verifyClass, verifyObject
 from repoze.who.interfaces import IIdentifier
 from repoze.who.middleware import match_classification
 
 from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.cache import SharedMemoryCache
+from repoze.who.plugins.x509.instrumentation import Instrumentation
 from tests import TestX509Base
+import time
 
 class TestX509Identifier(TestX509Base):
     
@@ -72,6 +78,26 @@ class TestX509Identifier(TestX509Base):
             'other'
         )
 
+    def test_classifications_are_per_instance(self):
+        custom = X509Identifier('Test', classifications=['ios'])
+        default = X509Identifier('Test')
+        self.assertEquals(custom.classifications[IIdentifier], ('ios',))
+        self.assertEquals(default.classifications[IIdentifier], ('browser',))
+        # Like repoze.who's configuration loader (plugins = x509;ios)
+        default.classifications[IIdentifier] = 'ios'
+        self.assertEquals(X509Identifier('Test').classifications,
+                          {IIdentifier: ('browser',)})
+        assert default in match_classification(IIdentifier, (default,),
+                                               'ios')
+
+    def test_configuration_is_immutable(self):
+        identifier = X509Identifier('Test')
+        self.assertRaises(AttributeError, setattr, identifier,
+                          'login_field', 'CN')
+        self.assertRaises(AttributeError, setattr, identifier, 'other', 1)
+        self.assertRaises(AttributeError, delattr, identifier, 'clock')
+        self.assertEquals(identifier.login_field, 'Email')
+
     def test_identify_default_values(self):
         identifier = X509Identifier('SSL_CLIENT_S_DN')
         environ = self.make_environ(
@@ -172,3 +198,382 @@ class TestX509Identifier(TestX509Base):
         creds = identifier.identify(environ)
         assert creds is None
 
+
+    def test_identify_with_dn_cache(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', dn_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        for i in range(3):
+            creds = identifier.identify(environ)
+            self.assertEquals(creds['login'], 'email@example.com')
+        self.assertEquals(identifier.dn_cache.hits, 2)
+        self.assertEquals(identifier.dn_cache.misses, 1)
+
+    def test_multiple_values_with_dn_cache(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', multiple_values=True,
+                                    dn_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            '/Email=email1@example.com/Email=email2@example.com/O=Org'
+        )
+        creds = identifier.identify(environ)
+        creds['login'].append('other@example.com')
+
+        creds = identifier.identify(environ)
+        self.assertEquals(creds['login'],
+                          ['email1@example.com', 'email2@example.com'])
+
+    def test_identify_with_identity_cache(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        creds = identifier.identify(environ)
+        self.assertEquals(creds['login'], 'email@example.com')
+        creds['repoze.who.userid'] = 'changed'
+
+        creds = identifier.identify(environ)
+        self.assertEquals(creds, {'subject': environ['SSL_CLIENT_S_DN'],
+                                  'login': 'email@example.com'})
+        self.assertEquals(identifier.identity_cache.hits, 1)
+
+    def test_identify_with_shared_identity_cache(self):
+        cache = SharedMemoryCache(maxsize=16)
+        self.addCleanup(cache.close)
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache=cache)
+        other = X509Identifier('SSL_CLIENT_S_DN', identity_cache=cache)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        creds = identifier.identify(environ)
+        self.assertEquals(other.identify(environ), creds)
+        self.assertEquals(cache.hits, 1)
+
+    def test_shared_caches_are_separated_by_configuration(self):
+        cache = SharedMemoryCache(maxsize=1024)
+        self.addCleanup(cache.close)
+        negative_cache = SharedMemoryCache(maxsize=1024)
+        self.addCleanup(negative_cache.close)
+        kwargs = {'identity_cache': cache, 'negative_cache': negative_cache}
+        by_email = X509Identifier('SSL_CLIENT_S_DN', **kwargs)
+        by_cn = X509Identifier('SSL_CLIENT_S_DN', login_field='CN', **kwargs)
+        multiple = X509Identifier('SSL_CLIENT_S_DN', multiple_values=True,
+                                  **kwargs)
+        denied = X509Identifier('SSL_CLIENT_S_DN', denied_issuers=[
+            '/C=US/CN=Issuer/O=Company'], **kwargs)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        assert denied.identify(environ) is None
+        self.assertEquals(by_email.identify(environ)['login'],
+                          'email@example.com')
+        self.assertEquals(by_cn.identify(environ)['login'], 'Name')
+        self.assertEquals(multiple.identify(environ)['login'],
+                          ['email@example.com'])
+        self.assertEquals(cache.hits, 0)
+        self.assertEquals(negative_cache.hits, 0)
+        # The same configuration shares the entries
+        other = X509Identifier('SSL_CLIENT_S_DN', login_field='CN', **kwargs)
+        self.assertEquals(other.cache_namespace, by_cn.cache_namespace)
+        self.assertEquals(other.identify(environ)['login'], 'Name')
+        self.assertEquals(cache.hits, 1)
+        # Unless the namespace is given
+        other = X509Identifier('SSL_CLIENT_S_DN', login_field='CN',
+                               cache_namespace='other', **kwargs)
+        other.identify(environ)
+        self.assertEquals(cache.hits, 1)
+
+    def test_identity_cache_checks_verification(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        assert identifier.identify(environ) is not None
+        environ['SSL_CLIENT_VERIFY'] = 'FAILED'
+        assert identifier.identify(environ) is None
+
+    def test_identity_cache_key_includes_certificate(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        environ['SSL_CLIENT_M_SERIAL'] = '01'
+        identifier.identify(environ)
+        environ['SSL_CLIENT_M_SERIAL'] = '02'
+        identifier.identify(environ)
+        environ['SSL_CLIENT_I_DN'] = '/CN=Other issuer'
+        identifier.identify(environ)
+        self.assertEquals(identifier.identity_cache.hits, 0)
+        self.assertEquals(len(identifier.identity_cache), 3)
+
+    def test_identity_cache_expires_at_validity_end(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10,
+                                    identity_cache_ttl=3600)
+        end = datetime.utcnow() + relativedelta(seconds=30)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'},
+            end=end.replace(tzinfo=tzutc())
+        )
+        identifier.identify(environ)
+        cache = identifier.identity_cache
+        cache.timer = lambda: time.time() + 60
+        identifier.identify(environ)
+        self.assertEquals(cache.hits, 0)
+        self.assertEquals(cache.misses, 2)
+
+    def test_identity_cache_expires_at_ttl(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10,
+                                    identity_cache_ttl=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        identifier.identify(environ)
+        cache = identifier.identity_cache
+        cache.timer = lambda: time.time() + 20
+        assert identifier.identify(environ) is not None
+        self.assertEquals(cache.hits, 0)
+        self.assertEquals(cache.misses, 2)
+
+    def test_identity_cache_invalid_ttl(self):
+        self.assertRaises(ValueError, X509Identifier, 'SSL_CLIENT_S_DN',
+                          identity_cache_size=10, identity_cache_ttl=0)
+
+    def test_multiple_values_server_variables_beyond_precomputed(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', multiple_values=True,
+                                    max_login_values=2)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@domain.com', 'C': 'US'}
+        )
+        environ['SSL_CLIENT_S_DN_Email'] = ''
+        for n in range(4):
+            environ['SSL_CLIENT_S_DN_Email_%d' % n] = 'email%d@example.com' % n
+        creds = identifier.identify(environ)
+
+        self.assertEquals(creds['login'], ['email0@example.com',
+                                           'email1@example.com',
+                                           'email2@example.com',
+                                           'email3@example.com'])
+
+    def test_single_value_server_variable_with_multiple_values(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', multiple_values=True)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@domain.com', 'C': 'US'}
+        )
+        environ['SSL_CLIENT_S_DN_Email'] = 'email@example.com'
+        creds = identifier.identify(environ)
+        self.assertEquals(creds['login'], ['email@example.com'])
+
+    def test_identify_rfc4514_subject(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', login_field='CN')
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            'CN=Smith\\, John,OU=Unit,DC=example,DC=com'
+        )
+        creds = identifier.identify(environ)
+        self.assertEquals(creds['login'], 'Smith, John')
+
+    def test_instrumentation_outcomes(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN', instrumentation=stats)
+        issuer = {'CN': 'Issuer', 'C': 'US', 'O': 'Company'}
+        identifier.identify({})
+        identifier.identify(self.make_environ(issuer, '/CN=Name'))
+        identifier.identify(self.make_environ(
+            issuer,
+            '/Email=email1@example.com/Email=email2@example.com'
+        ))
+        identifier.identify(self.make_environ(issuer, '/CN=Name',
+                                              verified=False))
+        end = datetime.utcnow() + relativedelta(days=-5)
+        identifier.identify(self.make_environ(
+            issuer,
+            '/CN=Name',
+            start=(end + relativedelta(years=-1)).replace(tzinfo=tzutc()),
+            end=end.replace(tzinfo=tzutc())
+        ))
+        environ = self.make_environ(issuer, '/Email=email@example.com')
+        assert identifier.identify(environ) is not None
+        environ['SSL_CLIENT_S_DN_Email'] = 'email@example.com'
+        assert identifier.identify(environ) is not None
+
+        snapshot = stats.snapshot()
+        self.assertEquals(snapshot['counters'], {
+            'no_dn': 1,
+            'missing_login': 1,
+            'too_many_values': 1,
+            'verify_failed': 1,
+            'expired': 1,
+            'identified': 2,
+        })
+        timings = snapshot['timings']
+        self.assertEquals(timings['verify_certificate']['count'], 6)
+        self.assertEquals(timings['parse_dates']['count'], 5)
+        self.assertEquals(timings['parse_dn']['count'], 3)
+        self.assertEquals(timings['login_values']['count'], 1)
+
+    def test_instrumentation_with_identity_cache(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10,
+                                    instrumentation=stats)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        identifier.identify(environ)
+        identifier.identify(environ)
+        environ['SSL_CLIENT_VERIFY'] = 'FAILED'
+        identifier.identify(environ)
+        snapshot = stats.snapshot()
+        self.assertEquals(snapshot['counters'], {'identified': 2,
+                                                 'verify_failed': 1})
+        self.assertEquals(snapshot['timings']['verify_certificate']['count'],
+                          2)
+
+    def test_negative_cache(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN', negative_cache_size=10,
+                                    instrumentation=stats)
+        end = datetime.utcnow() + relativedelta(days=-5)
+        expired = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'},
+            start=(end + relativedelta(years=-1)).replace(tzinfo=tzutc()),
+            end=end.replace(tzinfo=tzutc())
+        )
+        failed = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'},
+            verified=False
+        )
+        for i in range(3):
+            assert identifier.identify(expired) is None
+            assert identifier.identify(failed) is None
+
+        snapshot = stats.snapshot()
+        self.assertEquals(snapshot['counters'], {'expired': 3,
+                                                 'verify_failed': 3,
+                                                 'negative_cache_hit': 4})
+        self.assertEquals(snapshot['timings']['verify_certificate']['count'],
+                          2)
+        cache_stats = identifier.negative_cache.stats()
+        self.assertEquals(cache_stats['hits'], 4)
+        self.assertEquals(cache_stats['misses'], 2)
+        self.assertEquals(cache_stats['size'], 2)
+
+    def test_negative_cache_is_per_verification(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', negative_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'},
+            verified=False
+        )
+        assert identifier.identify(environ) is None
+        environ['SSL_CLIENT_VERIFY'] = 'SUCCESS'
+        creds = identifier.identify(environ)
+        self.assertEquals(creds['login'], 'email@example.com')
+
+    def test_negative_cache_expires(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', negative_cache_size=10,
+                                    negative_cache_ttl=5)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'},
+            verified=False
+        )
+        identifier.identify(environ)
+        identifier.negative_cache.timer = lambda: time.time() + 10
+        identifier.identify(environ)
+        self.assertEquals(identifier.negative_cache.hits, 0)
+
+    def test_negative_cache_ignores_missing_login(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', negative_cache_size=10)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'C': 'US'}
+        )
+        assert identifier.identify(environ) is None
+        self.assertEquals(len(identifier.negative_cache), 0)
+
+    def test_negative_cache_invalid_ttl(self):
+        self.assertRaises(ValueError, X509Identifier, 'SSL_CLIENT_S_DN',
+                          negative_cache_size=10, negative_cache_ttl=0)
+
+    def test_identify_with_clock(self):
+        now = [1325376000]
+        identifier = X509Identifier('SSL_CLIENT_S_DN', identity_cache_size=10,
+                                    identity_cache_ttl=3600,
+                                    clock=lambda: now[0])
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        environ['SSL_CLIENT_V_START'] = 'Jan  1 00:00:00 2012 GMT'
+        environ['SSL_CLIENT_V_END'] = 'Jan  1 00:30:00 2012 GMT'
+        assert identifier.identify(environ) is not None
+        now[0] += 1799
+        assert identifier.identify(environ) is not None
+        self.assertEquals(identifier.identity_cache.hits, 1)
+        now[0] += 2
+        assert identifier.identify(environ) is None
+        self.assertEquals(identifier.identity_cache.hits, 1)
+
+    def test_identify_many(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN', instrumentation=stats)
+        issuer = {'CN': 'Issuer', 'C': 'US', 'O': 'Company'}
+        valid = self.make_environ(issuer, '/CN=Name/Email=email@example.com')
+        other = self.make_environ(issuer, '/CN=Other/Email=other@example.com')
+        failed = self.make_environ(issuer, '/CN=Name', verified=False)
+        environs = [valid, {}, other, failed, dict(valid)]
+
+        results = identifier.identify_many(iter(environs))
+        assert not isinstance(results, list)
+        results = list(results)
+        self.assertEquals([creds and creds['login'] for creds in results],
+                          ['email@example.com', None, 'other@example.com',
+                           None, 'email@example.com'])
+        self.assertEquals(results[0], identifier.identify(valid))
+
+        snapshot = stats.snapshot()
+        self.assertEquals(snapshot['counters'], {'identified': 4,
+                                                 'no_dn': 1,
+                                                 'verify_failed': 1})
+        # The validity range is checked once per distinct value in the batch
+        self.assertEquals(snapshot['timings']['verify_certificate']['count'],
+                          3)
+
+    def test_identify_many_uses_one_time(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN')
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            {'CN': 'Name', 'Email': 'email@example.com', 'C': 'US'}
+        )
+        environ['SSL_CLIENT_V_START'] = 'Jan  1 00:00:00 2012 GMT'
+        environ['SSL_CLIENT_V_END'] = 'Jan  1 00:00:00 2013 GMT'
+        results = list(identifier.identify_many([environ],
+                                                now=1340000000))
+        self.assertEquals(results[0]['login'], 'email@example.com')
+        results = list(identifier.identify_many([environ]))
+        self.assertEquals(results, [None])
+
+    def test_identify_many_multiple_values(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', multiple_values=True)
+        environ = self.make_environ(
+            {'CN': 'Issuer', 'C': 'US', 'O': 'Company'},
+            '/Email=email1@example.com/Email=email2@example.com/O=Org'
+        )
+        results = list(identifier.identify_many([environ, environ]))
+        results[0]['login'].append('other@example.com')
+        self.assertEquals(results[1]['login'],
+                          ['email1@example.com', 'email2@example.com'])
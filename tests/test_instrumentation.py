@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+import unittest
+from repoze.who.plugins.x509.instrumentation import (Instrumentation,
+                                                     StatsdSink)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Unit tests for the instrumentation"""
+
+    def test_counters(self):
+        stats = Instrumentation()
+        stats.count('a')
+        stats.count('a')
+        stats.count('b', 5)
+        self.assertEqual(stats.snapshot()['counters'], {'a': 2, 'b': 5})
+
+    def test_timings(self):
+        stats = Instrumentation(buckets=(0.001, 0.01))
+        stats.timing('stage', 0.0005)
+        stats.timing('stage', 0.005)
+        stats.timing('stage', 0.5)
+        stats.timing('stage', 0.001)
+        timing = stats.snapshot()['timings']['stage']
+        self.assertEqual(timing['count'], 4)
+        self.assertAlmostEqual(timing['total'], 0.5065)
+        self.assertEqual(timing['buckets'], [(0.001, 2), (0.01, 1),
+                                             (None, 1)])
+
+    def test_snapshot_is_a_copy(self):
+        stats = Instrumentation()
+        stats.count('a')
+        snapshot = stats.snapshot()
+        stats.count('a')
+        self.assertEqual(snapshot['counters'], {'a': 1})
+
+    def test_reset(self):
+        stats = Instrumentation()
+        stats.count('a')
+        stats.timing('stage', 0.1)
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {'counters': {}, 'timings': {}})
+
+    def test_sink(self):
+        events = []
+        stats = Instrumentation(sink=lambda *event: events.append(event))
+        stats.count('a')
+        stats.timing('stage', 0.25)
+        self.assertEqual(events, [('count', 'a', 1), ('timing', 'stage', 0.25)])
+
+
+class TestStatsdSink(unittest.TestCase):
+    """Unit tests for the statsd sink"""
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.sink = StatsdSink(port=self.server.getsockname()[1],
+                               prefix='test')
+
+    def tearDown(self):
+        self.sink.close()
+        self.server.close()
+
+    def test_lines(self):
+        stats = Instrumentation(sink=self.sink)
+        stats.count('identified')
+        stats.timing('parse_dn', 0.0125)
+        self.assertEqual(self.server.recv(512), b'test.identified:1|c')
+        self.assertEqual(self.server.recv(512), b'test.parse_dn:12.500|ms')
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.cache import LRUCache
+from repoze.who.plugins.x509.instrumentation import Instrumentation
+from repoze.who.plugins.x509.issuers import IssuerPolicy
+from tests import TestX509Base
+
+ISSUER = '/C=US/O=Company/CN=Issuer'
+OTHER_ISSUER = '/C=US/O=Other/CN=Other Issuer'
+SUBJECT = '/C=US/CN=Name/Email=email@example.com'
+
+
+class TestIssuerPolicy(unittest.TestCase):
+    """Unit tests for the issuer allowlist and denylist"""
+
+    def test_allowed(self):
+        policy = IssuerPolicy(allowed=[ISSUER, 'CN=Second,O=Company,C=US'])
+        assert policy.allows(ISSUER)
+        assert policy.allows('CN=Issuer,O=Company,C=US')
+        assert policy.allows('/C=US/O=Company/CN=Second')
+        assert not policy.allows(OTHER_ISSUER)
+
+    def test_denied(self):
+        policy = IssuerPolicy(denied=[OTHER_ISSUER])
+        assert policy.allows(ISSUER)
+        assert not policy.allows(OTHER_ISSUER)
+        assert not policy.allows('CN=Other Issuer, O=other, C=US')
+
+    def test_denied_wins(self):
+        policy = IssuerPolicy(allowed=[ISSUER, OTHER_ISSUER],
+                              denied=['CN=Other Issuer,O=Other,C=US'])
+        assert policy.allows(ISSUER)
+        assert not policy.allows(OTHER_ISSUER)
+
+    def test_missing_or_invalid_issuer(self):
+        policy = IssuerPolicy()
+        assert policy.allows(ISSUER)
+        assert not policy.allows(None)
+        assert not policy.allows('')
+        assert not policy.allows('Issuer')
+
+    def test_invalid_names(self):
+        self.assertRaises(ValueError, IssuerPolicy, ['Issuer'])
+        self.assertRaises(ValueError, IssuerPolicy, None, ['/CN='])
+
+    def test_cache(self):
+        policy = IssuerPolicy(allowed=[ISSUER], cache_size=2)
+        for _ in range(2):
+            assert policy.allows(ISSUER)
+            assert not policy.allows(OTHER_ISSUER)
+        self.assertEqual(policy._cache, {ISSUER: True, OTHER_ISSUER: False})
+        assert policy.allows('CN=Issuer,O=Company,C=US')
+        self.assertEqual(len(policy._cache), 1)
+
+
+class TestIdentifierIssuers(TestX509Base):
+    """Unit tests for the issuer policy of X509Identifier"""
+
+    def test_allowed_issuers(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    allowed_issuers=[ISSUER],
+                                    instrumentation=stats)
+        creds = identifier.identify(self.make_environ(ISSUER, SUBJECT))
+        self.assertEqual(creds['login'], 'email@example.com')
+        assert identifier.identify(
+            self.make_environ(OTHER_ISSUER, SUBJECT)) is None
+        self.assertEqual(stats.snapshot()['counters'],
+                         {'identified': 1, 'issuer_denied': 1})
+
+    def test_denied_issuers(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    denied_issuers=[OTHER_ISSUER])
+        assert identifier.identify(self.make_environ(ISSUER, SUBJECT))
+        assert identifier.identify(
+            self.make_environ(OTHER_ISSUER, SUBJECT)) is None
+
+    def test_missing_issuer(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    denied_issuers=[OTHER_ISSUER])
+        environ = self.make_environ(ISSUER, SUBJECT)
+        del environ['SSL_CLIENT_I_DN']
+        assert identifier.identify(environ) is None
+        assert X509Identifier('SSL_CLIENT_S_DN').identify(environ)
+
+    def test_shared_identity_cache(self):
+        cache = LRUCache(10)
+        everyone = X509Identifier('SSL_CLIENT_S_DN', identity_cache=cache)
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    allowed_issuers=[ISSUER],
+                                    identity_cache=cache,
+                                    negative_cache_size=10)
+        environ = self.make_environ(OTHER_ISSUER, SUBJECT)
+        assert everyone.identify(environ) is not None
+        assert identifier.identify(environ) is None
+        assert identifier.identify(environ) is None
+
+    def test_identify_many(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    allowed_issuers=[ISSUER])
+        results = list(identifier.identify_many([
+            self.make_environ(ISSUER, SUBJECT),
+            self.make_environ(OTHER_ISSUER, SUBJECT),
+        ]))
+        self.assertEqual(results[0]['login'], 'email@example.com')
+        self.assertEqual(results[1], None)
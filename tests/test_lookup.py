@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+import unittest
+from repoze.who.plugins.x509.cache import LRUCache
+from repoze.who.plugins.x509.lookup import CachedLookup, LookupTimeout
+
+
+class Backend(object):
+    """
+    A lookup that records its calls, and may be slow or fail.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+        self.delay = 0
+        self.error = None
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, key):
+        self.calls.append(key)
+        self.release.wait(5)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.values.get(key)
+
+
+def wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestCachedLookup(unittest.TestCase):
+    """Unit tests for the cached lookups"""
+
+    def setUp(self):
+        self.now = [time.time()]
+        self.backend = Backend({'a': 1, 'b': 2})
+
+    def make_lookup(self, **kwargs):
+        kwargs.setdefault('clock', lambda: self.now[0])
+        return CachedLookup(self.backend, **kwargs)
+
+    def test_caches_results(self):
+        lookup = self.make_lookup(ttl=60, negative_ttl=5)
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(lookup('c'), None)
+        self.assertEqual(lookup('c'), None)
+        self.assertEqual(self.backend.calls, ['a', 'c'])
+        self.now[0] += 5
+        self.assertEqual(lookup('c'), None)
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(self.backend.calls, ['a', 'c', 'c'])
+        self.now[0] += 55
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(self.backend.calls, ['a', 'c', 'c', 'a'])
+        self.assertEqual(lookup.stats()['calls'], 4)
+
+    def test_prefix(self):
+        cache = LRUCache(10)
+        lookup = self.make_lookup(cache=cache, prefix='users')
+        lookup('a')
+        self.assertEqual(cache.get(('users', 'a'))[0], 1)
+
+    def test_single_flight(self):
+        self.backend.release.clear()
+        lookup = self.make_lookup()
+        results = []
+
+        def call():
+            results.append(lookup('a'))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        assert wait_until(lambda: self.backend.calls)
+        time.sleep(0.05)
+        self.backend.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(self.backend.calls, ['a'])
+
+    def test_errors_are_raised_and_not_cached(self):
+        lookup = self.make_lookup()
+        self.backend.error = KeyError('down')
+        self.assertRaises(KeyError, lookup, 'a')
+        self.backend.error = None
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(lookup.stats()['errors'], 1)
+
+    def test_counters_with_threads(self):
+        def function(key):
+            if key % 2:
+                raise KeyError(key)
+            return key
+
+        lookup = CachedLookup(function, cache_size=10000)
+
+        def call(start):
+            for key in range(start, start + 500):
+                try:
+                    lookup(key)
+                except KeyError:
+                    pass
+
+        threads = [threading.Thread(target=call, args=(n * 500,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = lookup.stats()
+        self.assertEqual((stats['calls'], stats['errors']), (4000, 2000))
+
+    def test_stale_while_revalidate(self):
+        lookup = self.make_lookup(ttl=60, stale_ttl=600)
+        self.assertEqual(lookup('a'), 1)
+        self.backend.values['a'] = 10
+        self.backend.release.clear()
+        self.now[0] += 61
+        # The stale value, without waiting for the refresh
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(lookup('a'), 1)
+        self.backend.release.set()
+        assert wait_until(lambda: lookup.cache.get('a')[0] == 10)
+        self.assertEqual(lookup('a'), 10)
+        self.assertEqual(self.backend.calls, ['a', 'a'])
+        self.assertEqual(lookup.stats()['stale'], 2)
+
+    def test_stale_while_backend_fails(self):
+        lookup = self.make_lookup(ttl=60, stale_ttl=600)
+        self.assertEqual(lookup('a'), 1)
+        self.backend.error = KeyError('down')
+        self.now[0] += 61
+        self.assertEqual(lookup('a'), 1)
+        assert wait_until(lambda: lookup.stats()['errors'] == 1)
+        self.assertEqual(lookup('a'), 1)
+        # Past the stale period
+        self.now[0] += 600
+        self.assertRaises(KeyError, lookup, 'a')
+
+    def test_deadline(self):
+        self.backend.delay = 0.3
+        lookup = self.make_lookup(deadline=0.02)
+        started = time.time()
+        self.assertRaises(LookupTimeout, lookup, 'a')
+        assert time.time() - started < 0.25
+        self.assertEqual(lookup.stats()['timeouts'], 1)
+        # The call goes on, and its result is cached
+        self.backend.delay = 0
+        assert wait_until(lambda: lookup.cache.get('a') is not None)
+        self.assertEqual(lookup('a'), 1)
+        self.assertEqual(self.backend.calls, ['a'])
+
+    def test_set_many(self):
+        lookup = self.make_lookup(ttl=60, negative_ttl=5)
+        lookup.set_many({'x': 'value', 'y': None})
+        lookup.set_many([('z', 3)])
+        self.assertEqual(lookup('x'), 'value')
+        self.assertEqual(lookup('y'), None)
+        self.assertEqual(lookup('z'), 3)
+        self.now[0] += 5
+        lookup('y')
+        self.assertEqual(self.backend.calls, ['y'])
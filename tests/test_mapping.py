@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from zope.interface.verify import verifyObject
+from repoze.who.interfaces import IAuthenticator
+from repoze.who.plugins.x509 import X509Authenticator, X509Identifier
+from repoze.who.plugins.x509.mapping import (MappingError, MappingIndex,
+                                             MmapMappingIndex, load_mapping,
+                                             mapping_key)
+from tests import TestX509Base
+
+MAPPING = '''\
+# Comments and empty lines are ignored
+
+/C=US/O=Company/CN=John Smith\tjsmith
+CN=Jane Doe,O=Company,C=US\tjdoe
+Admin@Example.com\tadmin
+/C=US/O=Company/CN=Repeated\tfirst
+/C=US/O=Company/CN=Repeated\tsecond
+'''
+
+
+class MappingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mapping')
+        self.write(MAPPING)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, content):
+        with open(self.path, 'w') as mapping:
+            mapping.write(content)
+
+
+class TestMappingIndex(MappingTestCase):
+    """Unit tests for the indexes of the mapping files"""
+
+    def check_index(self, index):
+        self.assertEqual(len(index), 4)
+        for key, userid in (('CN=John Smith,O=Company,C=US', 'jsmith'),
+                            ('/C=US/O=Company/CN=Jane Doe', 'jdoe'),
+                            ('admin@example.com', 'admin'),
+                            ('/C=US/O=Company/CN=Repeated', 'second')):
+            self.assertEqual(index.get(mapping_key(key)), userid)
+        self.assertEqual(index.get('other@example.com'), None)
+        self.assertEqual(index.get('other@example.com', 'default'), 'default')
+
+    def test_load_mapping(self):
+        index = load_mapping(self.path)
+        assert isinstance(index, MappingIndex)
+        self.check_index(index)
+
+    def test_load_mapping_with_mmap(self):
+        index = load_mapping(self.path, use_mmap=True)
+        assert isinstance(index, MmapMappingIndex)
+        self.check_index(index)
+
+    def test_mmap_index_grows(self):
+        items = [('user%d@example.com' % n, 'user%d' % n)
+                 for n in range(1000)]
+        index = MmapMappingIndex(items + [('user5@example.com', 'new')])
+        self.assertEqual(len(index), 1000)
+        for key, userid in items[6:]:
+            self.assertEqual(index.get(key), userid)
+        self.assertEqual(index.get('user5@example.com'), 'new')
+        self.assertEqual(index.get('user1000@example.com'), None)
+        self.assertEqual(len(MmapMappingIndex([])), 0)
+
+    def test_mmap_index_separators(self):
+        for item in (('key\twith tab', 'userid'), ('key', 'user\tid'),
+                     ('key\n', 'userid'), ('key', 'user\nid')):
+            self.assertRaises(ValueError, MmapMappingIndex, [item])
+
+    def test_invalid_lines(self):
+        self.write('key\t\tuserid\n')
+        self.assertEqual(load_mapping(self.path).get('key'), 'userid')
+        for content in ('no tab\n', '\tuserid\n', 'key\t\n',
+                        'CN=\tuserid\n', 'key\twith tabs\tuserid\n'):
+            self.write(content)
+            self.assertRaises(MappingError, load_mapping, self.path)
+
+
+class TestX509Authenticator(MappingTestCase, TestX509Base):
+    """Unit tests for the authenticator with mapping files"""
+
+    def test_object_conforms_to_IAuthenticator(self):
+        verifyObject(IAuthenticator, X509Authenticator(self.path))
+
+    def test_authenticate(self):
+        for use_mmap in (False, True):
+            authenticator = X509Authenticator(self.path, use_mmap=use_mmap)
+            self.assertEqual(authenticator.authenticate({}, {
+                'subject': 'CN=John Smith,O=Company,C=US',
+                'login': 'john.smith@example.com'
+            }), 'jsmith')
+            self.assertEqual(authenticator.authenticate({}, {
+                'subject': '/CN=Admin',
+                'login': ['other@example.com', 'ADMIN@example.com']
+            }), 'admin')
+            self.assertEqual(authenticator.authenticate({}, {
+                'subject': '/CN=Other',
+                'login': 'other@example.com'
+            }), None)
+            self.assertEqual(authenticator.authenticate({}, {
+                'subject': 'invalid',
+            }), None)
+
+    def test_ignores_other_identities(self):
+        authenticator = X509Authenticator(self.path)
+        self.assertEqual(authenticator.authenticate({}, {
+            'login': 'admin@example.com'
+        }), None)
+        self.assertEqual(authenticator.authenticate({}, {
+            'subject': '/CN=Admin',
+            'login': 'admin@example.com',
+            'password': 'secret'
+        }), None)
+
+    def test_with_identifier(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN')
+        authenticator = X509Authenticator(self.path)
+        environ = self.make_environ({'CN': 'Issuer'},
+                                    '/C=US/O=Company/CN=Administrator/'
+                                    'Email=admin@example.com')
+        identity = identifier.identify(environ)
+        self.assertEqual(authenticator.authenticate(environ, identity),
+                         'admin')
+
+    def test_reload(self):
+        now = [time.time()]
+        authenticator = X509Authenticator(self.path, check_interval=10,
+                                          clock=lambda: now[0],
+                                          background=False)
+        identity = {'subject': '/CN=New', 'login': 'new@example.com'}
+        self.assertEqual(authenticator.authenticate({}, identity), None)
+
+        self.write(MAPPING + 'new@example.com\tnew\n')
+        os.utime(self.path, (now[0] + 10,) * 2)
+        # Not checked yet
+        self.assertEqual(authenticator.authenticate({}, identity), None)
+        now[0] += 10
+        self.assertEqual(authenticator.authenticate({}, identity), 'new')
+        self.assertEqual(len(authenticator), 5)
+
+    def test_reload_keeps_mapping_on_errors(self):
+        authenticator = X509Authenticator(self.path, background=False)
+        self.write('invalid\n')
+        assert not authenticator.reload()
+        os.remove(self.path)
+        assert not authenticator.reload()
+        self.assertEqual(len(authenticator), 4)
+
+    def test_background_reload(self):
+        now = [time.time()]
+        authenticator = X509Authenticator(self.path, check_interval=10,
+                                          clock=lambda: now[0])
+        identity = {'subject': '/CN=New', 'login': 'new@example.com'}
+        self.write(MAPPING + 'new@example.com\tnew\n')
+        os.utime(self.path, (now[0] + 10,) * 2)
+        now[0] += 10
+        authenticator.authenticate({}, identity)
+        authenticator._reloader.join()
+        self.assertEqual(authenticator.authenticate({}, identity), 'new')
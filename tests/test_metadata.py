@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from zope.interface.verify import verifyObject
+from repoze.who.interfaces import IMetadataProvider
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.metadata import (CertificateNames,
+                                              X509MetadataProvider)
+from repoze.who.plugins.x509.utils import CachedDNParser, parse_dn
+from tests import TestX509Base
+
+SUBJECT = '/C=US/O=Company/OU=Sales/OU=Support/CN=Name/Email=name@example.com'
+ISSUER = 'CN=Issuer,O=Company,C=US'
+
+
+class CountingParser(object):
+
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, dn):
+        self.parsed.append(dn)
+        return parse_dn(dn)
+
+
+class TestCertificateNames(unittest.TestCase):
+    """Unit tests for the lazy mapping of distinguished names"""
+
+    def test_lazy_parse(self):
+        parser = CountingParser()
+        names = CertificateNames({'subject': SUBJECT, 'issuer': ISSUER},
+                                 parser)
+        self.assertEqual(parser.parsed, [])
+        self.assertEqual(names['subject']['OU'], ['Sales', 'Support'])
+        self.assertEqual(names['subject']['CN'], ['Name'])
+        self.assertEqual(parser.parsed, [SUBJECT])
+        self.assertEqual(names['issuer']['O'], ['Company'])
+        self.assertEqual(parser.parsed, [SUBJECT, ISSUER])
+        self.assertEqual(sorted(names), ['issuer', 'subject'])
+        self.assertEqual(len(names), 2)
+
+    def test_read_only(self):
+        names = CertificateNames({'subject': SUBJECT})
+
+        def assign(mapping, key):
+            mapping[key] = None
+        self.assertRaises(TypeError, assign, names, 'issuer')
+        self.assertRaises(TypeError, assign, names['subject'], 'CN')
+        self.assertRaises(KeyError, names.__getitem__, 'issuer')
+        self.assertEqual(names.get('issuer'), None)
+        assert 'subject' in names
+
+    def test_invalid_name(self):
+        names = CertificateNames({'subject': 'invalid'})
+        self.assertRaises(ValueError, names.__getitem__, 'subject')
+
+
+class TestX509MetadataProvider(TestX509Base):
+    """Unit tests for the metadata provider"""
+
+    def test_object_conforms_to_IMetadataProvider(self):
+        verifyObject(IMetadataProvider, X509MetadataProvider())
+
+    def test_add_metadata(self):
+        provider = X509MetadataProvider()
+        environ = self.make_environ(ISSUER, SUBJECT)
+        identity = {'repoze.who.userid': 'name', 'subject': SUBJECT}
+        provider.add_metadata(environ, identity)
+        names = identity['x509']
+        self.assertEqual(names['subject']['OU'], ('Sales', 'Support'))
+        self.assertEqual(names['issuer']['CN'], ('Issuer',))
+
+    def test_without_issuer(self):
+        provider = X509MetadataProvider(key='certificate')
+        identity = {'repoze.who.userid': 'name', 'subject': SUBJECT}
+        provider.add_metadata({}, identity)
+        self.assertEqual(list(identity['certificate']), ['subject'])
+
+    def test_other_identities(self):
+        identity = {'repoze.who.userid': 'name'}
+        X509MetadataProvider().add_metadata({}, identity)
+        self.assertEqual(identity, {'repoze.who.userid': 'name'})
+
+    def test_shares_dn_cache(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN', dn_cache_size=10)
+        provider = X509MetadataProvider(dn_cache=identifier.dn_cache)
+        environ = self.make_environ(ISSUER, SUBJECT)
+        identity = identifier.identify(environ)
+        identity['repoze.who.userid'] = identity['login']
+        provider.add_metadata(environ, identity)
+        misses = identifier.dn_cache.misses
+        self.assertEqual(identity['x509']['subject']['O'], ('Company',))
+        # The subject was parsed by the identifier to get the login
+        self.assertEqual(identifier.dn_cache.misses, misses)
+        self.assertEqual(identity['x509']['issuer']['O'], ('Company',))
+        self.assertEqual(identifier.dn_cache.misses, misses + 1)
+        assert isinstance(identifier.dn_cache, CachedDNParser)
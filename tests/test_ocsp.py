@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+import unittest
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509 import der
+from repoze.who.plugins.x509.ocsp import (CertificateID, OCSPChecker,
+                                          OCSPError, encode_request,
+                                          parse_response, STATUS_GOOD,
+                                          STATUS_REVOKED, STATUS_UNKNOWN)
+from tests import TestX509Base
+from tests.certificates import (ISSUER_CERTIFICATE, CLIENT_ISSUER,
+                                CLIENT_SERIAL)
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from SocketServer import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from socketserver import ThreadingMixIn
+
+_STATUS_TAGS = {STATUS_GOOD: 0x80, STATUS_REVOKED: 0xa1,
+                STATUS_UNKNOWN: 0x82}
+
+
+def generalized_time(epoch):
+    return der.encode(der.TAG_GENERALIZED_TIME, time.strftime(
+        '%Y%m%d%H%M%SZ', time.gmtime(epoch)).encode('ascii'))
+
+
+def encode_response(cert_id, status, this_update, next_update=None):
+    """
+    Returns an (unsigned) OCSP response with the status of a certificate.
+
+    :param cert_id: The DER encoding of its CertID.
+    """
+    if status == STATUS_REVOKED:
+        status = der.encode(0xa1, generalized_time(this_update))
+    else:
+        status = der.encode(_STATUS_TAGS[status])
+    single = [cert_id, status, generalized_time(this_update)]
+    if next_update is not None:
+        single.append(der.encode(der.TAG_CONTEXT_0,
+                                 generalized_time(next_update)))
+    data = der.encode(
+        der.TAG_SEQUENCE,
+        # The responder ID, by the hash of its key
+        der.encode(0xa2, der.encode(der.TAG_OCTET_STRING, b'\x00' * 20)),
+        generalized_time(this_update),
+        der.encode(der.TAG_SEQUENCE, der.encode(der.TAG_SEQUENCE, *single))
+    )
+    algorithm = der.encode(der.TAG_SEQUENCE,
+                           der.encode_oid('1.2.840.10045.4.3.2'))
+    basic = der.encode(der.TAG_SEQUENCE, data, algorithm,
+                       der.encode(0x03, b'\x00'))
+    return der.encode(
+        der.TAG_SEQUENCE,
+        der.encode(der.TAG_ENUMERATED, b'\x00'),
+        der.encode(der.TAG_CONTEXT_0, der.encode(
+            der.TAG_SEQUENCE, der.encode_oid('1.3.6.1.5.5.7.48.1.1'),
+            der.encode(der.TAG_OCTET_STRING, basic)))
+    )
+
+
+def request_cert_id(request):
+    """
+    Returns the DER encoding of the CertID of a request, and its serial.
+    """
+    data = bytearray(request)
+    start, end = der.expect(data, 0, len(data), der.TAG_SEQUENCE)
+    for _ in range(3):
+        start, end = der.expect(data, start, end, der.TAG_SEQUENCE)
+    tag, cert_start, cert_end = der.read(data, start, end)
+    serial = list(der.children(data, cert_start, cert_end))[3]
+    return (bytes(data[start:cert_end]),
+            der.parse_integer(data, serial[1], serial[2]))
+
+
+class OCSPHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in OCSP responder that answers with the statuses of the server.
+    """
+
+    def do_POST(self):
+        server = self.server
+        request = self.rfile.read(int(self.headers['Content-Length']))
+        cert_id, serial = request_cert_id(request)
+        server.requests.append(serial)
+        if server.delay:
+            time.sleep(server.delay)
+        if server.failing:
+            self.send_error(500)
+            return
+        now = time.time()
+        body = encode_response(cert_id,
+                               server.statuses.get(serial, STATUS_UNKNOWN),
+                               now, now + server.ttl)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/ocsp-response')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class OCSPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), OCSPHandler)
+        self.statuses = {}
+        self.requests = []
+        self.ttl = 3600
+        self.delay = 0
+        self.failing = False
+
+
+class TestOCSPMessages(unittest.TestCase):
+    """Unit tests for the OCSP requests and responses"""
+
+    def test_certificate_id(self):
+        issuer = CertificateID(ISSUER_CERTIFICATE)
+        self.assertEqual(issuer.name, CLIENT_ISSUER)
+        self.assertEqual(len(issuer.name_hash), 20)
+        self.assertEqual(len(issuer.key_hash), 20)
+        self.assertEqual(CertificateID(der.pem_to_der(ISSUER_CERTIFICATE))
+                         .key(CLIENT_SERIAL), issuer.key(CLIENT_SERIAL))
+
+    def test_request_and_response(self):
+        issuer = CertificateID(ISSUER_CERTIFICATE)
+        cert_id, serial = request_cert_id(encode_request(issuer,
+                                                         CLIENT_SERIAL))
+        self.assertEqual(serial, CLIENT_SERIAL)
+        response = parse_response(encode_response(
+            cert_id, STATUS_REVOKED, 1356998400, 1357084800))
+        self.assertEqual(response, [{
+            'name_hash': issuer.name_hash,
+            'key_hash': issuer.key_hash,
+            'serial': CLIENT_SERIAL,
+            'status': STATUS_REVOKED,
+            'this_update': 1356998400,
+            'next_update': 1357084800,
+        }])
+        response = parse_response(encode_response(cert_id, STATUS_GOOD,
+                                                  1356998400))
+        self.assertEqual(response[0]['status'], STATUS_GOOD)
+        self.assertEqual(response[0]['next_update'], None)
+
+    def test_unsuccessful_response(self):
+        # tryLater
+        response = der.encode(der.TAG_SEQUENCE,
+                              der.encode(der.TAG_ENUMERATED, b'\x03'))
+        self.assertRaises(OCSPError, parse_response, response)
+        self.assertRaises(der.DERError, parse_response, b'\x30\x03\x0a')
+
+
+class TestOCSPChecker(TestX509Base):
+    """Unit tests for the OCSP checker"""
+
+    def setUp(self):
+        self.server = OCSPServer()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_checker(self, **kwargs):
+        kwargs.setdefault('deadline', 2)
+        kwargs.setdefault('trusted_transport', True)
+        return OCSPChecker(self.url, [ISSUER_CERTIFICATE], **kwargs)
+
+    def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                break
+            time.sleep(0.01)
+        assert condition()
+
+    def test_statuses(self):
+        self.server.statuses = {CLIENT_SERIAL: STATUS_REVOKED,
+                                0x2000: STATUS_GOOD}
+        checker = self.make_checker()
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        assert checker.is_revoked(CLIENT_ISSUER, '10:00')
+        assert not checker.is_revoked(CLIENT_ISSUER, 0x2000)
+        # Unknown to the responder
+        assert not checker.is_revoked(CLIENT_ISSUER, 0x3000)
+        assert self.make_checker(strict=True).is_revoked(CLIENT_ISSUER,
+                                                         0x3000)
+        # The responses are cached
+        self.assertEqual(self.server.requests,
+                         [CLIENT_SERIAL, 0x2000, 0x3000, 0x3000])
+
+    def test_unknown_issuer(self):
+        checker = self.make_checker()
+        assert not checker.is_revoked('/CN=Other', CLIENT_SERIAL)
+        assert not checker.is_revoked(CLIENT_ISSUER, 'serial')
+        assert not checker.is_revoked(None, None)
+        strict = self.make_checker(strict=True)
+        assert strict.is_revoked('/CN=Other', CLIENT_SERIAL)
+        assert strict.is_revoked(CLIENT_ISSUER, 'serial')
+        self.assertEqual(self.server.requests, [])
+
+    def test_refresh_before_next_update(self):
+        now = [time.time()]
+        self.server.statuses = {CLIENT_SERIAL: STATUS_GOOD}
+        self.server.ttl = 600
+        checker = self.make_checker(refresh_before=60,
+                                    clock=lambda: now[0])
+        assert not checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+
+        # Within refresh_before: the cached status is used, and a request is
+        # sent in the background
+        self.server.statuses = {CLIENT_SERIAL: STATUS_REVOKED}
+        now[0] += 570
+        assert not checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        for _ in range(200):
+            if checker.cache.get(CertificateID(ISSUER_CERTIFICATE).key(
+                    CLIENT_SERIAL))[0] == STATUS_REVOKED:
+                break
+            time.sleep(0.01)
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_stale_if_error(self):
+        now = [time.time()]
+        self.server.statuses = {CLIENT_SERIAL: STATUS_REVOKED}
+        self.server.ttl = 600
+        checker = self.make_checker(refresh_before=0, stale_if_error=300,
+                                    strict=True, clock=lambda: now[0])
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+
+        self.server.statuses = {CLIENT_SERIAL: STATUS_GOOD}
+        self.server.failing = True
+        self.server.delay = 0.5
+        now[0] += 700
+        # Past its nextUpdate: it is used without waiting for the responder,
+        # which fails
+        started = time.time()
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        assert time.time() - started < 0.4
+        self.assertEqual(checker.stats()['stale'], 1)
+        self.wait_for(lambda: checker.stats()['errors'] == 1)
+
+        self.server.failing = False
+        self.server.delay = 0
+        self.server.ttl = 1800
+        self.wait_for(
+            lambda: not checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL))
+        self.assertEqual(checker.stats()['errors'], 1)
+
+    def test_deadline(self):
+        self.server.statuses = {CLIENT_SERIAL: STATUS_REVOKED}
+        self.server.delay = 0.5
+        checker = self.make_checker(deadline=0.05, strict=False)
+        started = time.time()
+        assert not checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        assert time.time() - started < 0.4
+        self.assertEqual(checker.stats()['timeouts'], 1)
+        # The response is cached when it comes
+        for _ in range(200):
+            if checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL):
+                break
+            time.sleep(0.01)
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        self.assertEqual(self.server.requests, [CLIENT_SERIAL])
+
+    def test_unreachable_responder(self):
+        checker = OCSPChecker('http://127.0.0.1:1/', [ISSUER_CERTIFICATE],
+                              strict=True, trusted_transport=True)
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        self.assertEqual(checker.stats()['errors'], 1)
+
+    def test_https_required(self):
+        self.assertRaises(ValueError, OCSPChecker, self.url,
+                          [ISSUER_CERTIFICATE])
+        checker = OCSPChecker('HTTPS://ocsp.example.com/',
+                              [ISSUER_CERTIFICATE])
+        assert not checker.trusted_transport
+
+    def test_identifier(self):
+        self.server.statuses = {CLIENT_SERIAL: STATUS_REVOKED}
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    revocation=self.make_checker())
+        environ = self.make_environ(CLIENT_ISSUER,
+                                    '/C=US/CN=Name/Email=email@example.com')
+        environ['SSL_CLIENT_M_SERIAL'] = '1000'
+        assert identifier.identify(environ) is None
+        environ['SSL_CLIENT_M_SERIAL'] = '1001'
+        creds = identifier.identify(environ)
+        self.assertEqual(creds['login'], 'email@example.com')
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from repoze.who.plugins.x509.policy import (CertificatePolicy, compile_rules,
+                                            PolicyError)
+from repoze.who.plugins.x509.utils import CachedDNParser, format_openssl_date
+
+NOW = 1300000000
+DAY = 86400
+SUBJECT = ('/C=US/O=Company/OU=Sales/OU=Support/CN=Name'
+           '/emailAddress=name@example.com')
+ISSUER = 'CN=Issuer,O=Example Corp,C=US'
+
+
+def make_environ(subject=SUBJECT, issuer=ISSUER, start=NOW - 30 * DAY,
+                 end=NOW + 30 * DAY, path='/', verify='SUCCESS'):
+    environ = {'SSL_CLIENT_S_DN': subject, 'SSL_CLIENT_I_DN': issuer,
+               'SSL_CLIENT_VERIFY': verify, 'PATH_INFO': path}
+    for key, value in [('SSL_CLIENT_V_START', start),
+                       ('SSL_CLIENT_V_END', end)]:
+        if isinstance(value, int):
+            value = format_openssl_date(value)
+        if value is not None:
+            environ[key] = value
+    return environ
+
+
+class TestCompileRules(unittest.TestCase):
+    """Unit tests for the compilation of the rules"""
+
+    def test_time_bounds(self):
+        checks, expires_above, expires_below, issued_above, issued_below = \
+            compile_rules(['expires > 7d', 'expires > 2w', 'expires < 90d',
+                           ('issued', '>', 3600)])
+        self.assertEqual(checks, ())
+        self.assertEqual(expires_above, 14 * DAY)
+        self.assertEqual(expires_below, 90 * DAY)
+        self.assertEqual(issued_above, 3600)
+        self.assertEqual(issued_below, None)
+
+    def test_invalid_rules(self):
+        for rule in ['subject.OU', 'subject.OU ~ Sales', 'subject.OU =',
+                     'subject.OU in Sales,', 'serial = 1', 'expires = 7d',
+                     'expires > 7 days', 'subject = Name',
+                     ('subject.OU', '<', 'Sales'), ('subject.OU', 'in', ()),
+                     ('subject.OU', 'in')]:
+            self.assertRaises(PolicyError, compile_rules, [rule])
+
+    def test_policy_error(self):
+        assert issubclass(PolicyError, ValueError)
+
+
+class TestCertificatePolicy(unittest.TestCase):
+    """Unit tests for the certificate policies"""
+
+    def make_policy(self, rules=(), routes=(), **kwargs):
+        self.now = NOW
+        return CertificatePolicy(rules, routes, clock=lambda: self.now,
+                                 **kwargs)
+
+    def test_dn_rules(self):
+        accepted = [
+            'issuer.O = Example Corp',
+            'issuer.organizationName = example corp',
+            'subject.OU = Support',
+            'subject.OU in Marketing, Sales',
+            'subject.Email = NAME@example.com',
+            'subject.OU != Marketing',
+            'subject.OU not in Marketing, Legal',
+            'subject.L not in Boston',
+            ('subject.CN', 'in', ['Name, Jr.', 'Name']),
+        ]
+        rejected = [
+            'issuer.O = Company',
+            'subject.OU in Marketing, Legal',
+            'subject.OU != Sales',
+            'subject.OU not in Sales, Legal',
+            'subject.L = Boston',
+            ('subject.CN', 'in', ['Name, Jr.']),
+        ]
+        for rule in accepted:
+            policy = self.make_policy([rule])
+            assert policy.allows(make_environ()), rule
+        for rule in rejected:
+            policy = self.make_policy([rule])
+            assert not policy.allows(make_environ()), rule
+
+    def test_all_rules(self):
+        policy = self.make_policy(['issuer.O = Example Corp',
+                                   'subject.OU in Sales, Marketing',
+                                   'subject.CN = Other'])
+        assert not policy.allows(make_environ())
+
+    def test_missing_or_invalid_dn(self):
+        for rule in ['issuer.O != Evil', 'issuer.O not in Evil']:
+            policy = self.make_policy([rule])
+            assert policy.allows(make_environ()), rule
+            assert not policy.allows(make_environ(issuer=None)), rule
+            assert not policy.allows(make_environ(issuer='invalid')), rule
+        policy = self.make_policy()
+        assert policy.allows(make_environ(issuer=None))
+        assert not policy.allows(make_environ(subject=None))
+
+    def test_verification(self):
+        policy = self.make_policy(['issuer.O = Example Corp'])
+        environ = make_environ()
+        assert policy.allows(environ)
+        for verify in ['FAILED:unable to get issuer certificate', 'NONE',
+                       None]:
+            environ['SSL_CLIENT_VERIFY'] = verify
+            assert not policy.allows(environ), verify
+        del environ['SSL_CLIENT_VERIFY']
+        assert not policy.allows(environ)
+        assert not self.make_policy().allows(make_environ(verify='FAILED'))
+
+    def test_expires(self):
+        policy = self.make_policy(['expires > 7d'])
+        environ = make_environ(end=NOW + 8 * DAY)
+        assert policy.allows(environ)
+        self.now = NOW + DAY - 1
+        assert policy.allows(environ)
+        self.now = NOW + DAY
+        assert not policy.allows(environ)
+        assert not policy.allows(make_environ(end=None))
+        assert not policy.allows(make_environ(end='invalid'))
+
+        policy = self.make_policy(['expires < 7d'])
+        assert not policy.allows(environ)
+        self.now = NOW + DAY + 1
+        assert policy.allows(environ)
+
+    def test_issued(self):
+        policy = self.make_policy(['issued > 1h', 'issued < 1d'])
+        environ = make_environ(start=NOW - 3600)
+        assert not policy.allows(environ)
+        self.now += 1
+        assert policy.allows(environ)
+        self.now = NOW - 3600 + DAY
+        assert not policy.allows(environ)
+        assert not policy.allows(make_environ(start=None))
+
+    def test_routes(self):
+        policy = self.make_policy(
+            ['issuer.O = Example Corp'],
+            [('/admin', ['subject.OU = Admins']),
+             ('/admin/reports/', ['subject.OU = Sales', 'expires > 7d']),
+             ('/sales', [])])
+        environ = make_environ()
+        for path, accepted in [('/', True), ('/admin', False),
+                               ('/admin/users', False),
+                               ('/admin/reports', True),
+                               ('/admin/reports/1', True),
+                               ('/administrator', True), ('/sales', True)]:
+            self.assertEqual(policy.allows(environ, path), accepted, path)
+            environ['PATH_INFO'] = path
+            self.assertEqual(policy.allows(environ), accepted, path)
+
+        environ = make_environ(issuer='CN=Other,O=Other')
+        assert not policy.allows(environ, '/')
+        # The rules of a route replace the others
+        assert policy.allows(environ, '/admin/reports')
+        assert policy.allows(environ, '/sales')
+
+        policy = self.make_policy(routes=[('/', ['subject.OU = Admins'])])
+        assert not policy.allows(make_environ(), '/sales')
+
+    def test_cache(self):
+        dn_cache = CachedDNParser(10)
+        policy = self.make_policy(['issuer.O = Example Corp'],
+                                  [('/sales', ['subject.OU = Sales'])],
+                                  dn_cache=dn_cache)
+        environ = make_environ()
+        assert policy.allows(environ)
+        assert policy.allows(environ, '/sales')
+        assert policy.allows(make_environ(), '/sales')
+        self.assertEqual(dn_cache.misses, 2)
+        self.assertEqual(dn_cache.hits, 0)
+        stats = policy.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertEqual(len(policy.decisions(environ)), 2)
+
+        # The subject is parsed once for any number of policies
+        other = self.make_policy(['subject.OU = Sales'], dn_cache=dn_cache)
+        assert other.allows(environ)
+        self.assertEqual(dn_cache.misses, 2)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import unittest
+from StringIO import StringIO
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.replay import LogReader, main, percentile, replay
+
+
+DN = '/C=MX/O=Ckluster/CN=Arturo Sevilla/Email=arturo@ckluster.com'
+START = 'Jan  1 00:00:00 2012 GMT'
+END = 'Jan  1 00:00:00 2030 GMT'
+NOW = 'Jun  1 00:00:00 2013 GMT'
+
+
+def log_line(dn=DN, verify='SUCCESS', start=START, end=END):
+    return ('10.0.0.1 - - [01/Jun/2013:00:00:00 -0500] "GET / HTTP/1.1" 200 '
+            '512 "%s" "%s" "%s" "%s"\n' % (dn, verify, start, end))
+
+
+class TestLogReader(unittest.TestCase):
+    """Unit tests for reading access logs"""
+
+    def test_default_fields(self):
+        environ = LogReader().environ(log_line())
+        self.assertEqual(environ, {
+            'SSL_CLIENT_S_DN': DN,
+            'SSL_CLIENT_VERIFY': 'SUCCESS',
+            'SSL_CLIENT_V_START': START,
+            'SSL_CLIENT_V_END': END
+        })
+
+    def test_unset_values(self):
+        environ = LogReader().environ(log_line(dn='-', verify='NONE',
+                                               start='', end=''))
+        self.assertEqual(environ, {'SSL_CLIENT_VERIFY': 'NONE'})
+
+    def test_escaped_values(self):
+        line = log_line(dn='/CN=Arturo \\"El\\" Sevilla/O=A\\x2cB')
+        environ = LogReader().environ(line)
+        self.assertEqual(environ['SSL_CLIENT_S_DN'],
+                         '/CN=Arturo "El" Sevilla/O=A,B')
+
+    def test_pattern(self):
+        reader = LogReader(pattern=r'dn=(?P<SSL_CLIENT_S_DN>\S+)')
+        self.assertEqual(reader.environ('x dn=/CN=a y'),
+                         {'SSL_CLIENT_S_DN': '/CN=a'})
+        self.assertEqual(reader.environ('x y'), None)
+
+    def test_unparsed_lines(self):
+        reader = LogReader()
+        environs = list(reader.read([log_line(), 'garbage\n', log_line()]))
+        self.assertEqual(len(environs), 2)
+        self.assertEqual(reader.unparsed, 1)
+
+
+class TestReplay(unittest.TestCase):
+    """Unit tests for replaying environments through the identifier"""
+
+    def _environs(self, count):
+        reader = LogReader()
+        return reader.read([log_line()] * count)
+
+    def _identifier(self):
+        return X509Identifier('SSL_CLIENT_S_DN', clock=lambda: 1370044800)
+
+    def test_replay(self):
+        result = replay(self._identifier(), self._environs(10))
+        self.assertEqual(result['requests'], 10)
+        self.assertEqual(len(result['sample']), 10)
+        self.assertEqual(result['sample'], sorted(result['sample']))
+
+    def test_batch(self):
+        result = replay(self._identifier(), self._environs(10), batch=True)
+        self.assertEqual(result['requests'], 10)
+
+    def test_sample_is_bounded(self):
+        result = replay(self._identifier(), self._environs(50), sample_size=5)
+        self.assertEqual(result['requests'], 50)
+        self.assertEqual(len(result['sample']), 5)
+
+    def test_percentile(self):
+        sample = range(101)
+        self.assertEqual(percentile(sample, 50), 50)
+        self.assertEqual(percentile(sample, 99), 99)
+        self.assertEqual(percentile([], 50), None)
+
+
+class TestMain(unittest.TestCase):
+    """Unit tests for the x509-replay console script"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as log:
+            log.write(log_line() * 3)
+            log.write(log_line(verify='FAILED:unable to verify'))
+            log.write(log_line(end='Jan  1 00:00:00 2013 GMT'))
+            log.write('garbage\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _run(self, *args):
+        out = StringIO()
+        self.assertEqual(main(list(args) + [self.path], out), 0)
+        return out.getvalue()
+
+    def test_report(self):
+        report = self._run('--now', NOW, '--stats')
+        self.assertTrue('requests:    5 (1 unparsed lines)' in report)
+        self.assertTrue('identified' in report)
+        lines = dict(line.split(None, 1) for line in report.splitlines()
+                     if line.startswith('  '))
+        self.assertEqual(lines['identified'].split()[0], '3')
+        self.assertEqual(lines['verify_failed'].split()[0], '1')
+        self.assertEqual(lines['expired'].split()[0], '1')
+        self.assertTrue('p99.9' in lines)
+        self.assertTrue('max' in lines)
+
+    def test_without_stats(self):
+        report = self._run('--now', NOW)
+        self.assertTrue('requests:    5 (1 unparsed lines)' in report)
+        self.assertFalse('outcomes:' in report)
+        self.assertTrue('latency (us):' in report)
+
+    def test_batch_and_caches(self):
+        report = self._run('--now', '1370044800', '--batch',
+                           '--identity-cache-size', '10')
+        self.assertTrue('requests:    5' in report)
+
+    def test_invalid_now(self):
+        self.assertRaises(SystemExit, self._run, '--now', 'yesterday')
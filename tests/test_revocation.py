@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from repoze.who.plugins.x509 import X509Identifier
+from repoze.who.plugins.x509.der import DERError, parse_crl, pem_to_der
+from repoze.who.plugins.x509.instrumentation import Instrumentation
+from repoze.who.plugins.x509.revocation import (RevocationChecker,
+                                                SerialIndex, load_crl,
+                                                _issuer_key)
+from tests import TestX509Base
+from tests.certificates import (CRL, CRL_NUMBER, CRL_NEXT_UPDATE,
+                                CRL_UPDATE, CLIENT_ISSUER, CLIENT_SERIAL)
+
+BIG_SERIAL = 0x0123456789ABCDEF0123456789ABCDEF01
+
+
+class TestSerialIndex(unittest.TestCase):
+    """Unit tests for the index of serial numbers"""
+
+    def test_lookups(self):
+        serials = [5, 1, 2 ** 64 - 1, 2 ** 64, BIG_SERIAL, 3, -7]
+        index = SerialIndex(iter(serials))
+        self.assertEqual(len(index), len(serials))
+        for serial in serials:
+            assert serial in index
+        for serial in (0, 2, 4, 6, 2 ** 63, 2 ** 64 + 1, BIG_SERIAL + 1,
+                       1 << 200, -1):
+            assert serial not in index
+
+    def test_empty(self):
+        index = SerialIndex([])
+        self.assertEqual(len(index), 0)
+        assert 1 not in index
+        assert BIG_SERIAL not in index
+
+    def test_many(self):
+        index = SerialIndex(range(0, 200000, 2))
+        assert 100000 in index
+        assert 100001 not in index
+
+
+class TestCRL(unittest.TestCase):
+    """Unit tests for reading the CRLs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as crl_file:
+            crl_file.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_parse_crl(self):
+        crl = parse_crl(pem_to_der(CRL, 'X509 CRL'))
+        self.assertEqual(crl['issuer'], CLIENT_ISSUER)
+        self.assertEqual(crl['number'], CRL_NUMBER)
+        self.assertEqual(crl['next_update'], CRL_NEXT_UPDATE)
+        self.assertEqual(list(crl['serials']), [CLIENT_SERIAL, BIG_SERIAL])
+
+    def test_load_pem_and_der(self):
+        for path in (self.write('crl.pem', CRL.encode('ascii')),
+                     self.write('crl.der', pem_to_der(CRL, 'X509 CRL'))):
+            crl = load_crl(path)
+            self.assertEqual(crl.number, CRL_NUMBER)
+            assert CLIENT_SERIAL in crl.index
+
+    def test_invalid_file(self):
+        path = self.write('crl.der', b'garbage')
+        self.assertRaises(DERError, load_crl, path)
+
+    def make_checker(self, now, **kwargs):
+        kwargs.setdefault('background', False)
+        return RevocationChecker([self.path], check_interval=10,
+                                 clock=lambda: now[0], **kwargs)
+
+    def test_is_revoked(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'))
+        checker = self.make_checker([1000])
+        assert checker.is_revoked(CLIENT_ISSUER, '1000')
+        assert checker.is_revoked(CLIENT_ISSUER, CLIENT_SERIAL)
+        assert checker.is_revoked('CN=Issuer,O=Company,C=US', '10:00')
+        assert checker.is_revoked(CLIENT_ISSUER, '%X' % BIG_SERIAL)
+        assert not checker.is_revoked(CLIENT_ISSUER, '1001')
+        assert not checker.is_revoked('/CN=Other', '1000')
+        # Any spelling of the issuer
+        assert checker.is_revoked('/c=us/organizationName=COMPANY/CN=Issuer',
+                                  '1000')
+        assert not checker.is_revoked(CLIENT_ISSUER, None)
+        assert not checker.is_revoked(CLIENT_ISSUER, 'not hex')
+        self.assertEqual(checker.stats(), [{
+            'path': self.path, 'number': CRL_NUMBER,
+            'next_update': CRL_NEXT_UPDATE, 'revoked': 2
+        }])
+
+    def test_issuer_key(self):
+        issuer = u'/C=MX/O=Compa\xf1\xeda/CN=Emisor'
+        self.assertEqual(_issuer_key(issuer.encode('utf-8')),
+                         _issuer_key(issuer))
+        self.assertEqual(_issuer_key(u'CN=emisor,O=COMPA\xd1\xcdA,C=mx'),
+                         _issuer_key(issuer))
+        self.assertRaises(ValueError, _issuer_key, b'/CN=\xff')
+
+    def test_strict(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'))
+        now = [1000]
+        checker = self.make_checker(now, strict=True)
+        assert not checker.is_revoked(CLIENT_ISSUER, '1001')
+        assert checker.is_revoked('/CN=Other', '1000')
+        assert checker.is_revoked(CLIENT_ISSUER, None)
+        now[0] = CRL_NEXT_UPDATE + 1
+        assert checker.is_revoked(CLIENT_ISSUER, '1001')
+
+    def test_reload(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'), 1000)
+        now = [1000]
+        checker = self.make_checker(now)
+        assert not checker.is_revoked(CLIENT_ISSUER, '2000')
+        self.write('crl.pem', CRL_UPDATE.encode('ascii'), 2000)
+        # It is not checked until the interval passes
+        assert not checker.is_revoked(CLIENT_ISSUER, '2000')
+        now[0] = 1010
+        assert checker.is_revoked(CLIENT_ISSUER, '2000')
+        self.assertEqual(checker.stats()[0]['number'], CRL_NUMBER + 1)
+
+    def test_reload_keeps_index_of_same_number(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'), 1000)
+        checker = self.make_checker([1000])
+        self.assertEqual(checker.reload(), 0)
+        index = checker._files[self.path].index
+        self.write('crl.der', b'')
+        self.write('crl.pem', pem_to_der(CRL, 'X509 CRL'), 2000)
+        self.assertEqual(checker.reload(), 1)
+        assert checker._files[self.path].index is index
+
+    def test_reload_keeps_previous_crl_on_errors(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'), 1000)
+        checker = self.make_checker([1000])
+        self.write('crl.pem', b'-----BEGIN X509 CRL-----', 2000)
+        self.assertEqual(checker.reload(), 0)
+        assert checker.is_revoked(CLIENT_ISSUER, '1000')
+
+    def test_background_reload(self):
+        self.path = self.write('crl.pem', CRL.encode('ascii'), 1000)
+        now = [1000]
+        checker = self.make_checker(now, background=True)
+        self.write('crl.pem', CRL_UPDATE.encode('ascii'), 2000)
+        now[0] = 1010
+        checker.is_revoked(CLIENT_ISSUER, '2000')
+        checker._reloader.join()
+        assert checker.is_revoked(CLIENT_ISSUER, '2000')
+
+
+class TestIdentifierRevocation(TestX509Base):
+    """Unit tests for the revocation checks of the identifier"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'crl.pem')
+        with open(path, 'w') as crl_file:
+            crl_file.write(CRL)
+        self.checker = RevocationChecker([path], background=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_environ(self, serial):
+        environ = TestX509Base.make_environ(
+            self, CLIENT_ISSUER, '/C=US/CN=Name/Email=email@example.com')
+        environ['SSL_CLIENT_M_SERIAL'] = serial
+        return environ
+
+    def test_revoked(self):
+        stats = Instrumentation()
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    revocation=self.checker,
+                                    instrumentation=stats)
+        assert identifier.identify(self.make_environ('1000')) is None
+        creds = identifier.identify(self.make_environ('1001'))
+        self.assertEqual(creds['login'], 'email@example.com')
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['counters'], {'revoked': 1,
+                                                'identified': 1})
+        self.assertEqual(snapshot['timings']['revocation']['count'], 2)
+
+    def test_revoked_with_identity_cache(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    revocation=self.checker,
+                                    identity_cache_size=10)
+        environ = self.make_environ('2000')
+        assert identifier.identify(environ) is not None
+        # The CRL is updated while the identity is cached
+        with open(self.checker.paths[0], 'w') as crl_file:
+            crl_file.write(CRL_UPDATE)
+        os.utime(self.checker.paths[0], (time.time() + 10,) * 2)
+        self.checker.reload()
+        assert identifier.identify(environ) is None
+
+    def test_identify_many(self):
+        identifier = X509Identifier('SSL_CLIENT_S_DN',
+                                    revocation=self.checker)
+        creds = list(identifier.identify_many([self.make_environ('1000'),
+                                               self.make_environ('1001')]))
+        assert creds[0] is None
+        assert creds[1] is not None
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from zope.interface.verify import verifyObject
+from repoze.who.interfaces import IAuthenticator
+from repoze.who.plugins.x509.sql import (ConnectionPool, PoolTimeout,
+                                         SQLAuthenticator)
+
+SUBJECT = '/C=US/O=Company/CN=John Smith/Email=john.smith@example.com'
+QUERY = 'SELECT userid FROM certificates WHERE subject = ?'
+LOGIN_QUERY = 'SELECT userid FROM certificates WHERE email = ?'
+PREWARM_QUERY = 'SELECT subject, userid FROM certificates'
+
+
+class DatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'users.db')
+        self.connections = []
+        connection = self.connect()
+        connection.execute('CREATE TABLE certificates (subject TEXT, '
+                           'email TEXT, userid TEXT)')
+        connection.executemany('INSERT INTO certificates VALUES (?, ?, ?)', [
+            (SUBJECT, 'john.smith@example.com', 'jsmith'),
+            ('/C=US/O=Company/CN=Jane Doe', 'jane.doe@example.com', 'jdoe'),
+        ])
+        connection.commit()
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connections.append(connection)
+        return connection
+
+
+class TestConnectionPool(DatabaseTestCase):
+    """Unit tests for the pool of connections"""
+
+    def test_reuses_connections(self):
+        pool = ConnectionPool(self.connect, size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        assert first is not second
+        pool.release(first)
+        assert pool.acquire() is first
+        self.assertEqual(len(self.connections), 3)
+
+    def test_timeout(self):
+        pool = ConnectionPool(self.connect, size=1, timeout=0.01)
+        connection = pool.acquire()
+        self.assertRaises(PoolTimeout, pool.acquire)
+        pool.release(connection)
+        assert pool.acquire() is connection
+
+    def test_waits_for_release(self):
+        pool = ConnectionPool(self.connect, size=1, timeout=5)
+        connection = pool.acquire()
+        timer = threading.Timer(0.05, pool.release, (connection,))
+        timer.start()
+        assert pool.acquire() is connection
+        timer.join()
+
+    def test_keeps_waiting_after_wakeup(self):
+        pool = ConnectionPool(self.connect, size=1, timeout=5)
+        connection = pool.acquire()
+
+        def wake_up():
+            with pool._condition:
+                pool._condition.notify_all()
+
+        woken = threading.Timer(0.02, wake_up)
+        released = threading.Timer(0.1, pool.release, (connection,))
+        woken.start()
+        released.start()
+        # A wakeup without an idle connection is not a timeout
+        assert pool.acquire() is connection
+        woken.join()
+        released.join()
+
+    def test_broken_connection(self):
+        pool = ConnectionPool(self.connect, size=1, timeout=0.01)
+        connection = pool.acquire()
+        pool.release(connection, broken=True)
+        assert pool.acquire() is not connection
+
+    def test_connect_error(self):
+        def connect():
+            raise sqlite3.OperationalError('unable to open database')
+
+        pool = ConnectionPool(connect, size=1, timeout=0.01)
+        self.assertRaises(sqlite3.OperationalError, pool.acquire)
+        # The failed connection does not count
+        self.assertRaises(sqlite3.OperationalError, pool.acquire)
+
+
+class TestSQLAuthenticator(DatabaseTestCase):
+    """Unit tests for the SQL authenticator"""
+
+    def make_authenticator(self, **kwargs):
+        kwargs.setdefault('query', QUERY)
+        return SQLAuthenticator(self.connect, **kwargs)
+
+    def test_object_conforms_to_IAuthenticator(self):
+        verifyObject(IAuthenticator, self.make_authenticator())
+
+    def test_authenticate(self):
+        authenticator = self.make_authenticator()
+        identity = {'subject': SUBJECT, 'login': 'john.smith@example.com'}
+        self.assertEqual(authenticator.authenticate({}, identity), 'jsmith')
+        self.assertEqual(authenticator.authenticate({}, identity), 'jsmith')
+        self.assertEqual(authenticator.authenticate({}, {'subject': '/CN=x'}),
+                         None)
+        self.assertEqual(authenticator.authenticate({}, {'subject': '/CN=x'}),
+                         None)
+        stats = authenticator.stats()
+        self.assertEqual((stats['queries'], stats['errors'], stats['hits'],
+                          stats['misses']), (2, 0, 2, 2))
+
+    def test_rollback_before_release(self):
+        rollbacks = []
+
+        class Connection(object):
+            def __init__(self, connection, failing):
+                self.connection = connection
+                self.failing = failing
+
+            def cursor(self):
+                return self.connection.cursor()
+
+            def rollback(self):
+                rollbacks.append(self)
+                if self.failing:
+                    raise sqlite3.OperationalError('connection lost')
+                self.connection.rollback()
+
+            def close(self):
+                self.connection.close()
+
+        failing = [True]
+
+        def connect():
+            return Connection(self.connect(), failing.pop() if failing
+                              else False)
+
+        authenticator = SQLAuthenticator(connect, QUERY, pool_size=1)
+        identity = {'subject': SUBJECT}
+        # The result is used, but the connection that cannot be rolled back
+        # is discarded
+        self.assertEqual(authenticator.authenticate({}, identity), 'jsmith')
+        self.assertEqual(authenticator.pool._idle, [])
+        self.assertEqual(authenticator.authenticate({}, {'subject': '/CN=x'}),
+                         None)
+        self.assertEqual(len(rollbacks), 2)
+        assert rollbacks[0] is not rollbacks[1]
+        self.assertEqual(authenticator.pool._idle, [rollbacks[1]])
+
+    def test_login_key(self):
+        authenticator = self.make_authenticator(query=LOGIN_QUERY,
+                                                key='login')
+        self.assertEqual(authenticator.authenticate({}, {
+            'subject': '/CN=Jane',
+            'login': ['other@example.com', 'jane.doe@example.com']
+        }), 'jdoe')
+        self.assertEqual(authenticator.authenticate({}, {'subject': '/CN=x'}),
+                         None)
+        self.assertRaises(ValueError, self.make_authenticator, key='CN')
+
+    def test_ignores_other_identities(self):
+        authenticator = self.make_authenticator(query=LOGIN_QUERY,
+                                                key='login')
+        self.assertEqual(authenticator.authenticate({}, {
+            'login': 'jane.doe@example.com', 'password': 'secret'
+        }), None)
+        self.assertEqual(authenticator.queries, 0)
+
+    def test_cache_expires(self):
+        now = [time.time()]
+        authenticator = self.make_authenticator(cache_ttl=60,
+                                                negative_cache_ttl=5,
+                                                clock=lambda: now[0])
+        identity = {'subject': '/CN=New'}
+        self.assertEqual(authenticator.authenticate({}, identity), None)
+        connection = self.connect()
+        connection.execute("INSERT INTO certificates VALUES "
+                           "('/CN=New', NULL, 'new')")
+        connection.commit()
+        self.assertEqual(authenticator.authenticate({}, identity), None)
+        now[0] += 5
+        self.assertEqual(authenticator.authenticate({}, identity), 'new')
+        self.assertEqual(authenticator.queries, 2)
+
+    def test_database_error(self):
+        authenticator = self.make_authenticator(
+            query='SELECT userid FROM missing WHERE subject = ?')
+        self.assertEqual(authenticator.authenticate({}, {'subject': SUBJECT}),
+                         None)
+        # The errors are not cached
+        self.assertEqual(authenticator.authenticate({}, {'subject': SUBJECT}),
+                         None)
+        self.assertEqual(authenticator.stats()['errors'], 2)
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        connect = self.connect
+
+        class SlowConnection(object):
+            def __init__(self):
+                self.connection = connect()
+
+            def cursor(self):
+                started.set()
+                release.wait(5)
+                return self.connection.cursor()
+
+        authenticator = SQLAuthenticator(SlowConnection, QUERY)
+        results = []
+
+        def authenticate():
+            results.append(authenticator.authenticate({}, {
+                'subject': SUBJECT}))
+
+        threads = [threading.Thread(target=authenticate) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['jsmith'] * 5)
+        self.assertEqual(authenticator.queries, 1)
+
+    def test_prewarm(self):
+        authenticator = self.make_authenticator(prewarm_query=PREWARM_QUERY)
+        self.assertEqual(authenticator.prewarm(), 2)
+        self.assertEqual(authenticator.authenticate({}, {
+            'subject': '/C=US/O=Company/CN=Jane Doe'}), 'jdoe')
+        self.assertEqual(authenticator.queries, 1)
+        self.assertEqual(self.make_authenticator().prewarm(), 0)
+
+    def test_deadline(self):
+        release = threading.Event()
+        connect = self.connect
+
+        class SlowConnection(object):
+            def __init__(self):
+                self.connection = connect()
+
+            def cursor(self):
+                release.wait(5)
+                return self.connection.cursor()
+
+        authenticator = SQLAuthenticator(SlowConnection, QUERY,
+                                         deadline=0.01)
+        identity = {'subject': SUBJECT}
+        self.assertEqual(authenticator.authenticate({}, identity), None)
+        self.assertEqual(authenticator.stats()['timeouts'], 1)
+        release.set()
+        for _ in range(500):
+            if authenticator.authenticate({}, identity) is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(authenticator.authenticate({}, identity), 'jsmith')
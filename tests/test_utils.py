@@ -214,3 +214,232 @@ class TestUtils(TestX509Base):
             'SSL_CLIENT_V_END'
         )
 
+
+    def test_cached_parser_returns_same_result(self):
+        parser = CachedDNParser(10)
+        dn = '/C=MX/CN=name/Email=one@example.com/Email=two@example.com'
+        parsed = parser(dn)
+        self.assertEqual(parsed, dict((k, tuple(v))
+                                      for k, v in parse_dn(dn).items()))
+        assert parser(dn) is parsed
+        self.assertEqual(parser.hits, 1)
+        self.assertEqual(parser.misses, 1)
+
+    def test_cached_parser_result_is_immutable(self):
+        parser = CachedDNParser(10)
+        parsed = parser('/C=MX/CN=name')
+        self.assertRaises(TypeError, parsed.__setitem__, 'C', ['US'])
+        self.assertRaises(TypeError, parsed.__delitem__, 'C')
+        self.assertRaises(TypeError, parsed.update, {'C': ['US']})
+        self.assertRaises(TypeError, parsed.pop, 'C')
+        self.assertRaises(TypeError, parsed.clear)
+        assert isinstance(parsed['C'], tuple)
+        self.assertEqual(parser('/C=MX/CN=name')['C'], ('MX',))
+
+    def test_cached_parser_evicts_entries(self):
+        parser = CachedDNParser(1)
+        parser('/C=MX')
+        parser('/C=US')
+        parser('/C=MX')
+        self.assertEqual(parser.misses, 3)
+        self.assertEqual(parser.stats()['size'], 1)
+
+    def test_cached_parser_invalid_dn(self):
+        parser = CachedDNParser(10)
+        self.assertRaises(ValueError, parser, '')
+        self.assertRaises(ValueError, parser, '/C=MX/CN=')
+        self.assertEqual(parser.stats()['size'], 0)
+
+    def test_parse_openssl_date(self):
+        parsed = parse_openssl_date('Jan  2 15:04:05 2012 GMT')
+        self.assertEqual(parsed, datetime(2012, 1, 2, 15, 4, 5,
+                                          tzinfo=tzutc()))
+        assert parsed.tzinfo == tzutc()
+
+        parsed = parse_openssl_date('Dec 31 23:59:59 2030 UTC')
+        self.assertEqual(parsed, datetime(2030, 12, 31, 23, 59, 59,
+                                          tzinfo=tzutc()))
+
+    def test_parse_openssl_date_fallback(self):
+        parsed = parse_openssl_date('2012-01-02T15:04:05Z')
+        self.assertEqual(parsed, datetime(2012, 1, 2, 15, 4, 5,
+                                          tzinfo=tzutc()))
+
+        parsed = parse_openssl_date('Jan  2 15:04:05 2012')
+        assert parsed.tzinfo is None
+
+    def test_openssl_date_to_epoch(self):
+        self.assertEqual(openssl_date_to_epoch('Jan  1 00:00:00 1970 GMT'), 0)
+        self.assertEqual(openssl_date_to_epoch('Jan  2 15:04:05 2012 GMT'),
+                         1325516645)
+        self.assertEqual(openssl_date_to_epoch('2012-01-02T15:04:05Z'),
+                         1325516645)
+        self.assertEqual(openssl_date_to_epoch('2012-01-02T15:04:05+00:00'),
+                         1325516645)
+        self.assertRaises(ValueError, openssl_date_to_epoch,
+                          'Jan  2 15:04:05 2012')
+        self.assertRaises(ValueError, openssl_date_to_epoch,
+                          '2012-01-02T15:04:05+01:00')
+        self.assertRaises(ValueError, openssl_date_to_epoch,
+                          'Foo  2 15:04:05 2012 GMT')
+
+    def test_format_openssl_date(self):
+        self.assertEqual(format_openssl_date(1325516645),
+                         'Jan  2 15:04:05 2012 GMT')
+        self.assertEqual(format_openssl_date(1893455999),
+                         'Dec 31 23:59:59 2029 GMT')
+        self.assertEqual(openssl_date_to_epoch(format_openssl_date(0)), 0)
+
+    def test_multi_valued_rdn(self):
+        parsed = parse_dn('/C=MX/O=company+CN=name/OU=unit unit+unit')
+        self.assertEqual(parsed['C'], ['MX'])
+        self.assertEqual(parsed['O'], ['company'])
+        self.assertEqual(parsed['CN'], ['name'])
+        self.assertEqual(parsed['OU'], ['unit unit+unit'])
+
+    def test_rfc4514_distinguished_name_parse(self):
+        parsed = parse_dn('CN=common name,OU=unit,OU=other unit,O=organization,'
+                          'L=locality,ST=state,C=co')
+        self.assertEqual(parsed['CN'], ['common name'])
+        self.assertEqual(parsed['OU'], ['unit', 'other unit'])
+        self.assertEqual(parsed['O'], ['organization'])
+        self.assertEqual(parsed['L'], ['locality'])
+        self.assertEqual(parsed['ST'], ['state'])
+        self.assertEqual(parsed['C'], ['co'])
+
+    def test_rfc4514_with_spaces(self):
+        parsed = parse_dn('C = MX, O = Organ.\\, data ; CN = name ')
+        self.assertEqual(parsed['C'], ['MX'])
+        self.assertEqual(parsed['O'], ['Organ., data'])
+        self.assertEqual(parsed['CN'], ['name'])
+
+    def test_rfc4514_multi_valued_rdn(self):
+        parsed = parse_dn('CN=name+UID=1234,O=company')
+        self.assertEqual(parsed['CN'], ['name'])
+        self.assertEqual(parsed['UID'], ['1234'])
+        self.assertEqual(parsed['O'], ['company'])
+
+    def test_rfc4514_escapes(self):
+        parsed = parse_dn('CN=James \\"Jim\\" Smith\\, III,O=a\\+b\\=c,'
+                          'L=\\ lead and trail\\ ,OU=back\\\\slash')
+        self.assertEqual(parsed['CN'], ['James "Jim" Smith, III'])
+        self.assertEqual(parsed['O'], ['a+b=c'])
+        self.assertEqual(parsed['L'], [' lead and trail '])
+        self.assertEqual(parsed['OU'], ['back\\slash'])
+
+    def test_rfc4514_hex_escapes(self):
+        parsed = parse_dn(u'CN=Ren\\C3\\A9,O=\\2Cstart')
+        self.assertEqual(parsed['CN'], [u'Ren\xe9'])
+        self.assertEqual(parsed['O'], [u',start'])
+
+        parsed = parse_dn('CN=Ren\\C3\\A9')
+        self.assertEqual(parsed['CN'], ['Ren\xc3\xa9'])
+
+    def test_rfc4514_quoted_value(self):
+        parsed = parse_dn('CN="Smith, John+Jr",O=company')
+        self.assertEqual(parsed['CN'], ['Smith, John+Jr'])
+        self.assertEqual(parsed['O'], ['company'])
+
+    def test_rfc4514_invalid(self):
+        for dn in ('CN=', 'CN=name,', 'CN=name,O=', '=name', 'CN="name',
+                   'CN="name" x', 'CN=na"me', 'CN=name\\', ' '):
+            self.assertRaises(ValueError, parse_dn, dn)
+
+    def test_iter_dn(self):
+        self.assertEqual(list(iter_dn('/C=MX/O=company+CN=name/C=US')),
+                         [('C', 'MX'), ('O', 'company'), ('CN', 'name'),
+                          ('C', 'US')])
+        self.assertEqual(list(iter_dn('CN=name+O=company,C=MX')),
+                         [('CN', 'name'), ('O', 'company'), ('C', 'MX')])
+        self.assertEqual(list(iter_dn('CN=a\\,b,C=MX')),
+                         [('CN', 'a,b'), ('C', 'MX')])
+
+    def test_iter_dn_is_lazy(self):
+        pairs = iter_dn('/C=MX/CN=')
+        self.assertEqual(next(pairs), ('C', 'MX'))
+        self.assertRaises(ValueError, next, pairs)
+
+        pairs = iter_dn('C=MX,CN=')
+        self.assertEqual(next(pairs), ('C', 'MX'))
+        self.assertRaises(ValueError, next, pairs)
+
+    def test_iter_dn_invalid(self):
+        for dn in ('', '/Casdf', 'I am a regular string', 'CN="name'):
+            self.assertRaises(ValueError, list, iter_dn(dn))
+
+    def test_normalize_dn(self):
+        expected = (('c', 'us'), ('o', 'company inc.'), ('cn', 'issuer'),
+                    ('email', 'ca@example.com'))
+        for dn in ('/C=US/O=Company Inc./CN=Issuer/'
+                   'emailAddress=ca@example.com',
+                   '/c=us/O=COMPANY  Inc./CN=issuer/Email=CA@example.com',
+                   'emailAddress=ca@example.com,CN=Issuer,O=Company Inc.,C=US',
+                   'E=ca@example.com, CN = Issuer, O="Company Inc.", C=US'):
+            self.assertEqual(normalize_dn(dn), expected)
+        self.assertNotEqual(normalize_dn('/C=US/O=Company/CN=Issuer'),
+                            normalize_dn('/C=US/CN=Issuer/O=Company'))
+        self.assertRaises(ValueError, normalize_dn, 'Issuer')
+
+    def test_normalize_dn_multi_valued_rdn(self):
+        expected = (('c', 'us'), ('o', 'x'), ('+ou', 'y'), ('cn', 'a'))
+        for dn in ('/C=US/O=x+OU=y/CN=a', '/C=US/OU=y+O=x/CN=a',
+                   'CN=a,O=x+OU=y,C=US', 'CN=a,OU=y+O=x,C=US',
+                   'CN=a,O=x + OU="y",C=US', 'CN=a;OU=y+O=x;C=US'):
+            self.assertEqual(normalize_dn(dn), expected, dn)
+        # Not the same name as separate RDNs
+        self.assertNotEqual(normalize_dn('/C=US/O=x/OU=y/CN=a'), expected)
+
+    def test_find_dn_attribute(self):
+        for dn in ('/Email=one@example.com/CN=name/Email=two@example.com',
+                   'Email=one@example.com,CN=name,Email=two@example.com',
+                   'Email=one@example.com,CN=na\\,me,Email=two@example.com'):
+            self.assertEqual(find_dn_attribute(dn, 'Email'),
+                             ['one@example.com', 'two@example.com'])
+            self.assertEqual(find_dn_attribute(dn, 'Email', first_only=True),
+                             'one@example.com')
+            self.assertEqual(find_dn_attribute(dn, 'O'), [])
+            assert find_dn_attribute(dn, 'O', first_only=True) is None
+
+    def test_find_dn_attribute_first_only_stops(self):
+        self.assertEqual(find_dn_attribute('/CN=name/C=', 'CN',
+                                           first_only=True), 'name')
+        self.assertRaises(ValueError, find_dn_attribute, '/CN=name/C=', 'CN')
+
+    def test_check_certificate(self):
+        keys = ('SSL_CLIENT_VERIFY', 'SSL_CLIENT_V_START', 'SSL_CLIENT_V_END')
+        environ = self.make_environ('/C=MX', '/C=MX')
+        self.assertEqual(check_certificate(environ, *keys), CERTIFICATE_VALID)
+
+        environ = self.make_environ('/C=MX', '/C=MX', verified=False)
+        self.assertEqual(check_certificate(environ, *keys),
+                         CERTIFICATE_NOT_VERIFIED)
+
+        end = datetime.utcnow() + relativedelta(days=-5)
+        environ = self.make_environ('/C=MX', '/C=MX',
+                                    end=end.replace(tzinfo=tzutc()))
+        self.assertEqual(check_certificate(environ, *keys),
+                         CERTIFICATE_EXPIRED)
+
+        environ = self.make_environ('/C=MX', '/C=MX',
+                                    start=datetime.utcnow(), end=end)
+        self.assertEqual(check_certificate(environ, *keys),
+                         CERTIFICATE_INVALID_DATES)
+
+    def test_verify_certificate_with_clock(self):
+        environ = self.make_environ('/C=MX', '/C=MX')
+        environ['SSL_CLIENT_V_START'] = 'Jan  1 00:00:00 2012 GMT'
+        environ['SSL_CLIENT_V_END'] = 'Jan  1 00:00:00 2013 GMT'
+        keys = ('SSL_CLIENT_VERIFY', 'SSL_CLIENT_V_START', 'SSL_CLIENT_V_END')
+        start, end = 1325376000, 1356998400
+        assert verify_certificate(environ, *keys, clock=lambda: start)
+        assert verify_certificate(environ, *keys, clock=lambda: end)
+        assert not verify_certificate(environ, *keys, clock=lambda: start - 1)
+        assert not verify_certificate(environ, *keys, clock=lambda: end + 0.5)
+
+    def test_check_certificate_with_unparseable_dates(self):
+        environ = self.make_environ('/C=MX', '/C=MX')
+        environ['SSL_CLIENT_V_END'] = 'not a date'
+        self.assertEqual(check_certificate(environ, 'SSL_CLIENT_VERIFY',
+                                           'SSL_CLIENT_V_START',
+                                           'SSL_CLIENT_V_END'),
+                         CERTIFICATE_INVALID_DATES)